@@ -1,42 +1,822 @@
+import atexit
+import base64
+import click
+import contextlib
+import contextvars
 import datetime
+import functools
 import hashlib
-from flask import Flask, jsonify, request
+import hmac
+import logging
+import logging.handlers
+from flask import Flask, Response, g, has_request_context, jsonify, make_response, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import traceback
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
 from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, jwt_required
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from dotenv import load_dotenv
-import google.generativeai as genai
-from PIL import Image
 import os
 import re
 import json
+import socket
 import io
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from apscheduler.schedulers.background import BackgroundScheduler
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
 from bson import ObjectId
 
-# from sklearn.feature_extraction.text import TfidfVectorizer
-# from sklearn.metrics.pairwise import cosine_similarity
-
 load_dotenv()
 
+# json ---------------------
+# responses are encoded by a provider that understands mongo types, so documents go to jsonify as
+# pymongo returns them: ObjectIds become their hex string and datetimes keep Flask's HTTP date
+# format. orjson is used when it is installed (JSON_USE_ORJSON=0 turns it off); the json module
+# fallback writes the same compact, unescaped UTF-8 that orjson does.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def mongo_json_default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    return DefaultJSONProvider.default(o)
+
+class MongoJSONProvider(DefaultJSONProvider):
+    default = staticmethod(mongo_json_default)
+    use_orjson = orjson is not None and os.getenv('JSON_USE_ORJSON', '1') != '0'
+    ensure_ascii = False
+
+    def dumps(self, obj, **kwargs):
+        # jsonify only passes indent or separators; anything else goes to the json module
+        if self.use_orjson and set(kwargs) <= {'indent', 'separators'}:
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if kwargs.get('indent'):
+                option |= orjson.OPT_INDENT_2
+            return orjson.dumps(obj, default=mongo_json_default, option=option).decode('utf-8')
+        if not kwargs.get('indent'):
+            kwargs.setdefault('separators', (',', ':'))
+        return super().dumps(obj, **kwargs)
+
 app = Flask(__name__)
-CORS(app)
+app.json = MongoJSONProvider(app)
+CORS(app, expose_headers=['X-Next-Cursor'])
 jwt = JWTManager(app)
 
 # JWT Configuration
 app.config['JWT_SECRET_KEY'] = "Raju bhai"
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = datetime.timedelta(days=1)
 
-
-client = MongoClient(os.getenv('MONGO_URI'))
-db = client['dev']
-
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# logging ---------------------
+# records are handed to a queue and written by a background thread, so logging never blocks a
+# request on stdout. Below WARNING only LOG_SAMPLE_RATE of the records are kept. Importing the app
+# starts no thread: the first request (or job worker) starts the listener, and records logged before
+# that wait in the queue.
+class SampledFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, _log_handler)
+_log_listener_lock = threading.Lock()
+_log_listener_started = False
+
+@app.before_request
+def start_log_listener():
+    global _log_listener_started
+    if _log_listener_started:
+        return
+    with _log_listener_lock:
+        if not _log_listener_started:
+            log_listener.start()
+            # writes out what is left in the queue
+            atexit.register(log_listener.stop)
+            _log_listener_started = True
+
+logger = logging.getLogger('drip_advisor')
+logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+logger.addFilter(SampledFilter(float(os.getenv('LOG_SAMPLE_RATE', 1.0))))
+logger.propagate = False
+
+# instrumentation ---------------------
+# every mongo command, Gemini call and outbound HTTP call is recorded as a span on the current
+# request (a contextvar, so threads started with the request's context report into it too) and in
+# process wide metrics, served in the Prometheus text format on /metrics. Each response carries a
+# Server-Timing header with the time spent per kind of call.
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 2))
+
+class Metrics:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0}
+            for position, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][position] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in self._histograms.items())
+        lines = []
+        described = set()
+        for (name, labels), value in counters:
+            if name not in described and name in self._help:
+                lines += [f'# HELP {name} {self._help[name]}', f'# TYPE {name} counter']
+                described.add(name)
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            if name not in described and name in self._help:
+                lines += [f'# HELP {name} {self._help[name]}', f'# TYPE {name} histogram']
+                described.add(name)
+            for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {histogram["count"]}')
+            lines.append(f'{name}_sum{self._labels(labels)} {histogram["sum"]:.6f}')
+            lines.append(f'{name}_count{self._labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('http_request_duration_seconds', 'Time spent handling a request, by route, method and status.')
+metrics.describe('mongo_command_duration_seconds', 'MongoDB command latency, by command and collection.')
+metrics.describe('mongo_command_failures_total', 'Failed MongoDB commands.')
+metrics.describe('gemini_call_duration_seconds', 'Gemini call latency including retries, by model and operation.')
+metrics.describe('gemini_call_failures_total', 'Gemini calls that raised.')
+metrics.describe('gemini_tokens_total', 'Tokens reported by Gemini, by model and type (prompt or completion).')
+metrics.describe('http_client_duration_seconds', 'Outbound HTTP call latency, by host, method and status.')
+metrics.describe('http_client_failures_total', 'Outbound HTTP calls that raised.')
+metrics.describe('prompts_total', 'Prompts built for Gemini, by route.')
+metrics.describe('prompt_tokens_total', 'Estimated tokens of the prompts built for Gemini, by route and part (system, profile, preferences, wardrobe, request).')
+metrics.describe('outfit_cache_requests_total', 'Outfit cache lookups, by result (memory_hits, db_hits, misses, or fresh when the request skipped the cache).')
+metrics.describe('jobs_enqueued_total', 'Requests queued as jobs, by kind and whether an identical active job was reused.')
+
+SPAN_METRICS = {'mongo': 'mongo_command', 'gemini': 'gemini_call', 'http': 'http_client'}
+
+# spans of the request being handled, summed per kind
+class RequestTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds, tokens=0):
+        with self._lock:
+            total = self.totals.setdefault(kind, {'seconds': 0.0, 'count': 0, 'tokens': 0})
+            total['seconds'] += seconds
+            total['count'] += 1
+            total['tokens'] += tokens
+
+    # mongo;dur=3.1;desc="4 calls", gemini;dur=812.0;desc="1 call, 1520 tokens", ..., total;dur=830.4
+    def server_timing(self):
+        with self._lock:
+            totals = {kind: dict(total) for kind, total in self.totals.items()}
+        entries = []
+        for kind, total in totals.items():
+            desc = f"{total['count']} call{'s' if total['count'] != 1 else ''}"
+            if total['tokens']:
+                desc += f", {total['tokens']} tokens"
+            entries.append(f'{kind};dur={total["seconds"] * 1000:.1f};desc="{desc}"')
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def record_span(kind, seconds, labels, failed=False, tokens=0):
+    prefix = SPAN_METRICS[kind]
+    metrics.observe(f'{prefix}_duration_seconds', seconds, labels)
+    if failed:
+        metrics.inc(f'{prefix}_failures_total', labels)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(kind, seconds, tokens)
+
+# times the block as a span; the block can add labels and token counts to the yielded dict
+@contextlib.contextmanager
+def traced(kind, **labels):
+    span = {'labels': labels, 'tokens': 0}
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield span
+    except Exception:
+        failed = True
+        raise
+    finally:
+        record_span(kind, time.perf_counter() - started, span['labels'], failed, span['tokens'])
+
+# pymongo reports each command on the thread that runs it, so spans land on the right request
+class MongoCommandTracer(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get('collection', '')
+        with self._lock:
+            self._collections[event.request_id] = collection
+
+    def _finish(self, event, failed):
+        with self._lock:
+            collection = self._collections.pop(event.request_id, '')
+        record_span('mongo', event.duration_micros / 1e6, {'command': event.command_name, 'collection': collection}, failed)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+@app.before_request
+def start_request_trace():
+    current_trace.set(RequestTrace())
+
+@app.after_request
+def finish_request_trace(response):
+    trace = current_trace.get()
+    if trace is None:
+        return response
+    seconds = time.perf_counter() - trace.started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('http_request_duration_seconds', seconds, {'route': route, 'method': request.method, 'status': str(response.status_code)})
+    response.headers['Server-Timing'] = trace.server_timing()
+    if seconds >= SLOW_REQUEST_SECONDS:
+        logger.warning('slow request %s %s %d in %.0f ms (%s)', request.method, request.path, response.status_code, seconds * 1000, response.headers['Server-Timing'])
+    else:
+        logger.info('%s %s %d in %.1f ms', request.method, request.path, response.status_code, seconds * 1000)
+    return response
+
+@app.teardown_request
+def reset_request_trace(error=None):
+    current_trace.set(None)
+
+# for operational routes: the request must carry `Authorization: Bearer <token>`, the token being the
+# value of the environment variable `name`. While it is not set the route answers 404.
+def bearer_token_required(name):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = os.getenv(name)
+            if not token:
+                return jsonify({'error': 'Not found'}), 404
+            if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+                return jsonify({'error': 'Invalid or missing token'}), 401
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.route('/metrics', methods=['GET'])
+@bearer_token_required('METRICS_TOKEN')
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# lazy startup ---------------------
+# a cold start only imports what every route needs. The Gemini SDK, PIL and numpy are imported on
+# first use, and the mongo client and Gemini SDK are set up once per process and reused by every
+# warm invocation after that.
+
+# wraps a no-argument factory so it runs once, on the first call; later calls return its result.
+# A factory that raises runs again on the next call; cache_clear() forgets the result.
+def once(factory):
+    lock = threading.Lock()
+    result = []
+
+    def get():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(factory())
+        return result[0]
+    get.cache_clear = result.clear
+    return get
+
+# connect=False leaves connecting to the first command
+@once
+def mongo_client():
+    return MongoClient(os.getenv('MONGO_URI'), connect=False, event_listeners=[MongoCommandTracer()])
+
+# stands in for the Database, creating the client the first time a collection is used
+class LazyDatabase:
+    def __init__(self, name):
+        self._name = name
+        self._database = None
+
+    def _get(self):
+        if self._database is None:
+            self._database = mongo_client()[self._name]
+        return self._database
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __getitem__(self, name):
+        return self._get()[name]
+
+db = LazyDatabase('dev')
+
+# GEMINI_API_ENDPOINT points the SDK at another server (e.g. a local fake, http://127.0.0.1:8080) over REST
+@once
+def gemini_sdk():
+    import google.generativeai as genai
+    if os.getenv('GEMINI_API_ENDPOINT'):
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"), transport='rest', client_options={'api_endpoint': os.getenv('GEMINI_API_ENDPOINT')})
+    else:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai
+
+# caching helpers ---------------------
+# bounded in-process LRU with optional per-entry TTL, safe to share between worker threads. With
+# max_bytes, size(value) gives each entry's size and the oldest entries are evicted until the total fits.
+class LRUCache:
+    def __init__(self, max_size, ttl=None, max_bytes=None, size=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._size = size or (lambda value: 0)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        size = self._size(value)
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (value, expires_at, size)
+            self.bytes += size
+            while self._data and (len(self._data) > self.max_size or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+            if self.max_bytes is not None:
+                stats.update(bytes=self.bytes, max_bytes=self.max_bytes)
+            return stats
+
+# gemini client ---------------------
+GEMINI_MODEL = "models/gemini-1.5-flash"
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', "models/text-embedding-004")
+
+class GeminiUnavailable(Exception):
+    pass
+
+class GeminiTimeout(GeminiUnavailable):
+    pass
+
+# shared access to Gemini: reused model instances, a cap on concurrent calls, a deadline per
+# call, jittered exponential backoff on 429/5xx and a circuit breaker that fails fast while
+# Gemini keeps erroring
+class GeminiClient:
+    RETRYABLE_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_concurrency=8, timeout=30.0, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 breaker_threshold=5, breaker_cooldown=30.0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._models = {}
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    def model(self, model_name=GEMINI_MODEL, system_instruction=None):
+        key = (model_name, system_instruction)
+        with self._lock:
+            if key not in self._models:
+                if system_instruction:
+                    self._models[key] = gemini_sdk().GenerativeModel(model_name=model_name, system_instruction=system_instruction)
+                else:
+                    self._models[key] = gemini_sdk().GenerativeModel(model_name=model_name)
+            return self._models[key]
+
+    def is_retryable(self, error):
+        from google.api_core import exceptions as google_exceptions
+        if isinstance(error, google_exceptions.GoogleAPICallError):
+            return error.code in self.RETRYABLE_CODES
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    # after the cooldown the breaker lets calls through again; one more failure re-opens it
+    def _check_breaker(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.breaker_cooldown:
+                raise GeminiUnavailable('Gemini is temporarily unavailable, please try again shortly')
+            self._opened_at = None
+            self._consecutive_failures = self.breaker_threshold - 1
+
+    def _record_result(self, failed):
+        with self._lock:
+            if not failed:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.breaker_threshold:
+                self._opened_at = time.monotonic()
+
+    # run fn(remaining_seconds) under the concurrency limit, deadline, retry policy and breaker
+    def call(self, fn, timeout=None):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._check_breaker()
+        if not self._semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise GeminiTimeout('Timed out waiting for a free Gemini slot')
+        try:
+            attempt = 0
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._record_result(failed=True)
+                    raise GeminiTimeout('Gemini call exceeded its deadline')
+                try:
+                    result = fn(remaining)
+                except Exception as e:
+                    if not self.is_retryable(e):
+                        raise
+                    if attempt >= self.max_retries:
+                        self._record_result(failed=True)
+                        raise GeminiUnavailable(f'Gemini call failed after {attempt + 1} attempts: {e}') from e
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+                    attempt += 1
+                    continue
+                self._record_result(failed=False)
+                return result
+        finally:
+            self._semaphore.release()
+
+    # retries are ours, the SDK's default retry policy would ignore the deadline
+    def generate_content(self, contents, model_name=GEMINI_MODEL, timeout=None, system_instruction=None, **kwargs):
+        model = self.model(model_name, system_instruction)
+        with traced('gemini', model=model_name, operation='generate') as span:
+            response = self.call(lambda remaining: model.generate_content(contents, request_options={'timeout': remaining, 'retry': None}, **kwargs), timeout)
+            self._count_tokens(model_name, response, span)
+            return response
+
+    # yields the answer's text as it is generated. The deadline, retries and breaker cover opening the
+    # stream (the SDK reads the first chunk before returning); an error after that reaches the caller
+    def stream_content(self, contents, model_name=GEMINI_MODEL, timeout=None, system_instruction=None, **kwargs):
+        model = self.model(model_name, system_instruction)
+        with traced('gemini', model=model_name, operation='stream') as span:
+            response = self.call(lambda remaining: model.generate_content(contents, stream=True, request_options={'timeout': remaining, 'retry': None}, **kwargs), timeout)
+            for chunk in response:
+                yield ''.join(part.text for candidate in chunk.candidates[:1] for part in candidate.content.parts)
+            self._count_tokens(model_name, response, span)
+
+    def _count_tokens(self, model_name, response, span):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            for token_type, count in (('prompt', usage.prompt_token_count), ('completion', usage.candidates_token_count)):
+                metrics.inc('gemini_tokens_total', {'model': model_name, 'type': token_type}, count)
+                span['tokens'] += count
+
+    # content can be a string or a list of strings (batched), returns one vector or a list of vectors
+    def embed_content(self, content, task_type, model_name=None, timeout=None):
+        model_name = model_name or EMBEDDING_MODEL
+        with traced('gemini', model=model_name, operation='embed'):
+            result = self.call(lambda remaining: gemini_sdk().embed_content(model=model_name, content=content, task_type=task_type, request_options={'timeout': remaining, 'retry': None}), timeout)
+        return result['embedding']
+
+    # asyncio variant; the blocking SDK call runs on a worker thread so the event loop stays free
+    async def generate_content_async(self, contents, model_name=GEMINI_MODEL, timeout=None, **kwargs):
+        import asyncio
+        return await asyncio.to_thread(self.generate_content, contents, model_name=model_name, timeout=timeout, **kwargs)
+
+gemini_client = GeminiClient(
+    max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', 8)),
+    timeout=float(os.getenv('GEMINI_TIMEOUT_SECONDS', 30)),
+    max_retries=int(os.getenv('GEMINI_MAX_RETRIES', 3)),
+    breaker_threshold=int(os.getenv('GEMINI_BREAKER_THRESHOLD', 5)),
+    breaker_cooldown=float(os.getenv('GEMINI_BREAKER_COOLDOWN_SECONDS', 30)),
+)
+
+# indexes ---------------------
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv('IMAGE_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+# finished jobs are kept this long for polling
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', 24 * 3600))
+
+# every index the routes rely on, per collection; creating an existing index is a no-op
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], unique=True),
+    ],
+    'clothing_items': [
+        # available items for outfit generation, sorted by frequency
+        IndexModel([('user_id', ASCENDING), ('available', ASCENDING), ('frequency', ASCENDING)]),
+        # wardrobe pagination
+        IndexModel([('user_id', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)]),
+        # laundry sweep, and items whose laundry timeout passed before the sweep
+        IndexModel([('available_at', ASCENDING)]),
+        # outfit candidates that suit the temperature, and wardrobe filters by category and warmth
+        IndexModel([('user_id', ASCENDING), ('category', ASCENDING), ('warmth', ASCENDING)]),
+    ],
+    'outfits': [
+        # outfit pages, newest first, and the retention window
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ],
+    'outfits_archive': [
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ],
+    'jobs': [
+        # one queued or running job per identical request; finished jobs drop active_key
+        IndexModel([('active_key', ASCENDING)], unique=True, sparse=True),
+        # claiming the oldest queued job, or one whose lease ran out
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('lease_expires_at', ASCENDING)]),
+        IndexModel([('finished_at', ASCENDING)], expireAfterSeconds=JOB_TTL_SECONDS),
+    ],
+    'image_descriptions': [
+        IndexModel([('created_at', ASCENDING)], expireAfterSeconds=IMAGE_CACHE_TTL_SECONDS),
+    ],
+    'weather_summaries': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+    'outfit_results': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+def ensure_indexes():
+    for collection, indexes in INDEXES.items():
+        db[collection].create_indexes(indexes)
+
+# signup relies on the unique users.email index to reject duplicates, so it is created before the
+# first insert of each process even when the index bootstrap is off or has not finished
+@once
+def ensure_users_index():
+    db.users.create_indexes(INDEXES['users'])
+
+# (name, collection, filter, sort) for the query shape of each route
+def route_query_shapes():
+    user_id = ObjectId()
+    return [
+        ('signup/login/profile', 'users', {'email': 'user@example.com'}, None),
+        ('wardrobe', 'clothing_items', {'user_id': user_id}, [('created_at', ASCENDING), ('_id', ASCENDING)]),
+        ('wardrobe filtered', 'clothing_items', {'user_id': user_id, 'available': False, 'frequency': {'$lte': 3}}, [('created_at', ASCENDING), ('_id', ASCENDING)]),
+        ('available items', 'clothing_items', {'user_id': user_id, '$or': [{'available': True}, {'available_at': {'$lte': utc_now()}}]}, None),
+        ('wardrobe by category', 'clothing_items', {'user_id': user_id, 'category': {'$in': ['shirt', 'pants']}, 'warmth': {'$gte': 3}}, None),
+        ('laundry sweep', 'clothing_items', {'available_at': {'$lte': utc_now()}}, None),
+        ('clothing item', 'clothing_items', {'_id': ObjectId(), 'user_id': user_id}, None),
+        ('outfits', 'outfits', {'user_id': user_id}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+        ('archived outfits', 'outfits_archive', {'user_id': user_id}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+        ('outfit', 'outfits', {'_id': ObjectId(), 'user_id': user_id}, None),
+        ('active job', 'jobs', {'active_key': 'key'}, None),
+        ('queued jobs', 'jobs', {'status': 'queued'}, [('created_at', ASCENDING)]),
+        ('expired job leases', 'jobs', {'status': 'running', 'lease_expires_at': {'$lte': utc_now()}}, None),
+        ('job', 'jobs', {'_id': ObjectId(), 'user_id': user_id}, None),
+    ]
+
+def plan_stages(plan):
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+# explain every route query shape and return the ones whose winning plan is a COLLSCAN
+def find_collection_scans():
+    failures = []
+    for name, collection, query, sort in route_query_shapes():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+        if 'COLLSCAN' in stages:
+            failures.append((name, stages))
+    return failures
+
+@app.cli.command('ensure-indexes')
+@click.option('--check', is_flag=True, help='Fail if any route query still does a collection scan.')
+def ensure_indexes_command(check):
+    ensure_indexes()
+    click.echo('Indexes are up to date')
+    if check:
+        failures = find_collection_scans()
+        for name, stages in failures:
+            click.echo(f'COLLSCAN: {name} ({" -> ".join(stages)})', err=True)
+        if failures:
+            raise SystemExit(1)
+        click.echo('No route query does a collection scan')
+
+# create the indexes once per process, in a background thread started by the first request, so no
+# request waits for them. A failed attempt is retried by a later request after a backoff that doubles
+# up to INDEX_BOOTSTRAP_MAX_RETRY_SECONDS. Off by default on Vercel, where cold starts should not pay
+# for it and `flask ensure-indexes` runs at deploy time instead (ENSURE_INDEXES_ON_STARTUP=0/1 overrides).
+ENSURE_INDEXES_ON_STARTUP = os.getenv('ENSURE_INDEXES_ON_STARTUP', '0' if os.getenv('VERCEL') else '1') == '1'
+INDEX_BOOTSTRAP_RETRY_SECONDS = float(os.getenv('INDEX_BOOTSTRAP_RETRY_SECONDS', 30))
+INDEX_BOOTSTRAP_MAX_RETRY_SECONDS = float(os.getenv('INDEX_BOOTSTRAP_MAX_RETRY_SECONDS', 600))
+_index_bootstrap = {'ready': not ENSURE_INDEXES_ON_STARTUP, 'running': False, 'failures': 0, 'next_attempt': 0.0}
+_index_bootstrap_lock = threading.Lock()
+
+def run_index_bootstrap():
+    try:
+        ensure_indexes()
+    except Exception:
+        logger.exception('creating indexes failed')
+        with _index_bootstrap_lock:
+            _index_bootstrap['failures'] += 1
+            delay = INDEX_BOOTSTRAP_RETRY_SECONDS * 2 ** (_index_bootstrap['failures'] - 1)
+            _index_bootstrap['next_attempt'] = time.monotonic() + min(delay, INDEX_BOOTSTRAP_MAX_RETRY_SECONDS)
+            _index_bootstrap['running'] = False
+    else:
+        with _index_bootstrap_lock:
+            _index_bootstrap['ready'] = True
+            _index_bootstrap['running'] = False
+
+@app.before_request
+def bootstrap_indexes():
+    if _index_bootstrap['ready']:
+        return
+    with _index_bootstrap_lock:
+        if _index_bootstrap['ready'] or _index_bootstrap['running'] or time.monotonic() < _index_bootstrap['next_attempt']:
+            return
+        _index_bootstrap['running'] = True
+    threading.Thread(target=run_index_bootstrap, name='index-bootstrap', daemon=True).start()
+
+# current user ---------------------
+# user documents are cached briefly per process; routes that change a user invalidate their entry
+USER_CACHE_TTL_SECONDS = int(os.getenv('USER_CACHE_TTL_SECONDS', 30))
+user_cache = LRUCache(max_size=int(os.getenv('USER_CACHE_MAX_ENTRIES', 1024)), ttl=USER_CACHE_TTL_SECONDS)
+
+# the logged in user's document, resolved at most once per request
+def get_current_user():
+    if 'current_user' not in g:
+        email = get_jwt_identity()
+        user = user_cache.get(email)
+        if user is None:
+            user = db.users.find_one({'email': email})
+            if user:
+                user_cache.set(email, user)
+        g.current_user = user
+    return g.current_user
+
+# the logged in user's _id, resolved through the cached user so a deleted account's token stops working
+def get_current_user_id():
+    user = get_current_user()
+    return user['_id'] if user else None
+
+def invalidate_cached_user(email):
+    user_cache.delete(email)
+    g.pop('current_user', None)
+
+# response caching ---------------------
+# every user has a version in user_versions that write routes bump after they change the user's items
+# or outfits. Wardrobe and outfit reads derive a strong ETag from it, answer If-None-Match with a 304
+# after reading only that version, and keep serialized bodies in an LRU bounded by entries and by
+# RESPONSE_CACHE_BUDGET_BYTES of bodies in total. laundry_due is the earliest pending laundry timeout,
+# when reads start showing items as available again without a write.
+# bodies larger than this are not cached
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 1024 * 1024))
+response_cache = LRUCache(
+    max_size=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 512)),
+    max_bytes=int(os.getenv('RESPONSE_CACHE_BUDGET_BYTES', 32 * 1024 * 1024)),
+    # (body, mimetype, headers)
+    size=lambda cached: len(cached[0]),
+)
+response_cache_counters = {'not_modified': 0}
+
+# call after the write; available_at is the laundry timeout of items the write marked as used
+def bump_user_version(user_id, available_at=None):
+    update = {'$inc': {'version': 1}}
+    if available_at is not None:
+        update['$min'] = {'laundry_due': available_at}
+    db.user_versions.update_one({'_id': user_id}, update, upsert=True)
+
+def current_user_version(user_id):
+    state = db.user_versions.find_one({'_id': user_id}) or {'version': 0}
+    laundry_due = state.get('laundry_due')
+    now = utc_now()
+    # pymongo returns naive UTC datetimes
+    if laundry_due is None or laundry_due > now.replace(tzinfo=None):
+        return state['version']
+    # some items came back from the laundry: new version, and the next pending timeout if any
+    pending = db.clothing_items.find_one({'user_id': user_id, **unavailable_filter(now)}, {'available_at': 1}, sort=[('available_at', ASCENDING)])
+    update = {'$inc': {'version': 1}}
+    if pending:
+        update['$set'] = {'laundry_due': pending['available_at']}
+    else:
+        update['$unset'] = {'laundry_due': ''}
+    # only one concurrent reader moves laundry_due on
+    db.user_versions.update_one({'_id': user_id, 'laundry_due': laundry_due}, update)
+    return db.user_versions.find_one({'_id': user_id})['version']
+
+# for GET routes of the logged in user whose response only depends on the user's version and the request URL
+def cached_per_user_version(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = get_current_user_id()
+        if not user_id:
+            return view(*args, **kwargs)
+        key = f"{user_id}:{current_user_version(user_id)}:{request.full_path}:{'ndjson' if wants_ndjson() else 'json'}"
+        etag = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+        if request.if_none_match.contains_weak(etag):
+            response_cache_counters['not_modified'] += 1
+            response = Response(status=304)
+        else:
+            cached = response_cache.get(key)
+            if cached is not None:
+                body, mimetype, headers = cached
+                response = Response(body, mimetype=mimetype, headers=headers)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if not response.is_streamed and len(response.get_data()) <= RESPONSE_CACHE_MAX_BYTES:
+                    headers = {name: value for name, value in response.headers.items() if name == 'X-Next-Cursor'}
+                    response_cache.set(key, (response.get_data(), response.mimetype, headers))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
 
 # test routes ---------------------
 @app.route('/')
@@ -74,10 +854,12 @@ def signup():
             'preferences': [],
         }
         new_user['password'] = hashlib.sha256(new_user['password'].encode("utf-8")).hexdigest()
-        existing_user = db.users.find_one({'email': new_user['email']})
-        if existing_user:
+        # the unique index on users.email rejects duplicates atomically
+        ensure_users_index()
+        try:
+            result = db.users.insert_one(new_user)
+        except DuplicateKeyError:
             return jsonify({'error': 'User with email already exists'}), 400
-        result = db.users.insert_one(new_user)
         return jsonify({'message': 'User created successfully', 'id': str(result.inserted_id)})
     except Exception as e:
         return error_stack(str(e))
@@ -102,10 +884,10 @@ def login():
 @app.route('/users/profile', methods=['GET'])
 @jwt_required()
 def profile():
-    email = email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
+    user = get_current_user()
     if user:
-        user['_id'] = str(user['_id'])  
+        # copy, the document is shared through the user cache
+        user = dict(user, _id=str(user['_id']))
         return jsonify(user)
     else:
         return jsonify({'error': 'User not found'}), 404
@@ -114,8 +896,8 @@ def profile():
 @app.route('/users/profile', methods=['PUT'])
 @jwt_required()
 def update_profile():
-    email = email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
+    email = get_jwt_identity()
+    user = get_current_user()
     if not user:
         return jsonify({'error': 'User not found'}), 404
     try:
@@ -125,6 +907,7 @@ def update_profile():
             'dob': request.json.get('dob'),
         }
         db.users.update_one({'email': email}, {'$set': update})
+        invalidate_cached_user(email)
         return jsonify({'message': 'Profile updated successfully'})
     except Exception as e:
         return error_stack(str(e))
@@ -134,33 +917,217 @@ def update_profile():
 @jwt_required()
 def delete_profile():
     email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
+    user = get_current_user()
     if not user:
         return jsonify({'error': 'User not found'}), 404
     try:
         db.users.delete_one({'email': email})
+        invalidate_cached_user(email)
         return jsonify({'message': 'Profile deleted successfully'})
     except Exception as e:
         return error_stack(str(e))
     
+# preferences ---------------------
+# preferences are {text, created_at} entries on the user, appended with $push and capped to the newest
+# PREFERENCES_MAX_ENTRIES. Each change bumps preferences_version (which also retires the user's cached
+# outfits) and folds the new entries into preferences_summary: the distinct preferences, newest first,
+# within PREFERENCES_TOKEN_BUDGET. Outfit prompts read the summary, never the raw list.
+PREFERENCES_MAX_ENTRIES = int(os.getenv('PREFERENCES_MAX_ENTRIES', 100))
+PREFERENCE_MAX_CHARS = 200
+# preferences saved as strings before they had entries: the text, then " on <datetime.now()>"
+LEGACY_PREFERENCE = re.compile(r'(.*) on (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?)', re.S)
+
+def preference_entry(preference):
+    if isinstance(preference, dict):
+        return preference
+    match = LEGACY_PREFERENCE.fullmatch(str(preference))
+    if not match:
+        return {'text': str(preference), 'created_at': None}
+    return {'text': match.group(1), 'created_at': datetime.datetime.fromisoformat(match.group(2))}
+
+def normalize_preference(text):
+    return ' '.join(str(text).split())[:PREFERENCE_MAX_CHARS]
+
+# entries (oldest first) merged into the summary's items (newest first): a preference given again
+# moves to the front, and the oldest ones are dropped once the budget is used up
+def summarize_preferences(items, entries, version=0):
+    merged = [normalize_preference(entry['text']) for entry in reversed(entries)] + list(items)
+    kept = []
+    seen = set()
+    available = PREFERENCES_TOKEN_BUDGET
+    for text in merged:
+        if not text or text.lower() in seen:
+            continue
+        if estimate_tokens(text) > available:
+            break
+        available -= estimate_tokens(text)
+        seen.add(text.lower())
+        kept.append(text)
+    return {'items': kept, 'text': '; '.join(reversed(kept)), 'version': version}
+
+# the summary outfit prompts read; preferences saved before summaries existed are summarized here
+def preferences_summary(user):
+    summary = user.get('preferences_summary')
+    if summary is None:
+        summary = summarize_preferences([], [preference_entry(preference) for preference in user.get('preferences') or []])
+    return summary
+
+# append the preferences and update the summary. The summary is extended with just the new entries
+# when it is the one of the previous version and the cap dropped no entry; otherwise (a concurrent
+# change, or entries sliced off that the summary may still hold) it is rebuilt from the kept entries.
+# The version fences the write, so an older summary never replaces a newer one.
+def add_user_preferences(user_id, texts):
+    now = utc_now()
+    entries = [{'text': normalize_preference(text), 'created_at': now} for text in texts]
+    # the document before the push, so the entries the slice keeps are known exactly
+    user = db.users.find_one_and_update(
+        {'_id': user_id},
+        {'$push': {'preferences': {'$each': entries, '$slice': -PREFERENCES_MAX_ENTRIES}}, '$inc': {'preferences_version': 1}},
+        projection={'preferences': 1, 'preferences_summary': 1, 'preferences_version': 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    version = user.get('preferences_version', 0) + 1
+    preferences = (user.get('preferences') or []) + entries
+    summary = user.get('preferences_summary')
+    if summary is not None and summary.get('version') == version - 1 and len(preferences) <= PREFERENCES_MAX_ENTRIES:
+        summary = summarize_preferences(summary['items'], entries, version)
+    else:
+        kept = preferences[-PREFERENCES_MAX_ENTRIES:]
+        summary = summarize_preferences([], [preference_entry(preference) for preference in kept], version)
+    db.users.update_one({'_id': user_id, 'preferences_version': version}, {'$set': {'preferences_summary': summary}})
+    return summary
+
 # add user preferences
 @app.route('/users/preferences', methods=['POST'])
 @jwt_required()
 def add_preferences():
     email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
+    user = get_current_user()
     if not user:
         return jsonify({'error': 'User not found'}), 404
     try:
         preferences = request.json.get('preferences')
-        # add date and time to the preference as a string at the end of each
-        preferences = [preference + ' on ' + str(datetime.datetime.now()) for preference in preferences]
-        db.users.update_one({'email': email}, {'$set': {'preferences': preferences}})
-        return jsonify({'message': 'Preferences added successfully'})
+        if not isinstance(preferences, list) or not all(isinstance(preference, str) and preference.strip() for preference in preferences):
+            return jsonify({'error': 'preferences must be a list of non-empty strings'}), 400
+        summary = add_user_preferences(user['_id'], preferences)
+        invalidate_cached_user(email)
+        return jsonify({'message': 'Preferences added successfully', 'summary': summary['text']})
     except Exception as e:
         return error_stack(str(e))
 
-# weather
+# the user's preferences, oldest first, and the summary outfit prompts use
+@app.route('/users/preferences', methods=['GET'])
+@jwt_required()
+def get_preferences():
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify({
+        'preferences': [preference_entry(preference) for preference in user.get('preferences') or []],
+        'summary': preferences_summary(user)['text'],
+    })
+
+# weather ---------------------
+# summaries are cached per normalized location and time bucket, in an in-process LRU in front of
+# a Mongo collection with a TTL index. Concurrent misses for the same key share one upstream call.
+WEATHER_API_URL = os.getenv('OPENWEATHERMAP_BASE_URL', 'http://api.openweathermap.org/data/2.5') + '/weather'
+WEATHER_CACHE_BUCKET_SECONDS = int(os.getenv('WEATHER_CACHE_BUCKET_SECONDS', 1800))
+# (connect, read) seconds
+WEATHER_TIMEOUT = (3.05, float(os.getenv('WEATHER_READ_TIMEOUT_SECONDS', 10)))
+weather_cache = LRUCache(max_size=int(os.getenv('WEATHER_CACHE_MAX_ENTRIES', 512)), ttl=WEATHER_CACHE_BUCKET_SECONDS)
+weather_cache_counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'coalesced': 0}
+
+# pooled, keep-alive connections for outbound HTTP calls
+# a session whose calls are recorded as http spans
+class TracedSession(requests.Session):
+    def request(self, method, url, *args, **kwargs):
+        with traced('http', host=urlsplit(url).hostname or '', method=method.upper(), status='error') as span:
+            response = super().request(method, url, *args, **kwargs)
+            span['labels']['status'] = str(response.status_code)
+            return response
+
+http_session = TracedSession()
+http_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+class WeatherUnavailable(Exception):
+    pass
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# run fn once per key at a time; callers arriving while it runs wait for the same result
+def coalesce(key, fn, counters=None):
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        if counters is not None:
+            counters['coalesced'] += 1
+        return future.result()
+    try:
+        result = fn()
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+def weather_cache_key(location):
+    bucket = int(time.time() // WEATHER_CACHE_BUCKET_SECONDS)
+    return f"{' '.join(location.lower().split())}|{bucket}"
+
+def fetch_weather_summary(location):
+    weather_response = http_session.get(WEATHER_API_URL, params={
+        'q': location,
+        'appid': os.getenv('OPENWEATHERMAP_API_KEY'),
+        'units': 'metric',
+    }, timeout=WEATHER_TIMEOUT)
+    if weather_response.status_code != 200:
+        raise WeatherUnavailable(weather_response.text)
+    weather_data = str(weather_response.json())
+
+    # Use Gemini to summarize the weather data
+    prompt = f"Summarize the following weather data into brief description(idealy 2 densely info packed sentences, include info that would be useful to decide what clothing to wear for the day) and the average temperature, return a json with weather_description and temperature: {weather_data}"
+    summary = query_gemini(prompt)
+
+    # Check if the returned summary is a dict, if so, use it directly
+    if isinstance(summary, dict):
+        return summary
+    # If the summary is a string, parse it as JSON
+    return json.loads(summary)
+
+def get_weather_summary(location):
+    key = weather_cache_key(location)
+    summary = weather_cache.get(key)
+    if summary is not None:
+        weather_cache_counters['memory_hits'] += 1
+        return summary
+
+    def load():
+        cached = db.weather_summaries.find_one({'_id': key})
+        if cached:
+            weather_cache_counters['db_hits'] += 1
+            summary = cached['summary']
+        else:
+            weather_cache_counters['misses'] += 1
+            summary = fetch_weather_summary(location)
+            if 'error' in summary:
+                return summary
+            db.weather_summaries.update_one({'_id': key}, {'$set': {
+                'summary': summary,
+                'expires_at': utc_now() + datetime.timedelta(seconds=WEATHER_CACHE_BUCKET_SECONDS),
+            }}, upsert=True)
+        weather_cache.set(key, summary)
+        return summary
+
+    return coalesce(key, load, weather_cache_counters)
+
 @app.route('/get_weather', methods=['POST'])
 @jwt_required()
 def get_weather():
@@ -170,29 +1137,12 @@ def get_weather():
         if not location:
             return jsonify({'error': 'Location is required'}), 400
 
-        # Fetch weather data from OpenWeatherMap API
-        weather_api_key = os.getenv('OPENWEATHERMAP_API_KEY')
-        weather_url = f"http://api.openweathermap.org/data/2.5/weather?q={location}&appid={weather_api_key}&units=metric"
-        weather_response = requests.get(weather_url)
-        weather_data = str(weather_response.json())
-
-
-
-        if weather_response.status_code != 200:
-            return jsonify({'error': 'Failed to fetch weather data', 'message': weather_response}), 403
-
-        # Use Gemini to summarize the weather data
-        prompt = f"Summarize the following weather data into brief description(idealy 2 densely info packed sentences, include info that would be useful to decide what clothing to wear for the day) and the average temperature, return a json with weather_description and temperature: {weather_data}"
-        summary = query_gemini(prompt)
+        try:
+            weather_summary = get_weather_summary(location)
+        except WeatherUnavailable as e:
+            return jsonify({'error': 'Failed to fetch weather data', 'message': str(e)}), 403
 
-        # Check if the returned summary is a dict, if so, use it directly
-        if isinstance(summary, dict):
-            weather_summary = summary
-        else:
-            # If the summary is a string, parse it as JSON
-            weather_summary = json.loads(summary)
-        
-        print(weather_summary)
+        logger.debug('weather summary for %r: %s', location, weather_summary)
 
         weather_description = weather_summary.get('weather_description')
         temperature = weather_summary.get('temperature')
@@ -206,13 +1156,118 @@ def get_weather():
         return jsonify({'error': str(e)}), 500
 
     
+# image preprocessing ---------------------
+# uploads are decoded at reduced size where the format allows it (JPEG draft mode), oriented from
+# EXIF, bounded to IMAGE_MAX_EDGE pixels and re-encoded as JPEG before they reach Gemini
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', 1024))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+MAX_IMAGE_UPLOAD_BYTES = int(os.getenv('MAX_IMAGE_UPLOAD_BYTES', 10 * 1024 * 1024))
+# whole request body, enforced by werkzeug while the body is streamed in
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_BYTES', 64 * 1024 * 1024))
+
+# returns the normalized RGB image and its compact JPEG encoding; IMAGE_MAX_EDGE=0 keeps full resolution
+def preprocess_image(data):
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(data))
+    if IMAGE_MAX_EDGE and image.format == 'JPEG':
+        # lets libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the requested size
+        image.draft('RGB', (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    if IMAGE_MAX_EDGE:
+        image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return image, buffer.getvalue()
+
+# single image routes are rejected from Content-Length before any of the body is read
+@app.before_request
+def limit_image_upload_size():
+    if request.endpoint in ('add_clothing_item', 'generate_tags') and (request.content_length or 0) > MAX_IMAGE_UPLOAD_BYTES:
+        raise RequestEntityTooLarge()
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(e):
+    return jsonify({'error': 'Upload is too large'}), 413
+
+# image description cache ---------------------
+# descriptions are keyed by a hash of the preprocessed pixels, so the same photo re-uploaded
+# (even re-encoded) skips the vision call. An in-process LRU sits in front of a Mongo
+# collection whose TTL index evicts old entries.
+IMAGE_DESCRIPTION_PROMPT = ("Describe this clothing item. Respond with a JSON object with these fields: description (a single, detailed sentence. "
+                            "Include color, style, material, and any distinctive features), category (one of shirt, pants, dress, outerwear, "
+                            "footwear, accessory), colors (its primary colors, lowercase), warmth (1 for very light to 5 for very warm) "
+                            "and formality (1 for very casual to 5 for formal).")
+image_description_cache = LRUCache(max_size=int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', 256)))
+image_cache_counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+# hash of a preprocessed image: RGB pixels plus dimensions
+def image_fingerprint(image):
+    digest = hashlib.sha256()
+    digest.update(f'{image.width}x{image.height}:'.encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+# the vision call answers in JSON; a plain sentence is kept as the description and its attributes come from the keyword rules
+def parse_image_description(text):
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get('description'), str):
+        description = text.strip()
+        return description, extract_attributes(description)
+    description = data['description'].strip()
+    return description, normalize_attributes(data, description)
+
+# takes the uploaded file's bytes and returns (image_hash, description, attributes), calling Gemini only on a cache miss
+def describe_clothing_image(data):
+    image, encoded = preprocess_image(data)
+    image_hash = image_fingerprint(image)
+
+    cached = image_description_cache.get(image_hash)
+    if cached is not None:
+        image_cache_counters['memory_hits'] += 1
+        return image_hash, cached['description'], dict(cached['attributes'])
+
+    cached = db.image_descriptions.find_one({'_id': image_hash})
+    if cached:
+        image_cache_counters['db_hits'] += 1
+        # entries cached before attributes were extracted get them from the keyword rules
+        attributes = cached.get('attributes') or extract_attributes(cached['description'])
+        image_description_cache.set(image_hash, {'description': cached['description'], 'attributes': attributes})
+        return image_hash, cached['description'], dict(attributes)
+
+    image_cache_counters['misses'] += 1
+    response = gemini_client.generate_content(
+        [IMAGE_DESCRIPTION_PROMPT, {'mime_type': 'image/jpeg', 'data': encoded}],
+        generation_config={'response_mime_type': 'application/json'}
+    )
+    description, attributes = parse_image_description(response.text)
+
+    db.image_descriptions.update_one(
+        {'_id': image_hash},
+        {'$set': {'description': description, 'attributes': attributes, 'created_at': datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True
+    )
+    image_description_cache.set(image_hash, {'description': description, 'attributes': attributes})
+    return image_hash, description, dict(attributes)
+
+@app.route('/cache/stats', methods=['GET'])
+@bearer_token_required('METRICS_TOKEN')
+def cache_stats():
+    return jsonify({
+        'image_descriptions': {**image_cache_counters, 'memory': image_description_cache.stats()},
+        'weather': {**weather_cache_counters, 'memory': weather_cache.stats()},
+        'responses': {**response_cache_counters, 'memory': response_cache.stats()},
+        'outfits': {**outfit_cache_counters, 'hit_rate': outfit_cache_hit_rate(), 'memory': outfit_cache.stats()},
+    })
+
 # clothing item routes ---
 @app.route('/add_clothing_item', methods=['POST'])
 @jwt_required()
 def add_clothing_item():
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    if not user:
+    user_id = get_current_user_id()
+    if not user_id:
         return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
     if 'image' not in request.files:
         return jsonify({"error": "No image file provided"}), 400
@@ -221,62 +1276,162 @@ def add_clothing_item():
     path = request.form['path']
 
     try:
-        # Open the image using PIL
-        image = Image.open(io.BytesIO(image_file.read()))
-
-        # Initialize Gemini model
-        model = genai.GenerativeModel("gemini-1.5-flash")
-
-        # Generate content
-        response = model.generate_content([
-            "Describe this clothing item in a single, detailed sentence. Include color, style, material, and any distinctive features.",
-            image
-        ])
-
-        # Extract the description
-        description = response.text.strip()
+        # Reuses the description if the same photo was already tagged (e.g. by /generate_tags)
+        image_hash, description, attributes = describe_clothing_image(image_file.read())
 
         # Create a new clothing item document
-        new_clothing_item = {
-            'user_id': user['_id'],
-            'description': description,
-            'image': image_file.filename,
-            'path': path,
-            'created_at': datetime.datetime.now(),
-            'frequency': 0,
-            'available': True
-        }
+        new_clothing_item = new_clothing_item_doc(user_id, description, image_hash, image_file.filename, path, attributes)
+
+        # Embed the description for candidate preselection; on failure it is backfilled when first needed
+        try:
+            embedding = embed_descriptions([description], 'retrieval_document')[0]
+            new_clothing_item['embedding'] = embedding.tobytes()
+        except Exception:
+            embedding = None
 
         # Insert the new clothing item into the database
         result = db.clothing_items.insert_one(new_clothing_item)
+        bump_user_version(user_id)
+        if embedding is not None:
+            wardrobe_index.add(user_id, result.inserted_id, embedding)
 
         return jsonify({'message': 'Clothing item added successfully', 'id': str(result.inserted_id)})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
-from bson import ObjectId
-from flask import jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-
-# Helper function to recursively convert ObjectId fields to strings
-def convert_objectid_to_str(item):
-    if isinstance(item, dict):
-        for key, value in item.items():
-            if isinstance(value, ObjectId):
-                item[key] = str(value)
-            elif isinstance(value, dict):
-                convert_objectid_to_str(value)
-            elif isinstance(value, list):
-                item[key] = [convert_objectid_to_str(v) if isinstance(v, (ObjectId, dict, list)) else v for v in value]
-    elif isinstance(item, list):
-        item = [convert_objectid_to_str(i) if isinstance(i, (ObjectId, dict, list)) else i for i in item]
-    return item
+# attributes are the category, colors, warmth and formality extracted with the description
+def new_clothing_item_doc(user_id, description, image_hash, filename, path, attributes):
+    return {
+        'user_id': user_id,
+        'description': description,
+        **attributes,
+        'image': filename,
+        'path': path,
+        'image_hash': image_hash,
+        'created_at': datetime.datetime.now(),
+        'frequency': 0,
+        'available': True
+    }
+
+# batch upload ---------------------
+# files are read part by part off the multipart body and handed to a bounded pool for tagging as
+# soon as each one is complete, so tagging overlaps the upload; all items are written with one insert_many
+BATCH_UPLOAD_MAX_FILES = int(os.getenv('BATCH_UPLOAD_MAX_FILES', 100))
+batch_tagging_pool = ThreadPoolExecutor(max_workers=int(os.getenv('BATCH_TAG_WORKERS', 4)), thread_name_prefix='batch-tagging')
+
+# yields ('field', name, value) and ('file', name, filename, data) for each complete part; raises
+# ValueError for a malformed or truncated body
+def iter_multipart_parts(stream, boundary, chunk_size=64 * 1024):
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    # werkzeug's decoder takes the \r before the closing delimiter for data when a chunk ends
+    # between the delimiter's two final dashes, so a chunk never ends there
+    closing_prefix = b'--' + boundary.encode('latin-1') + b'-'
+    tail = b''
+    part = None
+    size = 0
+    data = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if (tail + chunk).endswith(closing_prefix):
+            chunk += stream.read(1)
+        tail = (tail + chunk)[-len(closing_prefix):]
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, (Field, File)):
+                part = event
+                data = []
+                size = 0
+            elif isinstance(event, Data):
+                data.append(event.data)
+                size += len(event.data)
+                if isinstance(part, File) and size > MAX_IMAGE_UPLOAD_BYTES:
+                    raise RequestEntityTooLarge()
+                if not event.more_data:
+                    if isinstance(part, File):
+                        yield 'file', part.name, part.filename, b''.join(data)
+                    else:
+                        yield 'field', part.name, b''.join(data).decode('utf-8')
+            elif isinstance(event, Epilogue):
+                return
+            event = decoder.next_event()
+        if not chunk:
+            return
+
+# add several clothing items at once: multipart 'images' files, with an optional 'paths' field per image (same order)
+@app.route('/clothing_items/batch', methods=['POST'])
+@jwt_required()
+def add_clothing_items_batch():
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': "Content-Type must be 'multipart/form-data'"}), 415
+
+    uploads = []
+    paths = []
+    parsed = False
+    try:
+        for part in iter_multipart_parts(request.stream, boundary):
+            if part[0] == 'field' and part[1] == 'paths':
+                paths.append(part[2])
+            elif part[0] == 'file' and part[1] == 'images':
+                if len(uploads) == BATCH_UPLOAD_MAX_FILES:
+                    return jsonify({'error': f'At most {BATCH_UPLOAD_MAX_FILES} images can be uploaded at once'}), 413
+                uploads.append((part[2], batch_tagging_pool.submit(contextvars.copy_context().run, describe_clothing_image, part[3])))
+        parsed = True
+    except ValueError:
+        return jsonify({'error': 'Malformed multipart body'}), 400
+    finally:
+        # a rejected upload (too many files, an oversized or malformed part) does not pay for the
+        # vision calls still queued; the ones already running finish and are discarded
+        if not parsed:
+            for _, future in uploads:
+                future.cancel()
+    if not uploads:
+        return jsonify({'error': 'No image files provided'}), 400
+
+    results = []
+    new_items = []
+    for position, (filename, future) in enumerate(uploads):
+        try:
+            image_hash, description, attributes = future.result()
+        except Exception as e:
+            results.append({'index': position, 'filename': filename, 'status': 'error', 'error': str(e)})
+            continue
+        path = paths[position] if position < len(paths) else None
+        new_items.append(new_clothing_item_doc(user_id, description, image_hash, filename, path, attributes))
+        results.append({'index': position, 'filename': filename, 'status': 'created'})
+
+    if new_items:
+        # one batched embedding call for the whole upload
+        try:
+            embeddings = embed_descriptions([item['description'] for item in new_items], 'retrieval_document')
+            for item, embedding in zip(new_items, embeddings):
+                item['embedding'] = embedding.tobytes()
+        except Exception:
+            embeddings = None
+        db.clothing_items.insert_many(new_items)
+        bump_user_version(user_id)
+        created = iter(enumerate(new_items))
+        for result in results:
+            if result['status'] == 'created':
+                number, item = next(created)
+                result['id'] = str(item['_id'])
+                if embeddings is not None:
+                    wardrobe_index.add(user_id, item['_id'], embeddings[number])
+
+    return jsonify({'created': len(new_items), 'failed': len(uploads) - len(new_items), 'results': results})
+
 
 @app.route('/clothing_items', methods=['GET'])
 @jwt_required()
 def get_clothing_item():
-    email = get_jwt_identity()
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
     
     # Extract the clothing_item_id from query parameters
     clothing_item_id = request.args.get('clothing_item_id')
@@ -286,29 +1441,138 @@ def get_clothing_item():
     
     try:
         # Find the clothing item by its ID
-        item = db.clothing_items.find_one({'_id': ObjectId(clothing_item_id), 'email': email})
+        item = db.clothing_items.find_one({'_id': ObjectId(clothing_item_id), 'user_id': user_id}, ITEM_PROJECTION)
         
         if not item:
             return jsonify({'error': 'Clothing item not found'}), 404
         
-        # Convert the ObjectId fields to strings
-        item = convert_objectid_to_str(item)
-        return jsonify(item)
+        return jsonify(apply_laundry_expiry(item))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# embeddings are internal, never returned to clients or put into prompts
+ITEM_PROJECTION = {'embedding': 0}
+
+# wardrobe pages are ordered by (created_at, _id); the cursor is the sort key of the last item sent
+WARDROBE_SORT = [('created_at', 1), ('_id', 1)]
+WARDROBE_MAX_PAGE_SIZE = 500
+
+def encode_wardrobe_cursor(item):
+    payload = json.dumps({'created_at': item['created_at'].isoformat(), 'id': str(item['_id'])})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_wardrobe_cursor(cursor):
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return datetime.datetime.fromisoformat(payload['created_at']), ObjectId(payload['id'])
+
+# build the mongo filter, projection and page size from the query string
+def parse_wardrobe_query(user_id, args):
+    query = {'user_id': user_id}
+
+    available = args.get('available')
+    if available is not None:
+        if available.lower() not in ('true', 'false'):
+            raise ValueError('available must be true or false')
+        query.update(available_filter() if available.lower() == 'true' else unavailable_filter())
+
+    frequency = {}
+    if args.get('min_frequency') is not None:
+        frequency['$gte'] = int(args['min_frequency'])
+    if args.get('max_frequency') is not None:
+        frequency['$lte'] = int(args['max_frequency'])
+    if frequency:
+        query['frequency'] = frequency
+
+    category = args.get('category')
+    if category:
+        categories = [value.strip().lower() for value in category.split(',') if value.strip()]
+        unknown = [value for value in categories if value not in CATEGORY_KEYWORDS]
+        if unknown:
+            raise ValueError(f"category must be one of {', '.join(CATEGORY_KEYWORDS)}")
+        query['category'] = {'$in': categories}
+
+    warmth = {}
+    if args.get('min_warmth') is not None:
+        warmth['$gte'] = int(args['min_warmth'])
+    if args.get('max_warmth') is not None:
+        warmth['$lte'] = int(args['max_warmth'])
+    if warmth:
+        query['warmth'] = warmth
+
+    cursor = args.get('cursor')
+    if cursor:
+        try:
+            created_at, last_id = decode_wardrobe_cursor(cursor)
+        except Exception:
+            raise ValueError('Invalid cursor')
+        query['$and'] = [{'$or': [
+            {'created_at': {'$gt': created_at}},
+            {'created_at': created_at, '_id': {'$gt': last_id}},
+        ]}]
+
+    projection = ITEM_PROJECTION
+    fields = args.get('fields')
+    if fields:
+        # the sort keys are always returned so the next cursor can be built
+        projection = {field.strip(): 1 for field in fields.split(',') if field.strip() and field.strip() != 'embedding'}
+        projection['created_at'] = 1
+
+    limit = args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1 or limit > WARDROBE_MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {WARDROBE_MAX_PAGE_SIZE}')
+
+    return query, projection, limit
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
 # get all clothing items for the user
+# supports ?limit=&cursor= pagination, ?fields= projection, ?available=, ?min_frequency=/?max_frequency=,
+# ?category= and ?min_warmth=/?max_warmth= filters, and ?format=ndjson to stream items straight off the cursor
 @app.route('/wardrobe', methods=['GET'])
 @jwt_required()
+@cached_per_user_version
 def get_wardrobe():
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    if not user:
+    user_id = get_current_user_id()
+    if not user_id:
         return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
-    clothing_items = list(db.clothing_items.find({'user_id': user['_id']}))
-    clothing_items = convert_objectid_to_str(clothing_items)
-    return jsonify(clothing_items)
+
+    try:
+        query, projection, limit = parse_wardrobe_query(user_id, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cursor = db.clothing_items.find(query, projection).sort(WARDROBE_SORT)
+    if limit is not None:
+        # fetch one extra item to know whether another page exists
+        cursor = cursor.limit(limit + 1)
+
+    if wants_ndjson():
+        def generate():
+            sent = 0
+            last_item = None
+            for item in cursor:
+                if limit is not None and sent == limit:
+                    yield app.json.dumps({'next_cursor': encode_wardrobe_cursor(last_item)}) + '\n'
+                    break
+                last_item = item
+                sent += 1
+                yield app.json.dumps(apply_laundry_expiry(item)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    clothing_items = list(cursor)
+    next_cursor = None
+    if limit is not None and len(clothing_items) > limit:
+        clothing_items = clothing_items[:limit]
+        next_cursor = encode_wardrobe_cursor(clothing_items[-1])
+    now = utc_now()
+    response = jsonify([apply_laundry_expiry(item, now) for item in clothing_items])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 # set a clothing item as available
 @app.route('/clothing_items/available', methods=['PUT'])
@@ -317,9 +1581,8 @@ def set_available():
     if request.content_type != 'application/json':
         return jsonify({'error': "Content-Type must be 'application/json'"}), 415
 
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    if not user:
+    user_id = get_current_user_id()
+    if not user_id:
         return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
 
     clothing_item_id = request.json.get('clothing_item_id')
@@ -327,19 +1590,17 @@ def set_available():
         return jsonify({'error': 'clothing_item_id is required'}), 400
 
     try:
-        # Debugging: Print the query and update operation
-        print(f"Updating clothing item with ID: {clothing_item_id} for user ID: {user['_id']}")
-        
         result = db.clothing_items.update_one(
-            {'_id': ObjectId(clothing_item_id), 'user_id': user['_id']},
-            {'$set': {'available': True}}
+            {'_id': ObjectId(clothing_item_id), 'user_id': user_id},
+            {'$set': {'available': True}, '$unset': {'available_at': ''}}
         )
         
-        # Debugging: Print the result of the update operation
-        print(f"Matched count: {result.matched_count}, Modified count: {result.modified_count}")
+        logger.debug('set clothing item %s of user %s available: matched %d, modified %d',
+                     clothing_item_id, user_id, result.matched_count, result.modified_count)
         
         if result.matched_count == 0:
             return jsonify({'error': 'Clothing item not found or not owned by user'}), 404
+        bump_user_version(user_id)
         
         return jsonify({'message': 'Clothing item set as available successfully'})
     except Exception as e:
@@ -349,287 +1610,1422 @@ def set_available():
 @app.route('/clothing_items/delete', methods=['DELETE'])
 @jwt_required()
 def delete_clothing_item():
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    if not user:
+    user_id = get_current_user_id()
+    if not user_id:
         return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
     clothing_item_id = request.json.get('clothing_item_id')
     if not clothing_item_id:
         return jsonify({'error': 'clothing_item_id is required'}), 400
     try:
-        db.clothing_items.delete_one({'_id': ObjectId(clothing_item_id), 'user_id': user['_id']})
+        db.clothing_items.delete_one({'_id': ObjectId(clothing_item_id), 'user_id': user_id})
+        invalidate_recent_outfits([user_id])
+        bump_user_version(user_id)
+        wardrobe_index.remove(user_id, ObjectId(clothing_item_id))
         return jsonify({'message': 'Clothing item deleted successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
-# Helper function to recursively convert ObjectId fields to strings
-def convert_objectid(data):
-    if isinstance(data, list):
-        return [convert_objectid(item) for item in data]
-    elif isinstance(data, dict):
-        return {key: convert_objectid(value) for key, value in data.items()}
-    elif isinstance(data, ObjectId):
-        return str(data)
-    else:
-        return data
+# wardrobe embeddings ---------------------
+# each item's description is embedded once (float32 bytes on the item) and kept in a per-user
+# in-memory index, so outfit prompts only carry the top-K items relevant to the request
+OUTFIT_CANDIDATE_K = int(os.getenv('OUTFIT_CANDIDATE_K', 60))
+EMBEDDING_BATCH_SIZE = 100
+
+# embed a list of texts, returns unit-length float32 vectors
+def embed_descriptions(texts, task_type):
+    import numpy as np
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        vectors.extend(gemini_client.embed_content(texts[start:start + EMBEDDING_BATCH_SIZE], task_type))
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+class WardrobeVectorIndex:
+    def __init__(self, max_users, ttl):
+        # user_id -> {item_id: vector}; the TTL picks up items embedded by other processes
+        self._users = LRUCache(max_size=max_users, ttl=ttl)
+
+    def vectors(self, user_id):
+        import numpy as np
+        vectors = self._users.get(user_id)
+        if vectors is None:
+            vectors = {}
+            for item in db.clothing_items.find({'user_id': user_id, 'embedding': {'$exists': True}}, {'embedding': 1}):
+                vectors[item['_id']] = np.frombuffer(item['embedding'], dtype=np.float32)
+            self._users.set(user_id, vectors)
+        return vectors
+
+    def add(self, user_id, item_id, vector):
+        vectors = self._users.get(user_id)
+        if vectors is not None:
+            vectors[item_id] = vector
+
+    def remove(self, user_id, item_id):
+        vectors = self._users.get(user_id)
+        if vectors is not None:
+            vectors.pop(item_id, None)
+
+    # rank items by cosine similarity to the query, embedding (and saving) any item that has no vector yet
+    def top_k(self, user_id, items, query_vector, k):
+        import numpy as np
+        vectors = self.vectors(user_id)
+        missing = [item for item in items if item['_id'] not in vectors]
+        if missing:
+            embeddings = embed_descriptions([item['description'] for item in missing], 'retrieval_document')
+            for item, embedding in zip(missing, embeddings):
+                vectors[item['_id']] = embedding
+            db.clothing_items.bulk_write([
+                UpdateOne({'_id': item['_id']}, {'$set': {'embedding': embedding.tobytes()}})
+                for item, embedding in zip(missing, embeddings)
+            ])
+        scores = np.stack([vectors[item['_id']] for item in items]) @ query_vector
+        return [items[i] for i in np.argsort(-scores)[:k]]
+
+wardrobe_index = WardrobeVectorIndex(
+    max_users=int(os.getenv('WARDROBE_INDEX_MAX_USERS', 256)),
+    ttl=int(os.getenv('WARDROBE_INDEX_TTL_SECONDS', 600)),
+)
+
+# pre-select the k items closest to query_text; required items (e.g. base items) are always kept.
+# Small wardrobes skip the embedding call entirely, and any embedding failure falls back to the
+# k least worn items. The items come back most important first (required items, then by relevance,
+# or least worn first when they were not ranked), so prompt budgets cut the least important ones.
+def select_candidate_items(user_id, items, query_text, required_ids=(), k=None):
+    k = OUTFIT_CANDIDATE_K if k is None else k
+    required = [item for item in items if item['_id'] in required_ids]
+    others = [item for item in items if item['_id'] not in required_ids]
+    if k <= 0 or len(items) <= k:
+        return required + sorted(others, key=lambda item: item['frequency'])
+    try:
+        query_vector = embed_descriptions([query_text], 'retrieval_query')[0]
+        selected = wardrobe_index.top_k(user_id, others, query_vector, max(k - len(required), 0))
+    except Exception:
+        logger.warning('candidate preselection failed, using the least worn items', exc_info=True)
+        selected = sorted(others, key=lambda item: item['frequency'])[:max(k - len(required), 0)]
+    return required + selected
+
+# local outfit engine ---------------------
+# deterministic, rule based outfits built from the item descriptions in milliseconds: used when
+# the request asks for mode 'local', and as the fallback when Gemini fails or misses its deadline
+OUTFIT_MODES = ('gemini', 'local')
+OUTFIT_GEMINI_TIMEOUT_SECONDS = float(os.getenv('OUTFIT_GEMINI_TIMEOUT_SECONDS', 20))
+
+# the earliest keyword in a description decides its category ("a denim jacket with a shirt collar" is outerwear)
+CATEGORY_KEYWORDS = {
+    'shirt': ['t-shirt', 'tshirt', 'shirt', 'tee', 'top', 'blouse', 'polo', 'sweater', 'sweatshirt', 'hoodie', 'kurta',
+              'tank', 'jersey', 'pullover', 'turtleneck', 'henley', 'camisole', 'tunic'],
+    'pants': ['pants', 'jeans', 'trousers', 'chinos', 'shorts', 'joggers', 'leggings', 'skirt', 'sweatpants', 'slacks',
+              'cargos', 'culottes'],
+    'dress': ['dress', 'jumpsuit', 'romper', 'saree', 'sari', 'gown'],
+    'outerwear': ['jacket', 'coat', 'blazer', 'cardigan', 'parka', 'windbreaker', 'overcoat', 'gilet', 'puffer', 'raincoat'],
+    'footwear': ['shoes', 'sneakers', 'boots', 'sandals', 'loafers', 'heels', 'trainers', 'flats', 'slippers', 'oxfords'],
+    'accessory': ['watch', 'belt', 'cap', 'hat', 'scarf', 'bag', 'sunglasses', 'necklace', 'bracelet', 'ring', 'earrings',
+                  'tie', 'beanie', 'gloves', 'socks', 'backpack', 'wallet'],
+}
+WARM_KEYWORDS = ['wool', 'woolen', 'fleece', 'sweater', 'hoodie', 'coat', 'jacket', 'thermal', 'knit', 'knitted', 'puffer',
+                 'cashmere', 'flannel', 'corduroy', 'leather', 'parka', 'beanie', 'gloves', 'boots', 'turtleneck', 'padded']
+LIGHT_KEYWORDS = ['linen', 'shorts', 'tank', 'sleeveless', 'sandals', 'chiffon', 'mesh', 'short-sleeved', 'short sleeve',
+                  'breathable', 'lightweight', 'crop']
+COLOR_WORDS = ['black', 'white', 'grey', 'gray', 'navy', 'blue', 'red', 'green', 'olive', 'yellow', 'mustard', 'orange',
+               'pink', 'purple', 'maroon', 'burgundy', 'beige', 'cream', 'khaki', 'brown', 'tan', 'teal', 'charcoal', 'ivory']
+NEUTRAL_COLORS = {'black', 'white', 'grey', 'gray', 'navy', 'beige', 'cream', 'khaki', 'brown', 'tan', 'charcoal', 'ivory'}
+RAIN_KEYWORDS = ['rain', 'drizzle', 'shower', 'storm', 'thunder', 'wet']
+FORMAL_KEYWORDS = ['blazer', 'suit', 'tie', 'oxfords', 'loafers', 'silk', 'satin', 'tailored', 'formal', 'pleated', 'heels',
+                   'gown', 'dress shirt', 'slacks', 'trousers', 'button-down', 'waistcoat', 'cufflinks']
+CASUAL_KEYWORDS = ['t-shirt', 'tshirt', 'tee', 'hoodie', 'sweatshirt', 'joggers', 'sweatpants', 'shorts', 'sneakers', 'denim',
+                   'jeans', 'graphic', 'tank', 'flip-flops', 'slippers', 'cargos', 'cap', 'distressed', 'athletic']
+
+def description_words(description):
+    return re.findall(r"[a-z]+(?:-[a-z]+)*", description.lower())
+
+KEYWORD_CATEGORIES = {keyword: category for category, keywords in CATEGORY_KEYWORDS.items() for keyword in keywords}
+
+def classify_item(description):
+    words = description_words(description)
+    for position, word in enumerate(words):
+        # a keyword right before another one is a modifier ("dress shirt", "tank top")
+        if word in KEYWORD_CATEGORIES and not (position + 1 < len(words) and words[position + 1] in KEYWORD_CATEGORIES):
+            return KEYWORD_CATEGORIES[word]
+    return 'accessory'
+
+# 1 (very light) to 5 (very warm)
+def estimate_warmth(description):
+    text = ' '.join(description_words(description))
+    warmth = 3 + sum(1 for keyword in WARM_KEYWORDS if keyword in text) - sum(1 for keyword in LIGHT_KEYWORDS if keyword in text)
+    return max(1, min(5, warmth))
+
+def extract_colors(description):
+    words = description_words(description)
+    return [color for color in COLOR_WORDS if color in words]
+
+# 1 (very casual) to 5 (formal)
+def estimate_formality(description):
+    # whole words only, so "tie" does not match "tied" and "tee" does not match "steel"
+    text = f" {' '.join(description_words(description))} "
+    formality = 3 + sum(1 for keyword in FORMAL_KEYWORDS if f' {keyword} ' in text) - sum(1 for keyword in CASUAL_KEYWORDS if f' {keyword} ' in text)
+    return max(1, min(5, formality))
+
+ITEM_ATTRIBUTE_FIELDS = ('category', 'colors', 'warmth', 'formality')
+
+def extract_attributes(description):
+    return {
+        'category': classify_item(description),
+        'colors': extract_colors(description),
+        'warmth': estimate_warmth(description),
+        'formality': estimate_formality(description),
+    }
 
-from bson import ObjectId  # Import ObjectId to convert string IDs to ObjectId type
+# keep the fields of a model answer that are valid, the keyword rules fill in the rest
+def normalize_attributes(data, description):
+    attributes = extract_attributes(description)
+    category = str(data.get('category', '')).strip().lower()
+    if category in CATEGORY_KEYWORDS:
+        attributes['category'] = category
+    colors = data.get('colors')
+    if isinstance(colors, list):
+        attributes['colors'] = [str(color).strip().lower() for color in colors if str(color).strip()][:3] or attributes['colors']
+    for field in ('warmth', 'formality'):
+        try:
+            attributes[field] = max(1, min(5, int(data[field])))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return attributes
+
+# attributes stored at ingest, or extracted from the description for items that were not backfilled yet
+def item_attributes(item):
+    if all(field in item for field in ITEM_ATTRIBUTE_FIELDS):
+        return {field: item[field] for field in ITEM_ATTRIBUTE_FIELDS}
+    return extract_attributes(item.get('description', ''))
+
+# "A navy cotton t-shirt with a crew neck." -> "Navy cotton t-shirt"
+def short_item_name(description):
+    name = re.split(r',| with | featuring | that ', description.strip().rstrip('.'), maxsplit=1)[0]
+    name = re.sub(r'^(a|an|the)\s+', '', name, flags=re.IGNORECASE)
+    return ' '.join(name.split()[:6]).capitalize()
+
+def parse_temperature(temperature):
+    match = re.search(r'-?\d+(?:\.\d+)?', str(temperature)) if temperature is not None else None
+    return float(match.group()) if match else None
+
+def target_warmth(temperature):
+    if temperature is None:
+        return 3
+    for limit, warmth in ((5, 5), (12, 4), (20, 3), (27, 2)):
+        if temperature < limit:
+            return warmth
+    return 1
+
+def colors_clash(first, second):
+    loud_first = set(first['colors']) - NEUTRAL_COLORS
+    loud_second = set(second['colors']) - NEUTRAL_COLORS
+    return bool(loud_first and loud_second and not loud_first & loud_second)
+
+# build up to `count` distinct outfits of at most one shirt and one pants (or a dress), plus outerwear
+# when it is cold or wet, footwear and an accessory. Items closest to the weather's warmth and worn
+# least often come first; base items are part of every outfit.
+def generate_local_outfits(items, temperature=None, weather_description='', day_description='', base_items=(), count=3):
+    temperature = parse_temperature(temperature)
+    target = target_warmth(temperature)
+    rainy = any(keyword in (weather_description or '').lower() for keyword in RAIN_KEYWORDS)
+    base_ids = {item['_id'] for item in base_items}
+
+    def score(entry):
+        item, attributes = entry
+        return -abs(attributes['warmth'] - target) - 0.5 * item.get('frequency', 0)
+
+    by_category = {category: [] for category in CATEGORY_KEYWORDS}
+    base_by_category = {category: [] for category in CATEGORY_KEYWORDS}
+    for item in list(base_items) + [item for item in items if item['_id'] not in base_ids]:
+        entry = (item, item_attributes(item))
+        (base_by_category if item['_id'] in base_ids else by_category)[entry[1]['category']].append(entry)
+    for entries in by_category.values():
+        entries.sort(key=score, reverse=True)
+
+    # a base item fixes its slot for every outfit
+    shirts = base_by_category['shirt'][:1] or by_category['shirt'][:5]
+    pants = base_by_category['pants'][:1] or by_category['pants'][:5]
+    cores = []
+    if base_by_category['dress']:
+        cores = [(base_by_category['dress'][0], None, 0)]
+    else:
+        for shirt in shirts:
+            for pant in pants:
+                cores.append((shirt, pant, score(shirt) + score(pant) - (2 if colors_clash(shirt[1], pant[1]) else 0)))
+        if not base_by_category['shirt'] and not base_by_category['pants']:
+            cores.extend((dress, None, 2 * score(dress)) for dress in by_category['dress'][:3])
+    if not cores:
+        # nothing recognizable as a full outfit, fall back to the best single items
+        cores = [(entry, None, score(entry)) for entries in by_category.values() for entry in entries[:2]]
+    cores.sort(key=lambda core: core[2], reverse=True)
+
+    # prefer combinations that do not repeat a piece already used in an earlier outfit
+    chosen, used = [], set()
+    for core in cores:
+        pieces = {entry[0]['_id'] for entry in core[:2] if entry}
+        if not pieces & used:
+            chosen.append(core)
+            used |= pieces
+        if len(chosen) == count:
+            break
+    for core in cores:
+        if len(chosen) == count:
+            break
+        if core not in chosen:
+            chosen.append(core)
+
+    outfits = []
+    for position, (top, bottom, _) in enumerate(chosen):
+        entries = [entry for entry in (top, bottom) if entry]
+        if target >= 4 or rainy:
+            entries += base_by_category['outerwear'] or by_category['outerwear'][position:position + 1] or by_category['outerwear'][:1]
+        else:
+            entries += base_by_category['outerwear']
+        entries += base_by_category['footwear'] or by_category['footwear'][position:position + 1] or by_category['footwear'][:1]
+        entries += base_by_category['accessory'] or by_category['accessory'][position:position + 1]
+
+        if target >= 4:
+            tip = 'Layer up, it will be cold out.'
+        elif target <= 2:
+            tip = 'Stick to breathable fabrics and keep layers light.'
+        else:
+            tip = 'Comfortable for mild weather; carry a light layer for the evening.'
+        if rainy:
+            tip += ' Expect rain, pick water resistant shoes and outerwear.'
+
+        outfits.append({
+            'name': ' & '.join(short_item_name(entry[0]['description']) for entry in entries[:2]),
+            'description': f"A {'warm' if target >= 4 else 'light' if target <= 2 else 'balanced'} combination for "
+                           f"{weather_description or 'the weather'}" + (f' and {day_description}' if day_description else '') + '.',
+            'clothing_item_ids': [str(entry[0]['_id']) for entry in entries],
+            'styling_tips': tip,
+            'source': 'local',
+        })
+    return outfits
+
+# item attributes ---------------------
+# items store category, colors, warmth and formality from ingest, so outfit routes can drop clothes
+# that do not suit the temperature with an indexed query instead of sending the whole wardrobe
+COLD_TEMPERATURE = float(os.getenv('OUTFIT_COLD_TEMPERATURE', 10))
+HOT_TEMPERATURE = float(os.getenv('OUTFIT_HOT_TEMPERATURE', 25))
+ATTRIBUTE_EXTRACTION_PROMPT = ("For each numbered clothing item description below, extract its attributes. Respond with a JSON array with one "
+                               "object per description, in the same order, with these fields: category (one of shirt, pants, dress, outerwear, "
+                               "footwear, accessory), colors (its primary colors, lowercase), warmth (1 for very light to 5 for very warm) and "
+                               "formality (1 for very casual to 5 for formal).")
+
+# below COLD_TEMPERATURE only warm clothes are candidates, above HOT_TEMPERATURE only light ones. Footwear,
+# accessories and items without attributes are always kept; returns None when every item suits the weather
+def weather_item_filter(temperature):
+    temperature = parse_temperature(temperature)
+    if temperature is None:
+        return None
+    if temperature < COLD_TEMPERATURE:
+        warmth = {'$gte': 3}
+    elif temperature > HOT_TEMPERATURE:
+        warmth = {'$lte': 3}
+    else:
+        return None
+    return {'$or': [{'warmth': warmth}, {'category': {'$in': ['footwear', 'accessory']}}, {'warmth': {'$exists': False}}]}
+
+# a dress, or a shirt and pants
+def has_core_items(items):
+    categories = {item_attributes(item)['category'] for item in items}
+    return 'dress' in categories or {'shirt', 'pants'} <= categories
+
+# available items that suit the temperature; the whole available wardrobe if those cannot make an outfit
+def load_outfit_candidates(user_id, temperature):
+    weather_filter = weather_item_filter(temperature)
+    if weather_filter is not None:
+        items = list(db.clothing_items.find({'user_id': user_id, '$and': [available_filter(), weather_filter]}, ITEM_PROJECTION))
+        if has_core_items(items):
+            return items
+    return list(db.clothing_items.find({'user_id': user_id, **available_filter()}, ITEM_PROJECTION))
+
+# one Gemini call for a batch of descriptions, returns their attributes in the same order
+def extract_attributes_with_gemini(descriptions):
+    prompt = ATTRIBUTE_EXTRACTION_PROMPT + '\n\n' + '\n'.join(f'{number}. {description}' for number, description in enumerate(descriptions, 1))
+    response = gemini_client.generate_content([prompt], generation_config={'response_mime_type': 'application/json'})
+    data = json.loads(response.text)
+    if not isinstance(data, list) or len(data) != len(descriptions):
+        raise ValueError('Expected one attribute object per description')
+    return [normalize_attributes(entry if isinstance(entry, dict) else {}, description) for entry, description in zip(data, descriptions)]
+
+# set the attributes of items added before they were extracted at ingest, one bulk write per batch.
+# A batch Gemini fails on is extracted with the keyword rules, so every item is written and the loop ends
+def backfill_item_attributes(use_gemini=False, batch_size=50):
+    backfilled = 0
+    while True:
+        items = list(db.clothing_items.find({'category': {'$exists': False}}, {'description': 1, 'user_id': 1}).limit(batch_size))
+        if not items:
+            return backfilled
+        descriptions = [item.get('description', '') for item in items]
+        attributes = None
+        if use_gemini:
+            try:
+                attributes = extract_attributes_with_gemini(descriptions)
+            except Exception:
+                logger.warning('attribute extraction with Gemini failed, using the keyword rules', exc_info=True)
+        if attributes is None:
+            attributes = [extract_attributes(description) for description in descriptions]
+        db.clothing_items.bulk_write(
+            [UpdateOne({'_id': item['_id']}, {'$set': values}) for item, values in zip(items, attributes)],
+            ordered=False
+        )
+        backfilled += len(items)
+        # the attributes are part of wardrobe and outfit responses
+        user_ids = list({item['user_id'] for item in items})
+        invalidate_recent_outfits(user_ids)
+        # upserted like bump_user_version: a user without a version document reads as version 0
+        db.user_versions.bulk_write([UpdateOne({'_id': user_id}, {'$inc': {'version': 1}}, upsert=True) for user_id in user_ids], ordered=False)
+
+@app.cli.command('backfill-attributes')
+@click.option('--gemini', 'use_gemini', is_flag=True, help='Extract the attributes with Gemini instead of the keyword rules.')
+@click.option('--batch-size', default=50, show_default=True, help='Descriptions per Gemini call and per bulk write.')
+def backfill_attributes_command(use_gemini, batch_size):
+    click.echo(f'{backfill_item_attributes(use_gemini, batch_size)} clothing items backfilled')
+
+# bulk writes ---------------------
+# one round trip per write phase: outfits are inserted together and returned from memory
+# (insert_many sets their _id), instead of being read back by created_at
+def insert_outfits(user_id, outfits, created_at=None):
+    created_at = created_at or utc_now()
+    for outfit in outfits:
+        outfit['user_id'] = user_id
+        outfit['created_at'] = created_at
+    if outfits:
+        db.outfits.insert_many(outfits)
+    return outfits
+
+# call once the outfits are inserted, before they are hydrated
+def record_new_outfits(user_id, outfits):
+    if outfits:
+        push_recent_outfits(user_id, outfits)
+        bump_user_version(user_id)
+
+def persist_outfits(user_id, outfits):
+    insert_outfits(user_id, outfits)
+    record_new_outfits(user_id, outfits)
+    return outfits
+
+def mark_items_used(user_id, clothing_item_ids):
+    available_at = utc_now() + LAUNDRY_TIMEOUT
+    result = db.clothing_items.update_many(
+        {'_id': {'$in': clothing_item_ids}, 'user_id': user_id},
+        {'$set': {'available': False, 'available_at': available_at}, '$inc': {'frequency': 1}}
+    )
+    bump_user_version(user_id, available_at)
+    return result
+
+# outfit hydration ---------------------
+# load clothing items by id through a per-request identity map, so an item referenced
+# by several outfits (or several calls in one request) is fetched from mongo only once
+def load_clothing_items(object_ids):
+    item_map = g.setdefault('clothing_item_map', {}) if has_request_context() else {}
+    missing = list({oid for oid in object_ids if oid not in item_map})
+    if missing:
+        for item in db.clothing_items.find({'_id': {'$in': missing}}, ITEM_PROJECTION):
+            item_map[item['_id']] = item
+    return item_map
+
+# fill clothing_items_list on every outfit with a single batched query
+def hydrate_outfits(outfits):
+    outfit_object_ids = []
+    for outfit in outfits:
+        outfit['_id'] = str(outfit['_id'])
+        object_ids = []
+        for item_id in outfit.get('clothing_item_ids', []):
+            if ObjectId.is_valid(item_id) and ObjectId(item_id) not in object_ids:
+                object_ids.append(ObjectId(item_id))
+        outfit_object_ids.append(object_ids)
 
-@app.route('/outfits/generate', methods=['POST'])
-@jwt_required()
-def generate_outfit():
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    
-    if not user:
-        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
-    
-    # Fetch all available clothing items for the user
-    clothing_items = list(db.clothing_items.find({'user_id': user['_id'], 'available': True}))
-    
-    if not clothing_items:
-        return jsonify({'error': 'No clothing items found for user'}), 404
-    
-    # Sort clothing items by frequency (ascending)
-    clothing_items.sort(key=lambda x: x['frequency'])
-    
-    # Extract id, description, and frequency fields for each clothing item
-    clothing_items = [{'id': str(item['_id']), 'description': item['description'], 'frequency': item['frequency']} for item in clothing_items]
-    
-    # Get data from the request
-    weather_description = request.json.get('weather_description')
-    day_description = request.json.get('day_description')
-    preferences = str(user['preferences'])
-    temperature = request.json.get('temperature')
+    item_map = load_clothing_items([oid for object_ids in outfit_object_ids for oid in object_ids])
 
-    if not weather_description or temperature is None:
-        return jsonify({'error': 'Weather description and temperature are required'}), 400
-    
+    for outfit, object_ids in zip(outfits, outfit_object_ids):
+        if object_ids:
+            # copies, since the same item can appear in several outfits and is serialized per outfit
+            outfit['clothing_items_list'] = [apply_laundry_expiry(dict(item_map[oid], _id=str(oid))) for oid in object_ids if oid in item_map]
+    return outfits
+
+# outfit history ---------------------
+# outfits keeps the newest OUTFIT_RETENTION_RECENT outfits of each user and every outfit that was used;
+# `flask archive-outfits`, or the daily Vercel cron calling /cron/archive-outfits, moves the rest to
+# outfits_archive in batches. Using an archived outfit moves it back. recent_outfits holds one document
+# per user with the newest RECENT_OUTFITS_SIZE outfits and a summary of their items, pushed as outfits
+# are saved, so the home screen is a single read. A missing document is rebuilt from outfits.
+OUTFIT_RETENTION_RECENT = int(os.getenv('OUTFIT_RETENTION_RECENT', 100))
+RECENT_OUTFITS_SIZE = int(os.getenv('RECENT_OUTFITS_SIZE', 10))
+RECENT_OUTFIT_ITEM_FIELDS = ('description', 'category', 'colors', 'image', 'path')
+
+# outfit pages are ordered newest first; the cursor is the sort key of the last outfit sent
+OUTFIT_SORT = [('created_at', DESCENDING), ('_id', DESCENDING)]
+OUTFIT_MAX_PAGE_SIZE = 100
+
+def parse_outfits_query(user_id, args):
+    query = {'user_id': user_id}
+
+    cursor = args.get('cursor')
+    if cursor:
+        try:
+            created_at, last_id = decode_wardrobe_cursor(cursor)
+        except Exception:
+            raise ValueError('Invalid cursor')
+        query['$or'] = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': last_id}},
+        ]
+
+    limit = args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1 or limit > OUTFIT_MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {OUTFIT_MAX_PAGE_SIZE}')
+
+    return query, limit
+
+def outfit_item_ids(outfits):
+    return [ObjectId(item_id) for outfit in outfits for item_id in outfit.get('clothing_item_ids', []) if ObjectId.is_valid(item_id)]
+
+def outfit_summary(outfit, item_map):
+    summary = {field: outfit[field] for field in ('_id', 'name', 'description', 'source', 'created_at', 'used_at') if field in outfit}
+    summary['items'] = []
+    for item_id in dict.fromkeys(outfit.get('clothing_item_ids', [])):
+        item = item_map.get(ObjectId(item_id)) if ObjectId.is_valid(item_id) else None
+        if item:
+            summary['items'].append({'_id': item['_id'], **{field: item[field] for field in RECENT_OUTFIT_ITEM_FIELDS if field in item}})
+    return summary
+
+def rebuild_recent_outfits(user_id):
+    outfits = list(db.outfits.find({'user_id': user_id}).sort(OUTFIT_SORT).limit(RECENT_OUTFITS_SIZE))
+    item_map = load_clothing_items(outfit_item_ids(outfits))
+    document = {'_id': user_id, 'outfits': [outfit_summary(outfit, item_map) for outfit in outfits]}
+    try:
+        db.recent_outfits.replace_one({'_id': user_id}, document, upsert=True)
+    except DuplicateKeyError:
+        # a concurrent rebuild created it first, from the same outfits
+        pass
+    return document
+
+# call after inserting the outfits; they go in front, newest first as in OUTFIT_SORT
+def push_recent_outfits(user_id, outfits):
+    item_map = load_clothing_items(outfit_item_ids(outfits))
+    summaries = [outfit_summary(outfit, item_map) for outfit in reversed(outfits)]
+    result = db.recent_outfits.update_one(
+        {'_id': user_id},
+        {'$push': {'outfits': {'$each': summaries, '$position': 0, '$slice': RECENT_OUTFITS_SIZE}}}
+    )
+    if not result.matched_count:
+        rebuild_recent_outfits(user_id)
+
+# item summaries are rebuilt on the next read after items change
+def invalidate_recent_outfits(user_ids):
+    db.recent_outfits.delete_many({'_id': {'$in': list(user_ids)}})
+
+# move the outfits of a user outside the retention window (the newest `keep` and the used ones stay)
+# to outfits_archive, batch_size at a time. Outfits are copied before they are deleted, so a run that
+# stops part way leaves copies that the next run skips.
+def archive_user_outfits(user_id, keep=OUTFIT_RETENTION_RECENT, batch_size=500):
+    cursor = db.outfits.find({'user_id': user_id}, {'used_at': 1}).sort(OUTFIT_SORT).skip(keep)
+    outfit_ids = [outfit['_id'] for outfit in cursor if not outfit.get('used_at')]
+    for start in range(0, len(outfit_ids), batch_size):
+        batch = outfit_ids[start:start + batch_size]
+        archived_at = utc_now()
+        try:
+            db.outfits_archive.insert_many([dict(outfit, archived_at=archived_at) for outfit in db.outfits.find({'_id': {'$in': batch}})], ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+        db.outfits.delete_many({'_id': {'$in': batch}})
+    if outfit_ids:
+        bump_user_version(user_id)
+    return len(outfit_ids)
+
+def archive_old_outfits(keep=OUTFIT_RETENTION_RECENT, batch_size=500):
+    return sum(archive_user_outfits(user_id, keep, batch_size) for user_id in db.outfits.distinct('user_id'))
+
+@app.cli.command('archive-outfits')
+@click.option('--keep', default=OUTFIT_RETENTION_RECENT, show_default=True, help='Newest outfits kept per user, besides the used ones.')
+@click.option('--batch-size', default=500, show_default=True, help='Outfits moved per write.')
+def archive_outfits_command(keep, batch_size):
+    click.echo(f'{archive_old_outfits(keep, batch_size)} outfits archived')
+
+# scheduled in vercel.json; Vercel sends Authorization: Bearer <CRON_SECRET>
+@app.route('/cron/archive-outfits', methods=['GET'])
+@bearer_token_required('CRON_SECRET')
+def archive_outfits_cron():
+    return jsonify({'archived': archive_old_outfits(OUTFIT_RETENTION_RECENT)})
+
+# streaming outfits ---------------------
+# with "stream": true in the body (or Accept: text/event-stream) the outfit routes answer with
+# Server-Sent Events. Gemini's answer is streamed and parsed as it arrives, and each outfit is saved,
+# hydrated and sent as an `outfit` event as soon as its JSON object is complete. A `done` event with
+# the count and source ends the stream.
+def wants_event_stream():
+    return bool(request.json.get('stream')) or request.accept_mimetypes.best == 'text/event-stream'
+
+# pulls the objects of a JSON array out of text that arrives in pieces, skipping anything around
+# the array. The array is the first one after a ``` fence when there is one; brackets in the text
+# before it (e.g. "Here are [3] outfits") are skipped, as is any [ that does not open an object.
+class JSONArrayStream:
+    def __init__(self):
+        self._started = False
+        # a [ was seen before the start, waiting for the { that makes it the array
+        self._pending = False
+        self._backticks = 0
+        self._in_fence_header = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._buffer = []
+
+    # returns the objects completed by this piece of text
+    def feed(self, text):
+        objects = []
+        for char in text:
+            if self._finished:
+                break
+            if not self._started:
+                self._before_start(char)
+                continue
+            if self._depth == 0:
+                # between objects: only the start of the next one or the end of the array matter
+                if char == '{':
+                    self._depth = 1
+                    self._buffer = [char]
+                elif char == ']':
+                    self._finished = True
+                continue
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        objects.append(json.loads(''.join(self._buffer)))
+                    except json.JSONDecodeError:
+                        logger.warning('skipping an outfit that is not valid JSON')
+        return objects
+
+    def _before_start(self, char):
+        if self._in_fence_header:
+            # the rest of the fence's line, e.g. "json"
+            if char == '\n' or char == '[':
+                self._in_fence_header = False
+                self._pending = char == '['
+            return
+        if char == '`':
+            self._backticks += 1
+            if self._backticks == 3:
+                # a fence: look for the array after it, whatever came before
+                self._backticks = 0
+                self._pending = False
+                self._in_fence_header = True
+            return
+        self._backticks = 0
+        if self._pending and not char.isspace():
+            self._pending = False
+            if char == '{':
+                self._started = True
+                self._depth = 1
+                self._buffer = [char]
+                return
+        if char == '[':
+            self._pending = True
+
+# the outfits of a streamed Gemini answer, each one as soon as it is complete
+def stream_gemini_outfits(build_prompt):
+    prompt = build_prompt()
+    parser = JSONArrayStream()
+    for text in gemini_client.stream_content([prompt.text], timeout=OUTFIT_GEMINI_TIMEOUT_SECONDS, system_instruction=prompt.system_instruction):
+        for outfit in parser.feed(text):
+            if isinstance(outfit, dict):
+                yield prompt.resolve(outfit)
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {app.json.dumps(data)}\n\n'
+
+def event_stream_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# outfits is an iterable of outfits that may fail part way; fallback() builds local outfits when it
+# produced none. Each outfit is inserted on its own, so the ones already sent are saved even if the
+# client goes away before the end; recent_outfits and the user's version are updated once, when the
+# stream ends. With a cache_key, a complete set of Gemini outfits is cached.
+def stream_outfits(user_id, outfits, fallback, cache_key=None):
+    created_at = utc_now()
+    # outfits inserted but not recorded yet (copies: hydrating replaces _id with its string), and as sent
+    saved = []
+    sent = []
+
+    def send(outfit):
+        insert_outfits(user_id, [outfit], created_at)
+        saved.append(dict(outfit))
+        hydrate_outfits([outfit])
+        sent.append(outfit)
+        return sse_event('outfit', outfit)
+
+    def record():
+        new_outfits = saved[:]
+        saved.clear()
+        record_new_outfits(user_id, new_outfits)
+
+    def generate():
+        count = 0
+        source = 'gemini'
+        stopped = False
+        try:
+            outfits_iter = iter(outfits)
+            while True:
+                try:
+                    outfit = next(outfits_iter, None)
+                except Exception as e:
+                    logger.warning('outfit stream stopped after %d outfits: %s', count, e)
+                    stopped = True
+                    break
+                if outfit is None:
+                    break
+                yield send(outfit)
+                count += 1
+            if not count:
+                source = 'local'
+                for outfit in fallback():
+                    yield send(outfit)
+                    count += 1
+            record()
+            if source == 'gemini' and cache_key is not None and not stopped:
+                cache_outfits(user_id, cache_key, sent)
+            yield sse_event('done', {'count': count, 'source': source})
+        except Exception as e:
+            logger.exception('outfit stream failed')
+            yield sse_event('error', {'error': str(e)})
+        finally:
+            # the client went away, or the stream failed, before the end
+            if saved:
+                try:
+                    record()
+                except Exception:
+                    logger.exception('recording the streamed outfits failed')
+
+    return event_stream_response(generate())
+
+# cached outfits (already saved and hydrated) sent the same way, all at once
+def stream_cached_outfits(outfits):
+    def generate():
+        for outfit in outfits:
+            yield sse_event('outfit', outfit)
+        yield sse_event('done', {'count': len(outfits), 'source': 'cache'})
+
+    return event_stream_response(generate())
+
+# prompt builder ---------------------
+# the instructions of outfit and wardrobe prompts are fixed system prompts, so every request starts
+# with the same prefix and Gemini can cache it. The request part lists the wardrobe one line per item
+# under short aliases (i1, i2, ...) that are mapped back to item ids in the answer, and is kept under
+# PROMPT_TOKEN_BUDGET by leaving out the oldest preferences and the least important items (the least
+# relevant, or the most worn when the wardrobe was small enough not to be ranked).
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 3000))
+PREFERENCES_TOKEN_BUDGET = int(os.getenv('PREFERENCES_TOKEN_BUDGET', 300))
+PROMPT_DESCRIPTION_MAX_CHARS = 160
+
+WARDROBE_FORMAT = (
+    "Wardrobe items are listed one per line as `alias: description (category; colors; warmth 1-5; "
+    "formality 1-5; times worn)`. Refer to items only by their alias."
+)
+
+OUTFIT_SYSTEM_PROMPT = (
+    "You are a fashion expert who puts together outfits from the user's wardrobe. Keep in mind the "
+    "color combinations, the style of the clothing items, the weather and the user's day, and prefer "
+    "items that were worn less often. In an outfit: max number of shirts is 1 and max number of pants "
+    "is 1. There can be any number of accessories if they exist. " + WARDROBE_FORMAT + " Answer with a "
+    "JSON array of 3 different outfits in a ```json block. Each outfit object has a `name`, a "
+    "`description`, `clothing_item_ids` (the aliases of its items) and `styling_tips`."
+)
+
+WARDROBE_QUESTION_SYSTEM_PROMPT = (
+    "You are a fashion expert. The user asks you fashion questions and for shopping suggestions, and "
+    "you answer them with their wardrobe in mind. " + WARDROBE_FORMAT + " Answer with a JSON object in "
+    "a ```json block with an `answer` and `clothing_item_ids`, the aliases of the items you suggest."
+)
+
+def estimate_tokens(text):
+    # roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+# one prompt: its sections in order, the item aliases used in them and the estimated tokens per part
+class PromptBuilder:
+    def __init__(self, route, system_instruction, budget=None):
+        self.route = route
+        self.system_instruction = system_instruction
+        self.budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+        self.aliases = {}
+        self.tokens = {'system': estimate_tokens(system_instruction)}
+        self._sections = []
+        self._alias_of = {}
+
+    @property
+    def text(self):
+        return '\n\n'.join(self._sections)
+
+    def remaining(self):
+        return self.budget - sum(tokens for part, tokens in self.tokens.items() if part != 'system')
+
+    def add(self, part, text):
+        self._sections.append(text)
+        self.tokens[part] = self.tokens.get(part, 0) + estimate_tokens(text)
+
+    def alias(self, item_id):
+        item_id = str(item_id)
+        if item_id not in self._alias_of:
+            self._alias_of[item_id] = f'i{len(self.aliases) + 1}'
+            self.aliases[self._alias_of[item_id]] = item_id
+        return self._alias_of[item_id]
+
+    @staticmethod
+    def item_details(item):
+        attributes = item_attributes(item)
+        description = ' '.join(item.get('description', '').split())
+        if len(description) > PROMPT_DESCRIPTION_MAX_CHARS:
+            description = description[:PROMPT_DESCRIPTION_MAX_CHARS].rsplit(' ', 1)[0] + '...'
+        details = [attributes['category'], ', '.join(attributes['colors']), str(attributes['warmth']),
+                   str(attributes['formality']), f"worn {item.get('frequency', 0)}"]
+        return f"{description} ({'; '.join(detail for detail in details if detail)})"
+
+    # items most important first; with fit_budget, the ones past the budget (less `reserve` tokens
+    # kept for later sections) are left out. The rest are listed sorted by `order` when given.
+    # Returns the items that made it into the prompt.
+    def add_items(self, part, heading, items, fit_budget=True, reserve=0, order=None):
+        available = self.remaining() - reserve - estimate_tokens(heading)
+        included = []
+        details = {}
+        for item in items:
+            details[item['_id']] = self.item_details(item)
+            tokens = estimate_tokens(f"i{len(self.aliases) + len(included) + 1}: {details[item['_id']]}")
+            if fit_budget and tokens > available:
+                break
+            available -= tokens
+            included.append(item)
+        if order:
+            included.sort(key=order)
+        self.add(part, '\n'.join([heading] + [f"{self.alias(item['_id'])}: {details[item['_id']]}" for item in included]))
+        return included
+
+    # summary is the user's preferences_summary, already within PREFERENCES_TOKEN_BUDGET
+    def add_preferences(self, summary):
+        self.add('preferences', 'The user has the following preferences: ' + (summary['text'] or 'none') + '.')
+
+    # replace the aliases in the answer's clothing_item_ids with item ids, dropping unknown ones
+    def resolve(self, answer):
+        item_ids = answer.get('clothing_item_ids') if isinstance(answer, dict) else None
+        if isinstance(item_ids, list):
+            resolved = [self.aliases.get(str(alias).strip()) for alias in item_ids]
+            answer['clothing_item_ids'] = list(dict.fromkeys(item_id for item_id in resolved if item_id))
+        return answer
+
+    def report(self):
+        metrics.inc('prompts_total', {'route': self.route})
+        for part, tokens in self.tokens.items():
+            metrics.inc('prompt_tokens_total', {'route': self.route, 'part': part}, tokens)
+        logger.debug('%s prompt: about %d tokens (%s)', self.route, sum(self.tokens.values()),
+                     ', '.join(f'{part} {tokens}' for part, tokens in self.tokens.items()))
+        return self
+
+def user_profile_text(user):
+    user_age, user_gender = user_age_and_gender(user)
+    return f'The user is {user_age} years old and their gender is {user_gender}.'
+
+# outfit result cache ---------------------
+# Gemini's outfits are remembered per request context: the route, the user's available items and how
+# often each was worn, the temperature bucket, the normalized weather and day text, the base items and
+# the user's profile and preferences version. The same request in the same context answers with the
+# saved outfits without building a prompt or calling Gemini, until OUTFIT_CACHE_TTL_SECONDS pass or
+# something in the context changes; "fresh": true in the body skips the lookup. The outfit ids are
+# kept in an in-process LRU in front of a Mongo collection with a TTL index, like weather summaries.
+OUTFIT_CACHE_TTL_SECONDS = int(os.getenv('OUTFIT_CACHE_TTL_SECONDS', 6 * 3600))
+OUTFIT_CACHE_TEMPERATURE_BUCKET = float(os.getenv('OUTFIT_CACHE_TEMPERATURE_BUCKET', 3))
+outfit_cache = LRUCache(max_size=int(os.getenv('OUTFIT_CACHE_MAX_ENTRIES', 1024)), ttl=OUTFIT_CACHE_TTL_SECONDS)
+outfit_cache_counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'fresh': 0}
+
+def normalize_context_text(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', str(text or '').lower()))
+
+def outfit_cache_key(kind, user, items, temperature, weather_description, day_description, base_items=()):
+    parsed = parse_temperature(temperature)
+    payload = json.dumps({
+        'kind': kind,
+        'user_id': str(user['_id']),
+        'items': sorted([str(item['_id']), item.get('frequency', 0)] for item in items),
+        'temperature': int(parsed // OUTFIT_CACHE_TEMPERATURE_BUCKET) if parsed is not None else normalize_context_text(temperature),
+        'weather': normalize_context_text(weather_description),
+        'day': normalize_context_text(day_description),
+        'base_items': sorted(str(item['_id']) for item in base_items),
+        'profile': [user.get('dob'), user.get('gender'), user.get('preferences_version', 0)],
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def count_outfit_cache(result):
+    outfit_cache_counters[result] += 1
+    metrics.inc('outfit_cache_requests_total', {'result': result})
+
+# share of the lookups (not counting fresh requests) answered from the cache
+def outfit_cache_hit_rate():
+    hits = outfit_cache_counters['memory_hits'] + outfit_cache_counters['db_hits']
+    lookups = hits + outfit_cache_counters['misses']
+    return round(hits / lookups, 4) if lookups else None
+
+# saved outfits by id, in the order given; ids that are not in the outfits collection are skipped
+def load_saved_outfits(user_id, object_ids):
+    outfits = {outfit['_id']: outfit for outfit in db.outfits.find({'_id': {'$in': object_ids}, 'user_id': user_id})}
+    return [outfits[oid] for oid in object_ids if oid in outfits]
+
+# the cached outfits for this key, hydrated, or None on a miss. An entry whose outfits were archived
+# since is a miss.
+def get_cached_outfits(user_id, key):
+    outfit_ids = outfit_cache.get(key)
+    result = 'memory_hits'
+    if outfit_ids is None:
+        cached = db.outfit_results.find_one({'_id': key, 'user_id': user_id, 'expires_at': {'$gt': utc_now()}})
+        if not cached:
+            count_outfit_cache('misses')
+            return None
+        outfit_ids = cached['outfit_ids']
+        result = 'db_hits'
+        # kept in memory for what is left of its TTL; pymongo returns naive UTC datetimes
+        outfit_cache.set(key, outfit_ids, ttl=(cached['expires_at'] - utc_now().replace(tzinfo=None)).total_seconds())
+    outfits = load_saved_outfits(user_id, outfit_ids)
+    if len(outfits) < len(outfit_ids):
+        outfit_cache.delete(key)
+        count_outfit_cache('misses')
+        return None
+    count_outfit_cache(result)
+    return hydrate_outfits(outfits)
+
+def cache_outfits(user_id, key, outfits):
+    outfit_ids = [ObjectId(outfit['_id']) for outfit in outfits]
+    outfit_cache.set(key, outfit_ids)
+    db.outfit_results.update_one({'_id': key}, {'$set': {
+        'user_id': user_id,
+        'outfit_ids': outfit_ids,
+        'expires_at': utc_now() + datetime.timedelta(seconds=OUTFIT_CACHE_TTL_SECONDS),
+    }}, upsert=True)
+
+# the cached outfits unless the request asks for fresh ones; None when they have to be generated
+def lookup_cached_outfits(user_id, key, params):
+    if params.get('fresh'):
+        count_outfit_cache('fresh')
+        return None
+    return get_cached_outfits(user_id, key)
+
+# outfit requests ---------------------
+# the work behind /outfits/generate, /outfits/build and /gemini, shared by the routes and the job
+# queue workers. prepare_* check the parameters against the user's wardrobe and return how to build
+# the prompt; problems with the request are raised as OutfitRequestError with the status to answer with.
+class OutfitRequestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def user_age_and_gender(user):
     # Collect user's age and gender from the database
     user_dob = user.get('dob')
     if not user_dob:
-        return jsonify({'error': 'User date of birth is required'}), 400
+        raise OutfitRequestError('User date of birth is required')
     # Calculate user's age
     user_dob = datetime.datetime.strptime(user_dob, '%Y-%m-%d')
     user_age = (datetime.datetime.now() - user_dob).days // 365
     user_gender = user.get('gender')
     if not user_dob or not user_gender:
-        return jsonify({'error': 'User date of birth and gender are required'}), 400
+        raise OutfitRequestError('User date of birth and gender are required')
+    return user_age, user_gender
+
+# returns (cache_key, build_prompt, local_outfits): build_prompt() selects the candidate items and
+# returns the PromptBuilder, and is only called when the outfits are not cached; cache_key and
+# build_prompt are None in local mode. local_outfits() builds the outfits with the local engine, in
+# local mode and when Gemini fails.
+def prepare_generate_outfit(user, params):
+    # Fetch the available clothing items for the user that suit the temperature
+    temperature = params.get('temperature')
+    clothing_items = load_outfit_candidates(user['_id'], temperature)
     
-
-    # Use Gemini to generate outfit recommendations
-    try:
-        prompt = f"You are a fashion expert. Generate an outfit recommendation based on the following clothing items. Read the description of each item and generate 3 different outfits from them. Make sure to keep in mind the color combinations, the style of the clothing items, and the current weather conditions. The weather is described as follows: {weather_description} with a temperature of {temperature}°C. The user describes their day as follows: {day_description}. And the user has the following preferences: {preferences}. The user is " + str(user_age) + " years old and their gender is " + user_gender + ". In the outfit: max number of shirts is 1 and max number of pants is 1. there can be any number of accessories if it exists. Consider all of these factors and the output should contain a JSON array, with each object having one outfit. Each outfit object should have a name, description, list of ids of clothing items (the field should be named `clothing_item_ids`) in the outfits, and additional styling tips. \n\n"
-        
-        prompt += str(clothing_items)
-        
-        outfit_description = query_gemini(prompt)
-
-        # Add user id to each outfit and save the outfit in the database
-        for outfit in outfit_description:
-            outfit['user_id'] = user['_id']
-            outfit['created_at'] = datetime.datetime.now()
-            db.outfits.insert_one(outfit)
-        
-        # Return the outfits with the outfit ids, sort by time and get first 3 outfits
-        outfits = list(db.outfits.find({'user_id': user['_id']}).sort('created_at', -1).limit(3))
-
-        # Get the item from the item id and add it to the outfit
-        for outfit in outfits:
-            outfit['_id'] = str(outfit['_id'])
-            clothing_item_ids = outfit.get('clothing_item_ids', [])
-            
-            # Ensure the clothing_item_ids are converted to ObjectId format before querying the database
-            object_ids = [ObjectId(item_id) for item_id in clothing_item_ids if ObjectId.is_valid(item_id)]
-            
-            if object_ids:
-                clothing_items_list = list(db.clothing_items.find({'_id': {'$in': object_ids}}))
-                outfit['clothing_items_list'] = clothing_items_list if clothing_items_list else []
-                
-                # Convert the ObjectId of each clothing item to string
-                for item in outfit['clothing_items_list']:
-                    item['_id'] = str(item['_id'])
-        
-        # Recursively convert ObjectId fields to strings
-        outfits = convert_objectid(outfits)
-        
-        return jsonify(outfits)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-# Helper function to convert ObjectId fields to strings recursively
-def convert_objectid(data):
-    if isinstance(data, list):
-        return [convert_objectid(item) for item in data]
-    elif isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, ObjectId):
-                data[key] = str(value)
-            elif isinstance(value, (list, dict)):
-                data[key] = convert_objectid(value)
-    return data
+    if not clothing_items:
+        raise OutfitRequestError('No clothing items found for user', 404)
     
-# build an outfit around a specific clothing item
-@app.route('/outfits/build', methods=['POST'])
-@jwt_required()
-def build_outfit():
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    if not user:
-        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
-    # get all clothing items from the database for the user which are available
-    clothing_items = list(db.clothing_items.find({'user_id': user['_id'], 'available': True}))
+    # Get data from the request
+    weather_description = params.get('weather_description')
+    day_description = params.get('day_description')
+
+    if not weather_description or temperature is None:
+        raise OutfitRequestError('Weather description and temperature are required')
+
+    mode = params.get('mode', 'gemini')
+    if mode not in OUTFIT_MODES:
+        raise OutfitRequestError(f"mode must be one of {', '.join(OUTFIT_MODES)}")
+    available_items = clothing_items
+    # the user's date of birth and gender are required in local mode too
+    profile_text = user_profile_text(user)
+
+    def local_outfits():
+        return generate_local_outfits(available_items, temperature, weather_description, day_description)
+
+    if mode == 'local':
+        return None, None, local_outfits
+
+    def build_prompt():
+        # Keep only the items most relevant to the weather and the day to keep the prompt small
+        clothing_items = select_candidate_items(user['_id'], available_items, f"{weather_description}, {temperature}°C. {day_description or ''}")
+
+        prompt = PromptBuilder('generate', OUTFIT_SYSTEM_PROMPT)
+        prompt.add('profile', profile_text)
+        prompt.add_preferences(preferences_summary(user))
+        request_text = f"The weather is described as follows: {weather_description} with a temperature of {temperature}°C. The user describes their day as follows: {day_description}. Generate 3 different outfits from the wardrobe."
+        # the least important candidates are the first to go over budget; the rest are listed least worn first
+        prompt.add_items('wardrobe', 'Wardrobe:', clothing_items, reserve=estimate_tokens(request_text), order=lambda item: item['frequency'])
+        prompt.add('request', request_text)
+        return prompt.report()
+
+    cache_key = outfit_cache_key('generate', user, available_items, temperature, weather_description, day_description)
+    return cache_key, build_prompt, local_outfits
+
+# like prepare_generate_outfit, for outfits built around the base_items_ids items
+def prepare_build_outfit(user, params):
+    # get the clothing items from the database for the user which are available and suit the temperature
+    temperature = params.get('temperature')
+    clothing_items = load_outfit_candidates(user['_id'], temperature)
     if not clothing_items:
-        return jsonify({'error': 'No clothing items found for user'}), 404
-    # sort the clothing items by frequency in increasing order
-    clothing_items.sort(key=lambda x: x['frequency'])
-    # get only the id, description and frequency of the clothing items
-    clothing_items = [{'id': str(item['_id']), 'description': item['description'], 'frequency': item['frequency']} for item in clothing_items]
+        raise OutfitRequestError('No clothing items found for user', 404)
 
     # Get weather data from the request
-    weather_description = request.json.get('weather_description')
-    day_description = request.json.get('day_description')
-    preferences = str(user['preferences'])
-    temperature = request.json.get('temperature')
-    base_items_ids = request.json.get('base_items_ids')
+    weather_description = params.get('weather_description')
+    day_description = params.get('day_description')
+    base_items_ids = params.get('base_items_ids')
 
-    # Collect user's age and gender from the database
-    user_dob = user.get('dob')
-    if not user_dob:
-        return jsonify({'error': 'User date of birth is required'}), 400
-    # Calculate user's age
-    user_dob = datetime.datetime.strptime(user_dob, '%Y-%m-%d')
-    user_age = (datetime.datetime.now() - user_dob).days // 365
-    user_gender = user.get('gender')
-    if not user_dob or not user_gender:
-        return jsonify({'error': 'User date of birth and gender are required'}), 400
-    
-    # print("helo",user_age, user_gender, user_dob)
+    # the user's date of birth and gender are checked before the base items
+    user_age_and_gender(user)
 
     # Convert base_items_ids to ObjectId
     base_items_object_ids = [ObjectId(item_id) for item_id in base_items_ids if ObjectId.is_valid(item_id)]
     
-    # Fetch base items from the database
-    base_items = list(db.clothing_items.find({'_id': {'$in': base_items_object_ids}}))
+    # Fetch base items from the database (kept in the identity map for hydrating the outfits later)
+    item_map = load_clothing_items(base_items_object_ids)
+    base_items = [item_map[oid] for oid in dict.fromkeys(base_items_object_ids) if oid in item_map]
     if not base_items:
-        return jsonify({'error': 'Base Clothing item not found'}), 404
+        raise OutfitRequestError('Base Clothing item not found', 404)
 
     if not weather_description or temperature is None:
-        return jsonify({'error': 'Weather description and temperature are required'}), 400
-    
-    # ask gemini for outfit recommendation
+        raise OutfitRequestError('Weather description and temperature are required')
+
+    mode = params.get('mode', 'gemini')
+    if mode not in OUTFIT_MODES:
+        raise OutfitRequestError(f"mode must be one of {', '.join(OUTFIT_MODES)}")
+    available_items = clothing_items
+
+    def local_outfits():
+        return generate_local_outfits(available_items, temperature, weather_description, day_description, base_items)
+
+    if mode == 'local':
+        return None, None, local_outfits
+
+    profile_text = user_profile_text(user)
+
+    def build_prompt():
+        # keep only the items that go best with the base items in this weather, plus the base items themselves
+        query_text = f"{weather_description}, {temperature}°C. {day_description or ''} " + ' '.join(item['description'] for item in base_items)
+        clothing_items = select_candidate_items(user['_id'], available_items, query_text, required_ids={item['_id'] for item in base_items})
+        base_ids = {item['_id'] for item in base_items}
+
+        prompt = PromptBuilder('build', OUTFIT_SYSTEM_PROMPT)
+        prompt.add('profile', profile_text)
+        prompt.add_preferences(preferences_summary(user))
+        request_text = "The day's weather is as follows: " + (day_description if day_description else "typical day") + ". Generate 3 different outfits built around the base items: each outfit contains at least one base item and at least one other item."
+        # base items are always listed; of the others, the least important are the first to go over budget
+        prompt.add_items('base items', 'Base items:', base_items, fit_budget=False)
+        prompt.add_items('wardrobe', 'Other items:', [item for item in clothing_items if item['_id'] not in base_ids],
+                         reserve=estimate_tokens(request_text), order=lambda item: item['frequency'])
+        prompt.add('request', request_text)
+        return prompt.report()
+
+    cache_key = outfit_cache_key('build', user, available_items, temperature, weather_description, day_description, base_items)
+    return cache_key, build_prompt, local_outfits
+
+OUTFIT_PREPARERS = {'generate': prepare_generate_outfit, 'build': prepare_build_outfit}
+
+# the cached outfits when there are some (unless params ask for fresh ones); otherwise ask Gemini (the
+# local engine steps in when it times out, is unavailable or returns no outfit list), save them in one
+# write and return exactly these outfits with their items. Returns (outfits, source), source being
+# 'cache', 'gemini' or 'local'; only Gemini's outfits are cached.
+def run_outfit_request(user_id, params, cache_key, build_prompt, local_outfits):
+    outfit_description = None
+    if build_prompt is not None:
+        cached = lookup_cached_outfits(user_id, cache_key, params)
+        if cached is not None:
+            return cached, 'cache'
+        prompt = build_prompt()
+        try:
+            answer = query_gemini(prompt.text, timeout=OUTFIT_GEMINI_TIMEOUT_SECONDS, system_instruction=prompt.system_instruction)
+        except GeminiUnavailable:
+            answer = None
+        if isinstance(answer, list):
+            outfit_description = [prompt.resolve(outfit) for outfit in answer if isinstance(outfit, dict)]
+    source = 'gemini' if outfit_description else 'local'
+    if not outfit_description:
+        outfit_description = local_outfits()
+    outfits = persist_outfits(user_id, outfit_description)
+    # get the items for all outfits in one query and add them to each outfit
+    hydrate_outfits(outfits)
+    if source == 'gemini':
+        cache_outfits(user_id, cache_key, outfits)
+    return outfits, source
+
+# kind is 'generate' or 'build'; with "async": true the request is queued as a job instead
+def outfit_response(user, kind, params):
+    if params.get('async'):
+        return enqueue_job_response(user, kind, params)
     try:
-        # model = genai.GenerativeModel("models/gemini-1.5-flash")
-        prompt = "You are a fashion expert, Generate an outfit recommendation based on the following clothing items. the outfits you generate should all consist of these items, these items should be the base of outfits\n" + str(base_items) + "\n\nread the description of each item and generate 3 different outfits from them. make sure to keep in mind the color combinations and the style of the clothing items. the user has the following preferences:" + preferences + " and the day's weather is as follows: " + (day_description if day_description else "typical day") + ". The user is " + str(user_age) + " years old and their gender is " + user_gender + ". In the outfit: max number of shirts is 1 and max number of pants is 1. there can be any number of accessories if it exists. Consider all of these factors and the output should contain a JSON array, with each object having one outfit. Each outfit object should have a name, description, list of ids of clothing items (the field should be named `clothing_item_ids` and contain atleast one clothing item plus the base item) in the outfits, and additional styling tips. \n\n" + str(clothing_items)
-
+        cache_key, build_prompt, local_outfits = OUTFIT_PREPARERS[kind](user, params)
+    except OutfitRequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    if wants_event_stream():
+        if build_prompt is None:
+            return stream_outfits(user['_id'], (), local_outfits)
+        cached = lookup_cached_outfits(user['_id'], cache_key, params)
+        if cached is not None:
+            return stream_cached_outfits(cached)
+        return stream_outfits(user['_id'], stream_gemini_outfits(build_prompt), local_outfits, cache_key)
+    try:
+        outfits, source = run_outfit_request(user['_id'], params, cache_key, build_prompt, local_outfits)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    response = jsonify(outfits)
+    if build_prompt is not None:
+        response.headers['X-Outfit-Cache'] = 'hit' if source == 'cache' else 'miss'
+    return response
 
-        outfit_description = query_gemini(prompt)
-        # add user id to each outfit and save the outfit in the database
-        for outfit in outfit_description:
-            outfit['user_id'] = user['_id']
-            outfit['created_at'] = datetime.datetime.now()
-            db.outfits.insert_one(outfit)
-        # return the outfits with the outfit ids, sort by time and get first 3 outfits
-        outfits = list(db.outfits.find({'user_id': user['_id']}).sort('created_at', -1).limit(3))
+@app.route('/outfits/generate', methods=['POST'])
+@jwt_required()
+def generate_outfit():
+    user = get_current_user()
+    
+    if not user:
+        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
+    
+    return outfit_response(user, 'generate', request.json)
 
-        # get the item from the item id and add it to the outfit
-        for outfit in outfits:
-            outfit['_id'] = str(outfit['_id'])
-            clothing_item_ids = outfit.get('clothing_item_ids', [])
-            # ensure the clothing_item_ids are converted to ObjectId format before querying the database
-            object_ids = [ObjectId(item_id) for item_id in clothing_item_ids if ObjectId.is_valid(item_id)]
-            if object_ids:
-                clothing_items_list = list(db.clothing_items.find({'_id': {'$in': object_ids}}))
-                outfit['clothing_items_list'] = clothing_items_list if clothing_items_list else []
-                # convert the ObjectId of each clothing item to string
-                for item in outfit['clothing_items_list']:
-                    item['_id'] = str(item['_id'])
+# build an outfit around a specific clothing item
+@app.route('/outfits/build', methods=['POST'])
+@jwt_required()
+def build_outfit():
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
+    return outfit_response(user, 'build', request.json)
+
+# job queue ---------------------
+# with "async": true in the body, /outfits/generate, /outfits/build and /gemini queue the request in
+# the jobs collection and answer 202 with the job straight away, so the HTTP worker is not held for
+# the Gemini call. `flask run-workers` starts worker processes that claim jobs with find_one_and_update,
+# run them and store the result, which clients poll from /jobs/<id>. Requests are checked before they
+# are queued, so one that cannot succeed is answered with its error instead. While a job is queued or
+# running, the same request from the same user gets that job back. A job whose worker died is claimed
+# again once its lease runs out; a failed attempt is retried after an exponential backoff (not_before).
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 120))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv('JOB_RETRY_BACKOFF_SECONDS', 5))
+JOB_RETRY_MAX_BACKOFF_SECONDS = float(os.getenv('JOB_RETRY_MAX_BACKOFF_SECONDS', 300))
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', 1))
+JOB_WORKER_PROCESSES = int(os.getenv('JOB_WORKER_PROCESSES', 2))
+# fields that only say how to answer, not what to generate
+JOB_CONTROL_FIELDS = ('async', 'stream')
+
+def run_outfit_job(user, kind, params):
+    outfits, _ = run_outfit_request(user['_id'], params, *OUTFIT_PREPARERS[kind](user, params))
+    return {'outfit_ids': [outfit['_id'] for outfit in outfits]}
+
+def run_gemini_job(user, kind, params):
+    prompt = prepare_ask_gemini(user, params)()
+    return {'answer': prompt.resolve(query_gemini(prompt.text, system_instruction=prompt.system_instruction))}
+
+# kind -> fn(user, kind, params) returning the job's result
+JOB_RUNNERS = {'generate': run_outfit_job, 'build': run_outfit_job, 'gemini': run_gemini_job}
+# kind -> fn(user, params) raising OutfitRequestError for a request that cannot succeed, run before
+# queuing it; building the prompt is left to the worker. prepare_ask_gemini is defined further down.
+JOB_PREPARERS = {**OUTFIT_PREPARERS, 'gemini': lambda user, params: prepare_ask_gemini(user, params)}
+
+def job_dedup_key(user_id, kind, params):
+    payload = json.dumps({'user_id': str(user_id), 'kind': kind, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# returns (job, created); created is False when the same job is already queued or running. Only
+# those carry active_key, whose unique index makes two racing requests share one job.
+def enqueue_job(user_id, kind, params):
+    params = {key: value for key, value in params.items() if key not in JOB_CONTROL_FIELDS}
+    active_key = job_dedup_key(user_id, kind, params)
+    while True:
+        existing = db.jobs.find_one({'active_key': active_key})
+        if existing:
+            metrics.inc('jobs_enqueued_total', {'kind': kind, 'deduplicated': 'true'})
+            return existing, False
+        now = utc_now()
+        job = {'user_id': user_id, 'kind': kind, 'params': params, 'active_key': active_key,
+               'status': 'queued', 'attempts': 0, 'created_at': now, 'updated_at': now}
+        try:
+            db.jobs.insert_one(job)
+        except DuplicateKeyError:
+            # an identical request was queued between the lookup and the insert
+            continue
+        metrics.inc('jobs_enqueued_total', {'kind': kind, 'deduplicated': 'false'})
+        return job, True
+
+# the job as clients see it; a finished job carries its outfits (hydrated) or Gemini's answer
+def job_response(job):
+    response = {field: job[field] for field in ('_id', 'kind', 'status', 'attempts', 'created_at', 'updated_at', 'not_before', 'error') if field in job}
+    result = job.get('result') if job['status'] == 'done' else None
+    if result and 'outfit_ids' in result:
+        response['outfits'] = hydrate_outfits(load_saved_outfits(job['user_id'], [ObjectId(outfit_id) for outfit_id in result['outfit_ids']]))
+    elif result:
+        response['answer'] = result['answer']
+    return response
+
+def enqueue_job_response(user, kind, params):
+    try:
+        JOB_PREPARERS[kind](user, params)
+    except OutfitRequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    job, created = enqueue_job(user['_id'], kind, params)
+    response = jsonify({**job_response(job), 'deduplicated': not created})
+    response.status_code = 202
+    response.headers['Location'] = f"/jobs/{job['_id']}"
+    return response
+
+# the oldest queued job that is not backing off, or a running one whose lease ran out, now leased to this worker
+def claim_job(worker_id):
+    now = utc_now()
+    return db.jobs.find_one_and_update(
+        {'$or': [{'status': 'queued', 'not_before': {'$not': {'$gt': now}}},
+                 {'status': 'running', 'lease_expires_at': {'$lte': now}}]},
+        {'$set': {'status': 'running', 'worker': worker_id, 'updated_at': now,
+                  'lease_expires_at': now + datetime.timedelta(seconds=JOB_LEASE_SECONDS)},
+         '$unset': {'not_before': ''},
+         '$inc': {'attempts': 1}},
+        sort=[('created_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
 
-        
-        outfits = convert_objectid(outfits)
-        return jsonify(outfits)
+# attempts fences the update: a worker whose lease ran out cannot overwrite the job once it was claimed again
+def update_claimed_job(job, status, fields=None, unset=()):
+    now = utc_now()
+    fields = dict(fields or {}, status=status, updated_at=now)
+    unset = {field: '' for field in ('lease_expires_at', *unset)}
+    if status in ('done', 'failed'):
+        fields['finished_at'] = now
+        unset['active_key'] = ''
+    db.jobs.update_one({'_id': job['_id'], 'attempts': job['attempts']}, {'$set': fields, '$unset': unset})
+
+# the wait before retrying a job whose attempt number `attempts` failed
+def job_retry_backoff(attempts):
+    return datetime.timedelta(seconds=min(JOB_RETRY_MAX_BACKOFF_SECONDS, JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)))
+
+def run_job(job):
+    if job['attempts'] > JOB_MAX_ATTEMPTS:
+        update_claimed_job(job, 'failed', {'error': 'The job was abandoned by its workers'})
+        return
+    try:
+        user = db.users.find_one({'_id': job['user_id']})
+        if not user:
+            raise OutfitRequestError('User not found', 404)
+        result = JOB_RUNNERS[job['kind']](user, job['kind'], job['params'])
+    except OutfitRequestError as e:
+        update_claimed_job(job, 'failed', {'error': str(e), 'error_status': e.status})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-# get all outfits for the user
+        logger.exception('job %s failed on attempt %d', job['_id'], job['attempts'])
+        # back in the queue for another attempt after a backoff, unless this was the last one
+        if job['attempts'] < JOB_MAX_ATTEMPTS:
+            update_claimed_job(job, 'queued', {'error': str(e), 'not_before': utc_now() + job_retry_backoff(job['attempts'])})
+        else:
+            update_claimed_job(job, 'failed', {'error': str(e)})
+    else:
+        update_claimed_job(job, 'done', {'result': result}, unset=('error',))
+
+# with burst, the worker exits once the queue is empty
+def run_job_worker(burst=False):
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    start_log_listener()
+    logger.info('job worker %s started', worker_id)
+    while True:
+        try:
+            job = claim_job(worker_id)
+            if job is not None:
+                run_job(job)
+                continue
+        except Exception:
+            # e.g. mongo is unreachable; a job that was not finished is claimed again after its lease
+            if burst:
+                raise
+            logger.exception('job worker %s failed', worker_id)
+        if burst:
+            return
+        time.sleep(JOB_POLL_SECONDS)
+
+@app.cli.command('run-workers')
+@click.option('--processes', default=JOB_WORKER_PROCESSES, show_default=True, help='Worker processes to start.')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty instead of waiting for jobs.')
+def run_workers_command(processes, burst):
+    import multiprocessing
+    # spawned rather than forked, so every worker creates its own mongo client
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_job_worker, args=(burst,)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+# poll a job; queued and running jobs come with a Retry-After hint
+@app.route('/jobs/<id>', methods=['GET'])
+@jwt_required()
+def get_job(id):
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
+    job = db.jobs.find_one({'_id': ObjectId(id), 'user_id': user_id}) if ObjectId.is_valid(id) else None
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    response = jsonify(job_response(job))
+    if job['status'] in ('queued', 'running'):
+        response.headers['Retry-After'] = str(max(1, round(JOB_POLL_SECONDS)))
+    return response
+
+# get all outfits for the user, newest first
+# supports ?limit=&cursor= pagination and ?archived=true to read the archived outfits
 @app.route('/outfits', methods=['GET'])
 @jwt_required()
+@cached_per_user_version
 def get_outfits():
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    if not user:
+    user_id = get_current_user_id()
+    if not user_id:
         return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
-    outfits = list(db.outfits.find({'user_id': user['_id']}))
-    for outfit in outfits:
-        outfit['_id'] = str(outfit['_id'])
-        clothing_item_ids = outfit.get('clothing_item_ids', [])
-        
-        # Ensure the clothing_item_ids are converted to ObjectId format before querying the database
-        object_ids = [ObjectId(item_id) for item_id in clothing_item_ids if ObjectId.is_valid(item_id)]
-        
-        if object_ids:
-            clothing_items_list = list(db.clothing_items.find({'_id': {'$in': object_ids}}))
-            outfit['clothing_items_list'] = clothing_items_list if clothing_items_list else []
-            
-            # Convert the ObjectId of each clothing item to string
-            for item in outfit['clothing_items_list']:
-                item['_id'] = str(item['_id'])
-    
-    # Recursively convert ObjectId fields to strings
-    outfits = convert_objectid(outfits)
-    
-    return jsonify(outfits)
+
+    try:
+        query, limit = parse_outfits_query(user_id, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    collection = db.outfits_archive if request.args.get('archived', '').lower() == 'true' else db.outfits
+    cursor = collection.find(query).sort(OUTFIT_SORT)
+    if limit is not None:
+        # fetch one extra outfit to know whether another page exists
+        cursor = cursor.limit(limit + 1)
+    outfits = list(cursor)
+    next_cursor = None
+    if limit is not None and len(outfits) > limit:
+        outfits = outfits[:limit]
+        next_cursor = encode_wardrobe_cursor(outfits[-1])
+    hydrate_outfits(outfits)
+
+    response = jsonify(outfits)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# the newest outfits with a summary of their items, in one read
+@app.route('/outfits/recent', methods=['GET'])
+@jwt_required()
+@cached_per_user_version
+def get_recent_outfits():
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
+    document = db.recent_outfits.find_one({'_id': user_id}) or rebuild_recent_outfits(user_id)
+    return jsonify(document['outfits'])
 
 # get outfit by id
 @app.route('/outfits/<id>', methods=['GET'])
 @jwt_required() 
+@cached_per_user_version
 def get_outfit(id):
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
-    if not user:
+    user_id = get_current_user_id()
+    if not user_id:
         return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
-    outfit = db.outfits.find_one({'_id': ObjectId(id), 'user_id': user['_id']})
+    outfit = db.outfits.find_one({'_id': ObjectId(id), 'user_id': user_id}) or db.outfits_archive.find_one({'_id': ObjectId(id), 'user_id': user_id})
     if not outfit:
         return jsonify({'error': 'Outfit not found'}), 404
     
-    outfit['_id'] = str(outfit['_id'])
-    clothing_item_ids = outfit.get('clothing_item_ids', [])
-    
-    # Ensure the clothing_item_ids are converted to ObjectId format before querying the database
-    object_ids = [ObjectId(item_id) for item_id in clothing_item_ids if ObjectId.is_valid(item_id)]
-    
-    if object_ids:
-        clothing_items_list = list(db.clothing_items.find({'_id': {'$in': object_ids}}))
-        outfit['clothing_items_list'] = clothing_items_list if clothing_items_list else []
-        
-        # Convert the ObjectId of each clothing item to string
-        for item in outfit['clothing_items_list']:
-            item['_id'] = str(item['_id'])
-    
-    outfit = convert_objectid(outfit)
+    hydrate_outfits([outfit])
 
     return jsonify(outfit)
 
-# Initialize the scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
+# laundry timeout ---------------------
+# a used item stays unavailable until its available_at timestamp. Reads treat expired items as
+# available straight away, and a periodic sweep flips the stored flag with a single update_many.
+LAUNDRY_TIMEOUT = datetime.timedelta(hours=int(os.getenv('LAUNDRY_TIMEOUT_HOURS', 48)))
+LAUNDRY_SWEEP_INTERVAL_SECONDS = int(os.getenv('LAUNDRY_SWEEP_INTERVAL_SECONDS', 300))
+# the first sweep runs one interval after startup, so a cold start does not pay for it
+_last_laundry_sweep = time.monotonic()
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+# mongo filter for items that are available now, whether or not the sweep has caught up
+def available_filter(now=None):
+    return {'$or': [{'available': True}, {'available_at': {'$lte': now or utc_now()}}]}
+
+def unavailable_filter(now=None):
+    return {'available': False, 'available_at': {'$not': {'$lte': now or utc_now()}}}
+
+# fix the available flag of an item read before the sweep got to it
+def apply_laundry_expiry(item, now=None):
+    available_at = item.get('available_at')
+    if available_at is not None and not item.get('available', True):
+        # pymongo returns naive UTC datetimes
+        if available_at <= (now or utc_now()).replace(tzinfo=None):
+            item['available'] = True
+            del item['available_at']
+    return item
 
-def set_clothing_items_available(clothing_item_ids):
-    db.clothing_items.update_many(
-        {'_id': {'$in': clothing_item_ids}},
-        {'$set': {'available': True}}
+def sweep_expired_laundry():
+    result = db.clothing_items.update_many(
+        {'available_at': {'$lte': utc_now()}},
+        {'$set': {'available': True}, '$unset': {'available_at': ''}}
     )
+    return result.modified_count
+
+def sweep_expired_laundry_safely():
+    try:
+        sweep_expired_laundry()
+    except Exception:
+        logger.exception('laundry sweep failed')
+
+# the periodic sweep runs once the response has been sent, so no request waits for it; reads do not
+# depend on it (see available_filter and apply_laundry_expiry)
+@app.after_request
+def sweep_expired_laundry_periodically(response):
+    global _last_laundry_sweep
+    if time.monotonic() - _last_laundry_sweep >= LAUNDRY_SWEEP_INTERVAL_SECONDS:
+        _last_laundry_sweep = time.monotonic()
+        response.call_on_close(sweep_expired_laundry_safely)
+    return response
+
+@app.cli.command('sweep-laundry')
+def sweep_laundry_command():
+    click.echo(f'{sweep_expired_laundry()} clothing items are available again')
 
 # use the outfit and set laundry timeout for the clothing items
 @app.route('/outfits/use/<id>', methods=['POST'])
 @jwt_required()
 def use_outfit(id):
     try:
-        email = get_jwt_identity()
-        user = db.users.find_one({'email': email})
-        if not user:
+        user_id = get_current_user_id()
+        if not user_id:
             return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
-        outfit = db.outfits.find_one({'_id': ObjectId(id), 'user_id': user['_id']})
+        outfit = db.outfits.find_one({'_id': ObjectId(id), 'user_id': user_id}) or db.outfits_archive.find_one({'_id': ObjectId(id), 'user_id': user_id})
         if not outfit:
             return jsonify({'error': 'Outfit not found'}), 404
         # get the clothing items in the outfit
@@ -637,18 +3033,23 @@ def use_outfit(id):
         if not clothing_item_ids:
             return jsonify({'error': 'No clothing items found in the outfit'}), 404
         
-        clothing_items = list(db.clothing_items.find({'_id': {'$in': clothing_item_ids}}))
-        # set the clothing items to unavailable and increase the frequency
-        for item in clothing_items:
-            db.clothing_items.update_one({'_id': item['_id']}, {'$set': {'available': False}, '$inc': {'frequency': 1}})
-        
-        # Schedule a job to set the clothing items back to available after a timeout (e.g., 48 hours)
-        scheduler.add_job(
-            set_clothing_items_available,
-            'date',
-            run_date=datetime.datetime.now() + datetime.timedelta(hours=48),
-            args=[clothing_item_ids]
-        )
+        # used outfits are never archived; an archived one moves back to outfits, copied before it is
+        # deleted from the archive like archive_user_outfits does the other way
+        used_at = utc_now()
+        if 'archived_at' in outfit:
+            restored = dict(outfit, used_at=used_at)
+            del restored['archived_at']
+            try:
+                db.outfits.insert_one(restored)
+            except DuplicateKeyError:
+                # restored by a concurrent request
+                pass
+            db.outfits_archive.delete_one({'_id': outfit['_id']})
+        db.outfits.update_one({'_id': outfit['_id']}, {'$set': {'used_at': used_at}})
+        db.recent_outfits.update_one({'_id': user_id, 'outfits._id': outfit['_id']}, {'$set': {'outfits.$.used_at': used_at}})
+
+        # set the clothing items to unavailable until the laundry timeout passes and increase the frequency
+        mark_items_used(user_id, clothing_item_ids)
         
         return jsonify({'message': 'Outfit used successfully'})
     except Exception as e:
@@ -657,9 +3058,8 @@ def use_outfit(id):
 #####################
 
 # gemini prompt and parse json response
-def query_gemini(prompt):
-    model = genai.GenerativeModel(model_name="models/gemini-1.5-flash")
-    response = model.generate_content([prompt])
+def query_gemini(prompt, timeout=None, system_instruction=None):
+    response = gemini_client.generate_content([prompt], timeout=timeout, system_instruction=system_instruction)
 
     if not response.candidates or not response.candidates[0].content.parts:
         return {"error": "Invalid response structure from API"}
@@ -677,46 +3077,58 @@ def query_gemini(prompt):
         json_content = match.group(1).strip()
         try:
             result = json.loads(json_content)
-            print(result)
+            logger.debug('gemini answered %s', result)
             return result
         except json.JSONDecodeError:
             return {"error": "Invalid JSON in response"}
     else:
         return {"error": "No JSON found in response"}
 
+# checks a question about the user's wardrobe and returns build_prompt(), which selects the items
+# relevant to it and returns the PromptBuilder
+def prepare_ask_gemini(user, params):
+    # Fetch all available clothing items for the user
+    clothing_items = list(db.clothing_items.find({'user_id': user['_id'], **available_filter()}, ITEM_PROJECTION))
+    
+    if not clothing_items:
+        raise OutfitRequestError('No clothing items found for user', 404)
+
+    question = params.get('prompt')
+    if not isinstance(question, str) or not question.strip():
+        raise OutfitRequestError('prompt is required')
+    profile_text = user_profile_text(user)
+
+    def build_prompt():
+        # Keep only the items relevant to the question
+        candidates = select_candidate_items(user['_id'], clothing_items, question)
+
+        prompt = PromptBuilder('gemini', WARDROBE_QUESTION_SYSTEM_PROMPT)
+        prompt.add('profile', profile_text)
+        request_text = "Here is their question: " + question
+        prompt.add_items('wardrobe', 'Wardrobe:', candidates, reserve=estimate_tokens(request_text))
+        prompt.add('request', request_text)
+        return prompt.report()
+    return build_prompt
+
 @app.route('/gemini', methods=['POST'])
 @jwt_required()
 def ask_gemini():
-    email = get_jwt_identity()
-    user = db.users.find_one({'email': email})
+    user = get_current_user()
     
     if not user:
         return jsonify({'error': 'User must be logged in, please log in to use this api'}), 404
+
+    if request.json.get('async'):
+        return enqueue_job_response(user, 'gemini', request.json)
     
-    # Fetch all available clothing items for the user
-    clothing_items = list(db.clothing_items.find({'user_id': user['_id'], 'available': True}))
-    
-    if not clothing_items:
-        return jsonify({'error': 'No clothing items found for user'}), 404
-    
-    # Extract id, description, and frequency fields for each clothing item
-    clothing_items = [{'id': str(item['_id']), 'description': item['description'], 'frequency': item['frequency']} for item in clothing_items]
-    
-    # Collect user's age and gender from the database
-    user_dob = user.get('dob')
-    if not user_dob:
-        return jsonify({'error': 'User date of birth is required'}), 400
-    # Calculate user's age
-    user_dob = datetime.datetime.strptime(user_dob, '%Y-%m-%d')
-    user_age = (datetime.datetime.now() - user_dob).days // 365
-    user_gender = user.get('gender')
-    if not user_dob or not user_gender:
-        return jsonify({'error': 'User date of birth and gender are required'}), 400
-    
-    prompt = "You are a fashion expert. The user will ask you fashion questions and shopping suggestions. You answer their quetsions. Their gender is" + user_gender + " and their age is " + user_age + ". Here is their wardrobe info: " + str(clothing_items) + "Here is their question: " + request.json.get('prompt')
+    try:
+        build_prompt = prepare_ask_gemini(user, request.json)
+    except OutfitRequestError as e:
+        return jsonify({'error': str(e)}), e.status
 
     try:
-        result = query_gemini(prompt)
+        prompt = build_prompt()
+        result = prompt.resolve(query_gemini(prompt.text, system_instruction=prompt.system_instruction))
         return jsonify(result)
     except Exception as e:
         return {'error': str(e)}, 400
@@ -730,22 +3142,10 @@ def generate_tags():
     image_file = request.files['image']
     
     try:
-        # Open the image using PIL
-        image = Image.open(io.BytesIO(image_file.read()))
-        
-        # Initialize Gemini model
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        
-        # Generate content
-        response = model.generate_content([
-            "Describe this clothing item in a single, detailed sentence. Include color, style, material, and any distinctive features.",
-            image
-        ])
-        
-        # Extract the description
-        description = response.text.strip()
+        # Describe it through the image cache so a follow-up /add_clothing_item is free
+        image_hash, description, attributes = describe_clothing_image(image_file.read())
         
-        return jsonify({"description": description})
+        return jsonify({"description": description, "image_hash": image_hash, **attributes})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
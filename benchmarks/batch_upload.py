@@ -0,0 +1,52 @@
+# throughput of onboarding a wardrobe: N sequential /add_clothing_item requests against one
+# /clothing_items/batch request, with a stubbed Gemini vision call of fixed latency
+#
+#   python benchmarks/batch_upload.py [--images 100] [--vision-ms 300]
+import argparse
+import io
+import time
+
+from common import StubGemini, create_user, jpeg_bytes, load_app
+
+
+def images(count, offset):
+    # distinct colors so the image description cache never hits
+    return [jpeg_bytes(640, 480, ((offset + i) % 256, (offset + i) // 256 % 256, 128)) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=100)
+    parser.add_argument('--vision-ms', type=float, default=300)
+    args = parser.parse_args()
+
+    gemini = StubGemini(vision_ms=args.vision_ms, embed_ms=20)
+    index, _ = load_app(gemini)
+    client, headers, _ = create_user(index)
+
+    serial_images = images(args.images, 0)
+    start = time.perf_counter()
+    for i, data in enumerate(serial_images):
+        response = client.post('/add_clothing_item', headers=headers,
+                                data={'image': (io.BytesIO(data), f'serial-{i}.jpg'), 'path': f'serial/{i}.jpg'})
+        assert response.status_code == 200, response.json
+    serial_seconds = time.perf_counter() - start
+
+    batch_images = images(args.images, args.images)
+    start = time.perf_counter()
+    response = client.post('/clothing_items/batch', headers=headers, content_type='multipart/form-data', data={
+        'images': [(io.BytesIO(data), f'batch-{i}.jpg') for i, data in enumerate(batch_images)],
+        'paths': [f'batch/{i}.jpg' for i in range(len(batch_images))],
+    })
+    batch_seconds = time.perf_counter() - start
+    assert response.status_code == 200 and response.json['created'] == args.images, response.json
+
+    print(f'{args.images} images, stubbed vision latency {args.vision_ms:.0f} ms, '
+          f'{index.batch_tagging_pool._max_workers} tagging workers')
+    print(f"{'mode':>8} {'seconds':>9} {'items/s':>9}")
+    print(f"{'serial':>8} {serial_seconds:>9.2f} {args.images / serial_seconds:>9.1f}")
+    print(f"{'batch':>8} {batch_seconds:>9.2f} {args.images / batch_seconds:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# shared setup for the benchmarks: imports the app from api/index.py against an in-memory
+# mongomock database, with Gemini replaced by stubs that sleep for a configurable latency
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+import mongomock
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+
+COLORS = ['black', 'white', 'navy', 'olive', 'beige', 'red', 'grey', 'mustard', 'teal', 'brown']
+MATERIALS = ['cotton', 'linen', 'wool', 'denim', 'silk', 'polyester', 'leather', 'fleece']
+GARMENTS = ['t-shirt', 'shirt', 'sweater', 'hoodie', 'jeans', 'chinos', 'shorts', 'jacket', 'scarf', 'cap', 'sneakers', 'watch']
+EMBEDDING_DIMENSIONS = 768
+
+
+def estimate_tokens(text):
+    # roughly four characters per token for English text
+    return len(text) // 4
+
+
+# the aliases of the wardrobe items listed in an outfit prompt, in order
+def prompt_item_ids(prompt):
+    return list(dict.fromkeys(re.findall(r'^(i\d+):', prompt, re.M)))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def synthetic_description(i):
+    color = COLORS[i % len(COLORS)]
+    material = MATERIALS[(i // len(COLORS)) % len(MATERIALS)]
+    garment = GARMENTS[(i // (len(COLORS) * len(MATERIALS))) % len(GARMENTS)]
+    return f'A {color} {material} {garment} with a relaxed fit and subtle stitching details, item {i}.'
+
+
+def stub_vector(text):
+    seed = int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32)
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+        part = type('Part', (), {'text': text})()
+        content = type('Content', (), {'parts': [part]})()
+        self.candidates = [type('Candidate', (), {'content': content})()]
+        self.usage_metadata = None
+
+
+class StubGemini:
+    # latency = base_ms + ms_per_1k_tokens * prompt tokens / 1000, to mimic a model whose
+    # time to first token grows with the prompt
+    def __init__(self, base_ms=50, ms_per_1k_tokens=20, embed_ms=20, vision_ms=50):
+        self.base_ms = base_ms
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+        self.embed_ms = embed_ms
+        self.vision_ms = vision_ms
+        self.prompt_tokens = []
+        self.image_bytes = []
+
+    def model(self, model_name=None, system_instruction=None, **kwargs):
+        stub = self
+
+        class Model:
+            def generate_content(self, contents, **kwargs):
+                return stub.generate_content(contents, system_instruction=system_instruction, **kwargs)
+        return Model()
+
+    def generate_content(self, contents, system_instruction=None, **kwargs):
+        images = [part for part in contents if not isinstance(part, str)]
+        if images:
+            self.image_bytes.extend(len(part['data']) if isinstance(part, dict) else 0 for part in images)
+            time.sleep(self.vision_ms / 1000)
+            return StubResponse('A navy cotton shirt with a button-down collar.')
+        prompt = ''.join(contents)
+        tokens = estimate_tokens((system_instruction or '') + prompt)
+        self.prompt_tokens.append(tokens)
+        time.sleep((self.base_ms + self.ms_per_1k_tokens * tokens / 1000) / 1000)
+        ids = prompt_item_ids(prompt)
+        outfits = [
+            {'name': f'Outfit {n}', 'description': 'stub', 'clothing_item_ids': ids[n:n + 3], 'styling_tips': 'stub'}
+            for n in range(3)
+        ]
+        return StubResponse('```json\n' + json.dumps(outfits) + '\n```')
+
+    def embed_content(self, model, content, task_type=None, request_options=None):
+        time.sleep(self.embed_ms / 1000)
+        if isinstance(content, list):
+            return {'embedding': [stub_vector(text).tolist() for text in content]}
+        return {'embedding': stub_vector(content).tolist()}
+
+
+def load_app(gemini=None):
+    # keep the per-request access log out of the benchmark output
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import index
+    index.db = mongomock.MongoClient()['dev']
+    gemini = gemini or StubGemini()
+    genai = index.gemini_sdk()
+    genai.GenerativeModel = gemini.model
+    genai.embed_content = gemini.embed_content
+    index.gemini_client._models.clear()
+    return index, gemini
+
+
+def create_user(index, email='bench@example.com'):
+    client = index.app.test_client()
+    client.post('/users/signup', json={'email': email, 'password': 'bench', 'name': 'Bench', 'gender': 'female', 'dob': '1995-05-05'})
+    token = client.post('/users/login', json={'email': email, 'password': 'bench'}).json['access_token']
+    user = index.db.users.find_one({'email': email})
+    return client, {'Authorization': f'Bearer {token}'}, user['_id']
+
+
+# insert n items directly, with embeddings, as if they had been uploaded one by one
+def seed_items(index, user_id, n, embeddings=True):
+    now = index.datetime.datetime.now()
+    items = []
+    for i in range(n):
+        description = synthetic_description(i)
+        item = {
+            'user_id': user_id,
+            'description': description,
+            'image': f'item-{i}.jpg',
+            'path': f'uploads/item-{i}.jpg',
+            'created_at': now + index.datetime.timedelta(milliseconds=i),
+            'frequency': i % 7,
+            'available': True,
+            **index.extract_attributes(description),
+        }
+        if embeddings:
+            vector = stub_vector(description)
+            item['embedding'] = (vector / np.linalg.norm(vector)).tobytes()
+        items.append(item)
+    if items:
+        index.db.clothing_items.insert_many(items)
+
+
+def jpeg_bytes(width, height, color=(30, 60, 120)):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
@@ -0,0 +1,149 @@
+# fake Gemini and OpenWeatherMap HTTP server for the benchmarks. The app talks to it over the network
+# exactly as it would to the real services (GEMINI_API_ENDPOINT with the REST transport, and
+# OPENWEATHERMAP_BASE_URL), and every response waits for a configurable latency first
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import estimate_tokens, prompt_item_ids, stub_vector
+
+WEATHER = {
+    'weather': [{'main': 'Clouds', 'description': 'scattered clouds'}],
+    'main': {'temp': 18.4, 'feels_like': 17.9, 'temp_min': 16.0, 'temp_max': 21.2, 'humidity': 64},
+    'wind': {'speed': 3.6},
+}
+
+
+class FakeBackends:
+    # latency in ms: text generation is base_ms plus ms_per_1k_tokens per 1000 prompt tokens before the
+    # first token, then completion_ms to write the answer (spread over the chunks when streaming)
+    def __init__(self, gemini_ms=50, ms_per_1k_tokens=20, vision_ms=50, embed_ms=20, weather_ms=30, completion_ms=0):
+        self.gemini_ms = gemini_ms
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+        self.completion_ms = completion_ms
+        self.vision_ms = vision_ms
+        self.embed_ms = embed_ms
+        self.weather_ms = weather_ms
+        self.calls = {'generate': 0, 'stream': 0, 'vision': 0, 'embed': 0, 'weather': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+
+    # (prompt, answer text) after waiting for the first token
+    def answer(self, body, kind='generate'):
+        parts = [part for content in body.get('contents', []) for part in content.get('parts', [])]
+        system = body.get('systemInstruction') or body.get('system_instruction') or {}
+        prompt = ''.join(part.get('text', '') for part in system.get('parts', []) + parts)
+        if any('inlineData' in part or 'inline_data' in part for part in parts):
+            self.count('vision')
+            time.sleep(self.vision_ms / 1000)
+            return prompt, json.dumps({'description': 'A navy cotton shirt with a button-down collar.', 'category': 'shirt',
+                                       'colors': ['navy'], 'warmth': 2, 'formality': 4})
+        self.count(kind)
+        time.sleep((self.gemini_ms + self.ms_per_1k_tokens * estimate_tokens(prompt) / 1000) / 1000)
+        if 'weather data' in prompt:
+            answer = {'weather_description': 'Cloudy with a light breeze, mild all day.', 'temperature': 18}
+        else:
+            ids = prompt_item_ids(prompt)
+            answer = [{'name': f'Outfit {n}', 'description': 'fake', 'clothing_item_ids': ids[n:n + 3], 'styling_tips': 'fake'}
+                      for n in range(3)]
+        return prompt, '```json\n' + json.dumps(answer) + '\n```'
+
+    @staticmethod
+    def response(text, prompt, last=True):
+        payload = {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}]}
+        if last:
+            payload['candidates'][0]['finishReason'] = 'STOP'
+            payload['usageMetadata'] = {'promptTokenCount': estimate_tokens(prompt), 'candidatesTokenCount': estimate_tokens(text),
+                                        'totalTokenCount': estimate_tokens(prompt) + estimate_tokens(text)}
+        return payload
+
+    def generate(self, body):
+        prompt, text = self.answer(body)
+        time.sleep(self.completion_ms / 1000)
+        return self.response(text, prompt)
+
+    # the answer in `chunks` pieces, completion_ms apart in total
+    def stream(self, body, chunks=12):
+        prompt, text = self.answer(body, kind='stream')
+        size = -(-len(text) // chunks)
+        pieces = [text[start:start + size] for start in range(0, len(text), size)]
+        for n, piece in enumerate(pieces):
+            time.sleep(self.completion_ms / 1000 / len(pieces))
+            yield self.response(piece, prompt, last=n == len(pieces) - 1)
+
+    def embed(self, requests):
+        self.count('embed')
+        time.sleep(self.embed_ms / 1000)
+        texts = [''.join(part.get('text', '') for part in request['content']['parts']) for request in requests]
+        return [{'values': stub_vector(text).tolist()} for text in texts]
+
+    def _handler(self):
+        backends = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            # streamed REST answers are one JSON array, written an element at a time; the end of the
+            # response is marked by closing the connection
+            def reply_stream(self, payloads):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                separator = '['
+                for payload in payloads:
+                    self.wfile.write((separator + json.dumps(payload)).encode('utf-8'))
+                    self.wfile.flush()
+                    separator = ',\r\n'
+                self.wfile.write(b']')
+                self.close_connection = True
+
+            def do_GET(self):
+                if self.path.split('?')[0].endswith('/weather'):
+                    backends.count('weather')
+                    time.sleep(backends.weather_ms / 1000)
+                    return self.reply(200, WEATHER)
+                self.reply(404, {'error': 'not found'})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                path = self.path.split('?')[0]
+                if path.endswith(':streamGenerateContent'):
+                    return self.reply_stream(backends.stream(body))
+                if path.endswith(':generateContent'):
+                    return self.reply(200, backends.generate(body))
+                if path.endswith(':batchEmbedContents'):
+                    return self.reply(200, {'embeddings': backends.embed(body['requests'])})
+                if path.endswith(':embedContent'):
+                    return self.reply(200, {'embedding': backends.embed([body])[0]})
+                self.reply(404, {'error': {'code': 404, 'message': f'unknown path {path}'}})
+
+        return Handler
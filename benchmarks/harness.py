@@ -0,0 +1,169 @@
+# load test for the main routes: runs the app from api/index.py in process against mongomock (or a
+# local mongod with --mongo-uri) and the fake Gemini/OpenWeatherMap server from fake_backends.py,
+# seeds one user per wardrobe size and reports p50/p99 latency and requests per second per route
+#
+#   python benchmarks/harness.py [--sizes 10 100 1000 10000] [--requests 50] [--concurrency 4]
+#                                [--routes wardrobe outfits ...] [--gemini-ms 50] [--response-cache] [--json results.json]
+#
+# the per-user response cache is off unless --response-cache is given, since the same GET repeated
+# would otherwise measure cache hits instead of the route
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+
+from common import create_user, jpeg_bytes, percentile, seed_items
+from fake_backends import FakeBackends
+
+GENERATE_REQUEST = {
+    'weather_description': 'Cloudy with a light breeze, mild all day',
+    'temperature': '18',
+    'day_description': 'Office in the morning, dinner with friends',
+}
+
+# name -> (method, path, request kwargs for the n-th request); add_clothing_item runs last since it grows the wardrobe
+ROUTES = {
+    'wardrobe': lambda n: ('GET', '/wardrobe', {}),
+    'wardrobe page': lambda n: ('GET', '/wardrobe?limit=50', {}),
+    'outfits': lambda n: ('GET', '/outfits', {}),
+    'outfits page': lambda n: ('GET', '/outfits?limit=20', {}),
+    'outfits/recent': lambda n: ('GET', '/outfits/recent', {}),
+    # fresh skips the outfit cache, so every request calls Gemini
+    'outfits/generate': lambda n: ('POST', '/outfits/generate', {'json': dict(GENERATE_REQUEST, fresh=True)}),
+    # the same request every time: all but the warm-up are answered from the outfit cache
+    'outfits/generate cached': lambda n: ('POST', '/outfits/generate', {'json': GENERATE_REQUEST}),
+    'outfits/generate local': lambda n: ('POST', '/outfits/generate', {'json': dict(GENERATE_REQUEST, mode='local')}),
+    # only queues the job (a distinct day per request, so none is deduplicated); no worker runs here
+    'outfits/generate async': lambda n: ('POST', '/outfits/generate', {'json': dict(GENERATE_REQUEST, day_description=f'Day {n}', **{'async': True})}),
+    'get_weather': lambda n: ('POST', '/get_weather', {'json': {'location': f'City {n}'}}),
+    'add_clothing_item': lambda n: ('POST', '/add_clothing_item', {'data': {
+        # a distinct image per request so the image description cache never hits
+        'image': (io.BytesIO(jpeg_bytes(640, 480, (n % 256, n // 256 % 256, 200))), f'upload-{n}.jpg'),
+        'path': f'uploads/{n}.jpg',
+    }}),
+}
+
+
+# mongomock pops and re-adds keys of the projection passed to find() for every document it copies,
+# which races when concurrent requests share a module level projection such as ITEM_PROJECTION
+def copy_projection_per_find():
+    copy_only_fields = mongomock.collection.Collection._copy_only_fields
+    mongomock.collection.Collection._copy_only_fields = \
+        lambda self, doc, fields, container: copy_only_fields(self, doc, dict(fields) if fields else fields, container)
+
+
+def load_app(backends, mongo_uri=None):
+    os.environ.update({
+        'GEMINI_API_ENDPOINT': backends.url,
+        'GEMINI_API_KEY': 'fake',
+        'OPENWEATHERMAP_BASE_URL': backends.url + '/data/2.5',
+        'OPENWEATHERMAP_API_KEY': 'fake',
+    })
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if mongo_uri:
+        os.environ['MONGO_URI'] = mongo_uri
+    import index
+    if mongo_uri:
+        index.mongo_client().drop_database('drip_advisor_benchmark')
+        index.db = index.mongo_client()['drip_advisor_benchmark']
+        index.ensure_indexes()
+    else:
+        copy_projection_per_find()
+        index.db = mongomock.MongoClient()['dev']
+    return index
+
+
+def seed_outfits(index, user_id, count):
+    items = list(index.db.clothing_items.find({'user_id': user_id}, {'_id': 1}).limit(count * 3))
+    now = index.datetime.datetime.now()
+    outfits = [{
+        'user_id': user_id,
+        'name': f'Seeded outfit {n}',
+        'description': 'seeded',
+        'clothing_item_ids': [str(item['_id']) for item in items[n * 3 % len(items):][:3]],
+        'styling_tips': 'seeded',
+        'created_at': now,
+    } for n in range(count)]
+    if outfits:
+        index.db.outfits.insert_many(outfits)
+
+
+def run_route(index, headers, build, requests, concurrency, offset):
+    local = threading.local()
+
+    def send(n):
+        if not hasattr(local, 'client'):
+            local.client = index.app.test_client()
+        method, path, kwargs = build(offset + n)
+        start = time.perf_counter()
+        response = local.client.open(path, method=method, headers=headers, **kwargs)
+        return time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(send, range(requests)))
+        seconds = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status >= 400),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'rps': requests / seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='wardrobe sizes, one user each (10 to 10000)')
+    parser.add_argument('--requests', type=int, default=50, help='measured requests per route and size')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--outfits', type=int, default=20, help='outfits seeded per user')
+    parser.add_argument('--gemini-ms', type=float, default=50)
+    parser.add_argument('--gemini-ms-per-1k-tokens', type=float, default=20)
+    parser.add_argument('--vision-ms', type=float, default=50)
+    parser.add_argument('--embed-ms', type=float, default=20)
+    parser.add_argument('--weather-ms', type=float, default=30)
+    parser.add_argument('--response-cache', action='store_true', help='keep the response cache of the wardrobe and outfit reads on')
+    parser.add_argument('--mongo-uri', help='use a local mongod instead of mongomock, e.g. mongodb://127.0.0.1:27017')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    backends = FakeBackends(gemini_ms=args.gemini_ms, ms_per_1k_tokens=args.gemini_ms_per_1k_tokens, vision_ms=args.vision_ms,
+                            embed_ms=args.embed_ms, weather_ms=args.weather_ms).start()
+    index = load_app(backends, args.mongo_uri)
+    if not args.response_cache:
+        # no body is small enough to be cached
+        index.RESPONSE_CACHE_MAX_BYTES = -1
+
+    results = []
+    print(f"{'items':>6}  {'route':<24} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for size in args.sizes:
+        _, headers, user_id = create_user(index, f'bench-{size}@example.com')
+        seed_items(index, user_id, size)
+        seed_outfits(index, user_id, args.outfits)
+        offset = size * 1000
+        for name in [route for route in ROUTES if route in args.routes]:
+            # one warm-up request, so one-off work such as index creation is not measured
+            run_route(index, headers, ROUTES[name], 1, 1, offset)
+            result = run_route(index, headers, ROUTES[name], args.requests, args.concurrency, offset + 1)
+            offset += args.requests + 1
+            results.append({'items': size, 'route': name, **result})
+            print(f"{size:>6}  {name:<24} {result['requests']:>8} {result['errors']:>6} {result['p50_ms']:>8.1f} "
+                  f"{result['p99_ms']:>8.1f} {result['rps']:>8.1f}")
+    print(f'fake backend calls: {backends.calls}')
+    backends.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# peak RSS and /generate_tags latency for a 12 MP phone photo, with preprocessing disabled
+# (IMAGE_MAX_EDGE=0: full resolution decode and re-encode, as before) and enabled. Each mode runs
+# in its own process so peak RSS is not shared.
+#
+#   python benchmarks/image_preprocess.py [--width 4000 --height 3000] [--runs 5]
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def make_photo(path, width, height):
+    from PIL import Image
+    # smooth shapes plus a little grain, so it compresses roughly like a real photo (a flat color
+    # would be tiny, pure noise far larger than any phone photo)
+    rng = np.random.default_rng(0)
+    coarse = Image.fromarray(rng.integers(0, 256, (height // 50, width // 50, 3), dtype=np.uint8))
+    pixels = np.asarray(coarse.resize((width, height), Image.Resampling.BICUBIC), dtype=np.int16)
+    pixels += rng.integers(-6, 7, pixels.shape, dtype=np.int16)
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, 'JPEG', quality=90)
+
+
+def worker(photo_path, runs):
+    from common import StubGemini, load_app
+    gemini = StubGemini(vision_ms=0)
+    index, _ = load_app(gemini)
+    client = index.app.test_client()
+    with open(photo_path, 'rb') as f:
+        photo = f.read()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies = []
+    for _ in range(runs):
+        # every run is a cache miss
+        index.image_description_cache.clear()
+        index.db.image_descriptions.delete_many({})
+        start = time.perf_counter()
+        response = client.post('/generate_tags', data={'image': (io.BytesIO(photo), 'photo.jpg')})
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.json
+    print(json.dumps({
+        'upload_bytes': len(photo),
+        'gemini_bytes': gemini.image_bytes[-1],
+        'p50_ms': statistics.median(latencies),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'rss_growth_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.runs)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        photo_path = os.path.join(directory, 'photo.jpg')
+        make_photo(photo_path, args.width, args.height)
+        print(f"{'mode':>8} {'upload KB':>10} {'to Gemini KB':>13} {'p50 ms':>8} {'peak RSS MB':>12} {'RSS growth MB':>14}")
+        for mode, max_edge in (('before', '0'), ('after', os.getenv('IMAGE_MAX_EDGE', '1024'))):
+            output = subprocess.run(
+                [sys.executable, '-W', 'ignore', __file__, '--worker', photo_path, '--runs', str(args.runs)],
+                env={**os.environ, 'IMAGE_MAX_EDGE': max_edge}, capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>8} {result['upload_bytes'] / 1024:>10.0f} {result['gemini_bytes'] / 1024:>13.0f} "
+                  f"{result['p50_ms']:>8.0f} {result['peak_rss_mb']:>12.0f} {result['rss_growth_mb']:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
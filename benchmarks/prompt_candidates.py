@@ -0,0 +1,53 @@
+# compares prompt tokens and end-to-end latency of /outfits/generate with the whole wardrobe in
+# the prompt (OUTFIT_CANDIDATE_K=0) against embedding top-K preselection. The full mode lifts
+# PROMPT_TOKEN_BUDGET so it measures the untrimmed prompt; top-K runs under the configured budget.
+#
+#   python benchmarks/prompt_candidates.py [--sizes 50 500 5000] [--runs 5]
+import argparse
+import statistics
+import time
+
+from common import StubGemini, create_user, load_app, seed_items
+
+REQUEST = {
+    'weather_description': 'Cool and breezy morning with light drizzle, clearing up in the afternoon',
+    'temperature': '14',
+    'day_description': 'Office presentation followed by dinner with friends',
+    # every run has to reach Gemini, not the outfit cache
+    'fresh': True,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--k', type=int, default=60)
+    parser.add_argument('--gemini-base-ms', type=float, default=50)
+    parser.add_argument('--gemini-ms-per-1k-tokens', type=float, default=20)
+    args = parser.parse_args()
+
+    gemini = StubGemini(base_ms=args.gemini_base_ms, ms_per_1k_tokens=args.gemini_ms_per_1k_tokens)
+    index, _ = load_app(gemini)
+    budget_default = index.PROMPT_TOKEN_BUDGET
+
+    print(f"{'items':>6} {'mode':>6} {'prompt tokens':>14} {'p50 ms':>9} {'mean ms':>9}")
+    for size in args.sizes:
+        client, headers, user_id = create_user(index, email=f'bench-{size}@example.com')
+        seed_items(index, user_id, size)
+        for mode, k, budget in (('full', 0, 10 ** 9), ('top-k', args.k, budget_default)):
+            index.OUTFIT_CANDIDATE_K = k
+            index.PROMPT_TOKEN_BUDGET = budget
+            gemini.prompt_tokens.clear()
+            latencies = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                response = client.post('/outfits/generate', headers=headers, json=REQUEST)
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, response.json
+            print(f'{size:>6} {mode:>6} {int(statistics.mean(gemini.prompt_tokens)):>14} '
+                  f'{statistics.median(latencies):>9.1f} {statistics.mean(latencies):>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# micro-benchmarks for turning mongo documents into responses: large wardrobe pages and hydrated
+# outfit lists encoded the way the routes used to (a recursive ObjectId conversion, then jsonify)
+# against the MongoJSONProvider, with the json module and with orjson, plus the wardrobe cursor
+#
+#   python benchmarks/serialization.py [--outfits 500] [--items 5000] [--runs 20]
+import argparse
+import copy
+import time
+
+from bson import ObjectId
+
+from common import load_app, synthetic_description
+
+
+def outfit_documents(index, count):
+    now = index.datetime.datetime.now()
+    outfits = []
+    for n in range(count):
+        items = [{'_id': ObjectId(), 'user_id': ObjectId(), 'description': synthetic_description(n * 3 + i), 'frequency': i,
+                  'available': True, 'created_at': now, **index.extract_attributes(synthetic_description(n * 3 + i))} for i in range(3)]
+        outfits.append({'_id': ObjectId(), 'user_id': ObjectId(), 'name': f'Outfit {n}', 'description': 'benchmark',
+                        'clothing_item_ids': [str(item['_id']) for item in items], 'styling_tips': 'benchmark',
+                        'created_at': now, 'clothing_items_list': items})
+    return outfits
+
+
+def item_documents(index, count):
+    now = index.datetime.datetime.now()
+    return [{'_id': ObjectId(), 'user_id': ObjectId(), 'description': synthetic_description(i), 'image': f'item-{i}.jpg',
+             'path': f'uploads/item-{i}.jpg', 'created_at': now, 'frequency': i % 7, 'available': True,
+             **index.extract_attributes(synthetic_description(i))} for i in range(count)]
+
+
+# the converter the routes ran before every jsonify call
+def convert_objectid(data):
+    if isinstance(data, list):
+        return [convert_objectid(item) for item in data]
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, ObjectId):
+                data[key] = str(value)
+            elif isinstance(value, (list, dict)):
+                data[key] = convert_objectid(value)
+    return data
+
+
+# microseconds per call of fn(prepared) where prepared = prepare() is built outside the timing
+def measure(fn, prepare, runs):
+    inputs = [prepare() for _ in range(runs)]
+    start = time.perf_counter()
+    for value in inputs:
+        fn(value)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outfits', type=int, default=500)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    index, _ = load_app()
+    outfits = outfit_documents(index, args.outfits)
+    items = item_documents(index, args.items)
+    cursor = index.encode_wardrobe_cursor(items[-1])
+
+    def to_json(data, use_orjson=False):
+        index.MongoJSONProvider.use_orjson = use_orjson
+        with index.app.app_context():
+            return index.jsonify(data).get_data()
+
+    cases = []
+    for name, documents in ((f'{args.items} wardrobe items', items), (f'{args.outfits} outfits', outfits)):
+        cases += [
+            # the old path converts in place, so each run gets its own copy
+            (f'{name}, convert_objectid + jsonify', lambda data: to_json(convert_objectid(data)), lambda documents=documents: copy.deepcopy(documents)),
+            (f'{name}, provider (json)', to_json, lambda documents=documents: documents),
+        ]
+        if index.orjson is not None:
+            cases.append((f'{name}, provider (orjson)', lambda data: to_json(data, use_orjson=True), lambda documents=documents: documents))
+    cases += [
+        ('encode_wardrobe_cursor', index.encode_wardrobe_cursor, lambda: items[-1]),
+        ('decode_wardrobe_cursor', index.decode_wardrobe_cursor, lambda: cursor),
+    ]
+    print(f"{'case':<52} {'ms/call':>10}")
+    for name, fn, prepare in cases:
+        print(f'{name:<52} {measure(fn, prepare, args.runs) / 1000:>10.3f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# cold start cost of api/index.py: `python -X importtime` in fresh interpreters, reporting the median
+# import time, the heaviest modules it imports directly, the time to answer a first request to /,
+# and which heavy SDKs are loaded by then. --compare REV runs the same against api/index.py at a
+# git revision, e.g. the commit before lazy imports
+#
+#   python benchmarks/startup.py [--runs 5] [--top 10] [--compare HEAD~1]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT
+
+HEAVY_MODULES = ['google.generativeai', 'googleapiclient', 'google.oauth2', 'PIL', 'numpy', 'apscheduler']
+
+FIRST_REQUEST = f'''
+import sys, time
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+index.app.test_client().get('/')
+print((imported - start) * 1000, (time.perf_counter() - imported) * 1000)
+print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))
+'''
+
+ENV = {
+    # never wait on a database: nothing here needs one, and old revisions connect at import
+    'MONGO_URI': 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=200',
+    'ENSURE_INDEXES_ON_STARTUP': '0',
+    'LOG_LEVEL': 'WARNING',
+}
+
+
+# {module: cumulative microseconds} for the modules `import index` imports directly, and index's own total
+def import_times(directory):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import index'], cwd=directory,
+                            env={**os.environ, **ENV}, capture_output=True, text=True, check=True)
+    modules = {}
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if name.strip() == 'index' and depth == 0:
+            total = int(cumulative)
+        elif depth == 1:
+            modules[name.strip()] = int(cumulative)
+    return total, modules
+
+
+def first_request(directory):
+    result = subprocess.run([sys.executable, '-c', FIRST_REQUEST], cwd=directory, env={**os.environ, **ENV},
+                            capture_output=True, text=True, check=True)
+    lines = result.stdout.splitlines()
+    import_ms, request_ms = map(float, lines[0].split())
+    return import_ms, request_ms, lines[1].split() if len(lines) > 1 else []
+
+
+def report(label, directory, runs, top):
+    samples = [import_times(directory) for _ in range(runs)]
+    requests = [first_request(directory) for _ in range(runs)]
+    print(f'== {label}')
+    print(f"import index (-X importtime): {statistics.median(total for total, _ in samples) / 1000:.0f} ms median of {runs}")
+    print(f"import + first request to /: {statistics.median(r[0] for r in requests):.0f} + {statistics.median(r[1] for r in requests):.0f} ms")
+    print(f"heavy modules loaded after the first request: {', '.join(requests[-1][2]) or 'none'}")
+    modules = {name: statistics.median(sample[1].get(name, 0) for sample in samples) for name in samples[0][1]}
+    print('heaviest direct imports:')
+    for name, micros in sorted(modules.items(), key=lambda entry: entry[1], reverse=True)[:top]:
+        print(f'  {micros / 1000:8.1f} ms  {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--compare', help='also measure api/index.py at this git revision')
+    args = parser.parse_args()
+
+    if args.compare:
+        source = subprocess.run(['git', 'show', f'{args.compare}:api/index.py'], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'index.py'), 'w') as f:
+                f.write(source)
+            report(args.compare, directory, args.runs, args.top)
+    report('working tree', os.path.join(ROOT, 'api'), args.runs, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# time to the first outfit: posts /outfits/generate (or /outfits/build) against the fake Gemini server
+# once as a plain JSON request and once with "stream": true, and reports when the first outfit event,
+# the last outfit event and the whole response arrived
+#
+#   python benchmarks/streaming.py [--items 100] [--requests 10] [--gemini-ms 300] [--completion-ms 1500]
+import argparse
+import time
+
+from common import create_user, percentile, seed_items
+from fake_backends import FakeBackends
+from harness import GENERATE_REQUEST, load_app
+
+
+# seconds from sending the request to each outfit event and to the end of the response
+def timed_request(client, headers, path, body):
+    start = time.perf_counter()
+    response = client.post(path, headers=headers, json=body, buffered=False)
+    outfits = []
+    for chunk in response.response:
+        # the app yields exactly one event per chunk
+        if chunk.startswith(b'event: outfit'):
+            outfits.append(time.perf_counter() - start)
+    total = time.perf_counter() - start
+    response.close()
+    return outfits or [total], total, response.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--route', choices=['generate', 'build'], default='generate')
+    parser.add_argument('--gemini-ms', type=float, default=300, help='time to the first token')
+    parser.add_argument('--completion-ms', type=float, default=1500, help='time to write the whole answer')
+    args = parser.parse_args()
+
+    backends = FakeBackends(gemini_ms=args.gemini_ms, completion_ms=args.completion_ms).start()
+    index = load_app(backends)
+    client, headers, user_id = create_user(index, 'stream@example.com')
+    seed_items(index, user_id, args.items)
+
+    # fresh skips the outfit cache, since every request is the same
+    body = dict(GENERATE_REQUEST, fresh=True)
+    if args.route == 'build':
+        body['base_items_ids'] = [str(index.db.clothing_items.find_one({'user_id': user_id})['_id'])]
+    path = f'/outfits/{args.route}'
+
+    print(f"{'mode':<10} {'first outfit p50 ms':>20} {'last outfit p50 ms':>20} {'total p50 ms':>14} {'errors':>7}")
+    for mode, extra in (('json', {}), ('stream', {'stream': True})):
+        timed_request(client, headers, path, dict(body, **extra))
+        results = [timed_request(client, headers, path, dict(body, **extra)) for _ in range(args.requests)]
+        first = [outfits[0] for outfits, _, _ in results]
+        last = [outfits[-1] for outfits, _, _ in results]
+        total = [seconds for _, seconds, _ in results]
+        errors = sum(1 for _, _, status in results if status >= 400)
+        print(f'{mode:<10} {percentile(first, 50) * 1000:>20.1f} {percentile(last, 50) * 1000:>20.1f} '
+              f'{percentile(total, 50) * 1000:>14.1f} {errors:>7}')
+    print(f'fake backend calls: {backends.calls}')
+    backends.stop()
+
+
+if __name__ == '__main__':
+    main()
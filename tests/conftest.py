@@ -0,0 +1,37 @@
+# shared fixtures: the app from api/index.py against a fresh mongomock database per test
+import os
+import sys
+
+import mongomock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+os.environ.setdefault('ENSURE_INDEXES_ON_STARTUP', '0')
+os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+
+import index  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient()['test']
+    monkeypatch.setattr(index, 'db', database)
+    index.ensure_users_index.cache_clear()
+    index.user_cache.clear()
+    index.response_cache.clear()
+    index.outfit_cache.clear()
+    return database
+
+
+@pytest.fixture
+def client(db):
+    return index.app.test_client()
+
+
+# (user _id, Authorization headers) of a signed up and logged in user
+@pytest.fixture
+def user(client, db):
+    client.post('/users/signup', json={'email': 'user@example.com', 'password': 'secret', 'name': 'User',
+                                       'gender': 'female', 'dob': '1995-04-01'})
+    token = client.post('/users/login', json={'email': 'user@example.com', 'password': 'secret'}).json['access_token']
+    return db.users.find_one({'email': 'user@example.com'})['_id'], {'Authorization': f'Bearer {token}'}
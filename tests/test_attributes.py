@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import index
+
+
+@pytest.mark.parametrize('description, category', [
+    # the earliest keyword decides
+    ('A denim jacket with a shirt collar.', 'outerwear'),
+    # a keyword right before another one is a modifier
+    ('A white dress shirt.', 'shirt'),
+    ('A black tank top.', 'shirt'),
+    ('Blue denim jeans.', 'pants'),
+    ('Brown leather boots.', 'footwear'),
+    ('Something soft.', 'accessory'),
+])
+def test_category(description, category):
+    assert index.classify_item(description) == category
+
+
+def test_warmth_colors_and_formality():
+    assert index.extract_attributes('A red wool sweater.') == {'category': 'shirt', 'colors': ['red'], 'warmth': 5, 'formality': 3}
+    assert index.extract_attributes('Linen shorts.')['warmth'] == 1
+    # clamped to 1-5
+    assert index.estimate_warmth('A navy wool padded puffer parka with fleece lining and thermal knit') == 5
+    assert index.estimate_formality('A silk tie') == 5
+    # whole words only: "tied" is not "tie", "steel" is not "tee"
+    assert index.estimate_formality('Steel-toe boots with a tied lace.') == 3
+
+
+def test_model_attributes_are_validated_and_completed_by_the_rules():
+    assert index.normalize_attributes({'category': 'Footwear', 'colors': [' Red ', ''], 'warmth': 9, 'formality': 'high'}, 'A blue tee') == {
+        'category': 'footwear', 'colors': ['red'], 'warmth': 5, 'formality': 2}
+    assert index.normalize_attributes({'category': 'hat', 'colors': []}, 'A blue tee') == index.extract_attributes('A blue tee')
+
+
+def test_stored_attributes_are_preferred():
+    stored = {'description': 'Blue denim jeans.', 'category': 'shirt', 'colors': [], 'warmth': 1, 'formality': 5}
+    assert index.item_attributes(stored) == {'category': 'shirt', 'colors': [], 'warmth': 1, 'formality': 5}
+    assert index.item_attributes({'description': 'Blue denim jeans.', 'category': 'shirt'})['category'] == 'pants'
+
+
+def item(user_id, description, **fields):
+    return {'user_id': user_id, 'description': description, 'frequency': 0, 'available': True, **fields}
+
+
+def test_cold_weather_keeps_warm_clothes_footwear_and_unknown_items(db, user):
+    user_id, _ = user
+    db.clothing_items.insert_many([item(user_id, description, **index.extract_attributes(description)) for description in (
+        'A red wool sweater.', 'Grey wool trousers.', 'Linen shorts.', 'White sneakers.')] + [item(user_id, 'An old thing.')])
+    names = {candidate['description'] for candidate in index.load_outfit_candidates(user_id, '3')}
+    assert names == {'A red wool sweater.', 'Grey wool trousers.', 'White sneakers.', 'An old thing.'}
+    # mild weather keeps everything
+    assert len(index.load_outfit_candidates(user_id, '18')) == 5
+
+
+def test_the_whole_wardrobe_is_used_when_the_weather_leaves_no_outfit(db, user):
+    user_id, _ = user
+    db.clothing_items.insert_many([item(user_id, description, **index.extract_attributes(description))
+                                   for description in ('A red wool sweater.', 'Linen shorts.')])
+    assert len(index.load_outfit_candidates(user_id, '3')) == 2
+
+
+def test_backfill_sets_the_attributes_of_old_items(db, user):
+    user_id, _ = user
+    done = db.clothing_items.insert_one(item(user_id, 'Blue denim jeans.', category='shirt')).inserted_id
+    db.clothing_items.insert_many([item(user_id, f'A red wool sweater number {n}.') for n in range(5)])
+    db.recent_outfits.insert_one({'_id': user_id, 'outfits': []})
+
+    assert index.backfill_item_attributes(batch_size=2) == 5
+    assert db.clothing_items.count_documents({'category': 'shirt', 'warmth': 5, 'colors': ['red']}) == 5
+    # items that already have attributes are left alone
+    assert db.clothing_items.find_one({'_id': done})['category'] == 'shirt'
+    # the attributes are part of responses: cached reads are retired
+    assert db.recent_outfits.find_one({'_id': user_id}) is None
+    assert db.user_versions.find_one({'_id': user_id})['version'] == 3
+    assert index.backfill_item_attributes() == 0
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+def test_backfill_with_gemini_falls_back_to_the_rules_per_batch(db, user, monkeypatch):
+    user_id, _ = user
+    db.clothing_items.insert_many([item(user_id, 'A red wool sweater.'), item(user_id, 'Blue denim jeans.'), item(user_id, 'Linen shorts.')])
+    answers = [json.dumps([{'category': 'outerwear', 'colors': ['crimson'], 'warmth': 4, 'formality': 2},
+                           {'category': 'pants', 'colors': ['indigo'], 'warmth': 3, 'formality': 1}]),
+               # not one object per description
+               json.dumps([])]
+    monkeypatch.setattr(index.gemini_client, 'generate_content', lambda contents, **kwargs: Response(answers.pop(0)))
+
+    assert index.backfill_item_attributes(use_gemini=True, batch_size=2) == 3
+    by_description = {doc['description']: doc for doc in db.clothing_items.find()}
+    assert by_description['A red wool sweater.']['category'] == 'outerwear'
+    assert by_description['Blue denim jeans.']['colors'] == ['indigo']
+    assert by_description['Linen shorts.']['category'] == 'pants' and by_description['Linen shorts.']['warmth'] == 1
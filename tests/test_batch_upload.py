@@ -0,0 +1,107 @@
+import io
+import threading
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import index
+
+BOUNDARY = 'test-boundary'
+
+
+# fields is {name: [value, ...]}, a value being a string or (filename, bytes) for a file
+def multipart(fields):
+    body = b''
+    for name, values in fields.items():
+        for value in values:
+            if isinstance(value, tuple):
+                filename, data = value
+                headers = f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\nContent-Type: image/jpeg'
+            else:
+                headers, data = f'Content-Disposition: form-data; name="{name}"', value.encode('utf-8')
+            body += f'--{BOUNDARY}\r\n{headers}\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode('utf-8')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 64 * 1024])
+def test_iter_multipart_parts_yields_fields_and_files_in_order(chunk_size):
+    body = multipart({
+        'paths': ['a.jpg', 'b.jpg'],
+        'images': [('one.jpg', b'first image'), ('two.jpg', b'\r\n--not-a-boundary\r\n' * 50)],
+    })
+    parts = list(index.iter_multipart_parts(io.BytesIO(body), BOUNDARY, chunk_size=chunk_size))
+    assert parts == [
+        ('field', 'paths', 'a.jpg'),
+        ('field', 'paths', 'b.jpg'),
+        ('file', 'images', 'one.jpg', b'first image'),
+        ('file', 'images', 'two.jpg', b'\r\n--not-a-boundary\r\n' * 50),
+    ]
+
+
+def test_iter_multipart_parts_rejects_an_oversized_file(monkeypatch):
+    monkeypatch.setattr(index, 'MAX_IMAGE_UPLOAD_BYTES', 100)
+    body = multipart({'images': [('small.jpg', b'small'), ('big.jpg', b'x' * 101)]})
+    parts = index.iter_multipart_parts(io.BytesIO(body), BOUNDARY, chunk_size=16)
+    assert next(parts) == ('file', 'images', 'small.jpg', b'small')
+    with pytest.raises(RequestEntityTooLarge):
+        next(parts)
+
+
+def test_iter_multipart_parts_rejects_a_truncated_body():
+    body = multipart({'images': [('one.jpg', b'complete'), ('two.jpg', b'cut off here')]})
+    parts = index.iter_multipart_parts(io.BytesIO(body[:body.index(b'cut off') + 3]), BOUNDARY)
+    assert next(parts) == ('file', 'images', 'one.jpg', b'complete')
+    with pytest.raises(ValueError):
+        next(parts)
+
+
+# every split of the body into two reads gives the same parts
+def test_iter_multipart_parts_with_any_read_boundary():
+    body = multipart({'paths': ['a.jpg'], 'images': [('one.jpg', b'abc\r\n--nope\r\n')]})
+    expected = [('field', 'paths', 'a.jpg'), ('file', 'images', 'one.jpg', b'abc\r\n--nope\r\n')]
+
+    class SplitStream(io.BytesIO):
+        def __init__(self, data, split):
+            super().__init__(data)
+            self.split = split
+
+        def read(self, size=-1):
+            position = self.tell()
+            return super().read(self.split - position if position < self.split else size)
+
+    for split in range(1, len(body)):
+        assert list(index.iter_multipart_parts(SplitStream(body, split), BOUNDARY)) == expected, split
+
+
+def test_batch_with_a_truncated_body_is_a_bad_request(client, user):
+    _, headers = user
+    body = multipart({'images': [('one.jpg', b'cut off here')]})
+    response = client.post('/clothing_items/batch', headers=headers, data=body[:body.index(b'cut off') + 3],
+                           content_type=f'multipart/form-data; boundary={BOUNDARY}')
+    assert response.status_code == 400
+
+
+def test_rejected_batch_cancels_queued_tagging(client, user, monkeypatch):
+    _, headers = user
+    release = threading.Event()
+    described = []
+
+    def describe(data):
+        release.wait(5)
+        described.append(data)
+        return 'hash', 'A shirt.', index.extract_attributes('A shirt.')
+
+    pool = index.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(index, 'batch_tagging_pool', pool)
+    monkeypatch.setattr(index, 'describe_clothing_image', describe)
+    monkeypatch.setattr(index, 'BATCH_UPLOAD_MAX_FILES', 3)
+
+    body = multipart({'images': [(f'{n}.jpg', f'image {n}'.encode()) for n in range(5)]})
+    response = client.post('/clothing_items/batch', headers=headers, data=body,
+                           content_type=f'multipart/form-data; boundary={BOUNDARY}')
+    release.set()
+    pool.shutdown(wait=True)
+
+    assert response.status_code == 413
+    # only the one already running when the request was rejected was described
+    assert described == [b'image 0']
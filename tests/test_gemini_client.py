@@ -0,0 +1,106 @@
+import pytest
+import requests
+from google.api_core import exceptions as google_exceptions
+
+import index
+
+
+# time as seen by the client: sleeping moves the clock on instead of waiting
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(index.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(index.time, 'sleep', clock.sleep)
+    # the longest backoff the jitter allows
+    monkeypatch.setattr(index.random, 'uniform', lambda low, high: high)
+    return clock
+
+
+# a stub call that raises the given errors in turn, then returns 'ok'; remaining holds the time it was given
+class Flaky:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.remaining = []
+
+    def __call__(self, remaining):
+        self.remaining.append(remaining)
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def client(**kwargs):
+    options = dict(timeout=30.0, max_retries=3, backoff_base=0.5, backoff_max=8.0, breaker_threshold=3, breaker_cooldown=30.0)
+    return index.GeminiClient(**{**options, **kwargs})
+
+
+def test_retryable_errors_are_retried_with_backoff(clock):
+    call = Flaky(google_exceptions.TooManyRequests('slow down'), google_exceptions.ServiceUnavailable('busy'),
+                 requests.exceptions.ConnectionError('reset'))
+    assert client().call(call) == 'ok'
+    assert len(call.remaining) == 4
+    assert clock.sleeps == [0.5, 1.0, 2.0]
+
+
+def test_other_errors_are_not_retried(clock):
+    for error in (ValueError('bad answer'), google_exceptions.InvalidArgument('bad request')):
+        call = Flaky(error)
+        with pytest.raises(type(error)):
+            client().call(call)
+        assert len(call.remaining) == 1 and clock.sleeps == []
+
+
+def test_retries_stop_after_max_retries(clock):
+    call = Flaky(*[google_exceptions.InternalServerError('boom')] * 5)
+    with pytest.raises(index.GeminiUnavailable, match='after 3 attempts'):
+        client(max_retries=2).call(call)
+    assert len(call.remaining) == 3
+
+
+def test_the_deadline_bounds_every_attempt_and_the_backoff(clock):
+    call = Flaky(*[google_exceptions.ServiceUnavailable('busy')] * 10)
+    with pytest.raises(index.GeminiTimeout):
+        client(max_retries=10, backoff_base=2.0).call(call, timeout=5)
+    # 2 s, then 3 s of the 4 s backoff that were left
+    assert clock.sleeps == [2.0, 3.0]
+    assert call.remaining == [5, 3]
+
+
+def test_the_breaker_opens_half_opens_and_resets(clock):
+    gemini = client(max_retries=0, breaker_threshold=2, breaker_cooldown=30.0)
+    for _ in range(2):
+        with pytest.raises(index.GeminiUnavailable):
+            gemini.call(Flaky(google_exceptions.ServiceUnavailable('busy')))
+
+    # open: calls fail fast without reaching Gemini
+    call = Flaky()
+    with pytest.raises(index.GeminiUnavailable, match='temporarily unavailable'):
+        gemini.call(call)
+    assert call.remaining == []
+
+    # half open after the cooldown: one more failure opens it again straight away
+    clock.now += 30
+    with pytest.raises(index.GeminiUnavailable, match='after 1 attempts'):
+        gemini.call(Flaky(google_exceptions.ServiceUnavailable('busy')))
+    with pytest.raises(index.GeminiUnavailable, match='temporarily unavailable'):
+        gemini.call(call)
+
+    # a success after the next cooldown closes it, and it takes the full threshold to open it again
+    clock.now += 30
+    assert gemini.call(Flaky()) == 'ok'
+    with pytest.raises(index.GeminiUnavailable):
+        gemini.call(Flaky(google_exceptions.ServiceUnavailable('busy')))
+    assert gemini.call(Flaky()) == 'ok'
@@ -0,0 +1,44 @@
+from bson import ObjectId
+
+import index
+
+
+def test_items_keep_the_outfit_order_and_deleted_ones_are_skipped(db, user):
+    user_id, _ = user
+    ids = db.clothing_items.insert_many([{'user_id': user_id, 'description': description, 'embedding': b'\0'}
+                                         for description in ('shirt', 'jeans', 'sneakers', 'cap')]).inserted_ids
+    db.clothing_items.delete_one({'_id': ids[3]})
+    outfits = [
+        {'_id': ObjectId(), 'clothing_item_ids': [str(ids[2]), str(ids[0]), str(ids[3]), str(ids[2]), 'not-an-id']},
+        {'_id': ObjectId(), 'clothing_item_ids': [str(ids[1]), str(ids[0])]},
+        {'_id': ObjectId(), 'clothing_item_ids': [str(ids[3])]},
+        {'_id': ObjectId()},
+    ]
+
+    with index.app.test_request_context():
+        hydrated = index.hydrate_outfits(outfits)
+    assert hydrated is outfits
+    assert [[item['description'] for item in outfit.get('clothing_items_list', [])] for outfit in outfits] == [
+        ['sneakers', 'shirt'], ['jeans', 'shirt'], [], []]
+    assert all(isinstance(outfit['_id'], str) for outfit in outfits)
+    first_shirt, second_shirt = outfits[0]['clothing_items_list'][1], outfits[1]['clothing_items_list'][1]
+    assert first_shirt == second_shirt and first_shirt is not second_shirt
+    assert first_shirt['_id'] == str(ids[0]) and 'embedding' not in first_shirt
+
+
+def test_items_are_loaded_once_per_request(db, user, monkeypatch):
+    user_id, _ = user
+    ids = db.clothing_items.insert_many([{'user_id': user_id, 'description': 'shirt'}, {'user_id': user_id, 'description': 'jeans'}]).inserted_ids
+    finds = []
+    find = db.clothing_items.find
+
+    def counting_find(*args, **kwargs):
+        finds.append(args[0])
+        return find(*args, **kwargs)
+    monkeypatch.setattr(db.clothing_items, 'find', counting_find)
+
+    with index.app.test_request_context():
+        index.hydrate_outfits([{'_id': ObjectId(), 'clothing_item_ids': [str(ids[0])]}])
+        index.hydrate_outfits([{'_id': ObjectId(), 'clothing_item_ids': [str(ids[0]), str(ids[1])]}])
+        index.hydrate_outfits([{'_id': ObjectId(), 'clothing_item_ids': [str(ids[1])]}])
+    assert finds == [{'_id': {'$in': [ids[0]]}}, {'_id': {'$in': [ids[1]]}}]
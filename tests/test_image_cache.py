@@ -0,0 +1,91 @@
+import io
+import json
+
+import pytest
+from PIL import Image
+
+import index
+
+
+def encode(image, format):
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+
+def photo(color):
+    image = Image.new('RGB', (64, 48), color)
+    image.paste((255, 255, 255), (16, 12, 48, 36))
+    return image
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+# the vision call; calls counts how often it was made
+@pytest.fixture
+def vision(db, monkeypatch):
+    index.image_description_cache.clear()
+    monkeypatch.setattr(index, 'image_cache_counters', {'memory_hits': 0, 'db_hits': 0, 'misses': 0})
+    calls = []
+
+    def generate_content(contents, **kwargs):
+        calls.append(contents)
+        return Response(json.dumps({'description': 'A navy cotton t-shirt with a white print.', 'category': 'shirt',
+                                    'colors': ['navy', 'white'], 'warmth': 2, 'formality': 2}))
+    monkeypatch.setattr(index.gemini_client, 'generate_content', generate_content)
+    return calls
+
+
+def tags(client, data, filename='shirt.jpg'):
+    response = client.post('/generate_tags', data={'image': (io.BytesIO(data), filename)})
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def test_reuploading_an_image_skips_the_vision_call(client, vision):
+    data = encode(photo((20, 30, 90)), 'PNG')
+    first = tags(client, data)
+    assert first['description'] == 'A navy cotton t-shirt with a white print.' and first['category'] == 'shirt'
+    assert tags(client, data, 'same-photo-again.png') == first
+    assert len(vision) == 1
+    assert index.image_cache_counters == {'memory_hits': 1, 'db_hits': 0, 'misses': 1}
+
+
+def test_the_same_pixels_in_another_format_hit_the_cache(client, vision):
+    image = photo((20, 30, 90))
+    first = tags(client, encode(image, 'PNG'))
+    assert tags(client, encode(image, 'BMP'), 'shirt.bmp')['image_hash'] == first['image_hash']
+    assert len(vision) == 1
+
+
+def test_the_saved_description_outlives_the_process_cache(client, db, vision):
+    data = encode(photo((20, 30, 90)), 'PNG')
+    first = tags(client, data)
+    index.image_description_cache.clear()
+    assert tags(client, data) == first
+    assert len(vision) == 1 and index.image_cache_counters['db_hits'] == 1
+    assert db.image_descriptions.count_documents({}) == 1
+
+
+def test_another_image_is_described(client, vision):
+    tags(client, encode(photo((20, 30, 90)), 'PNG'))
+    tags(client, encode(photo((200, 30, 30)), 'PNG'))
+    assert len(vision) == 2
+
+
+def test_adding_a_tagged_image_reuses_its_description(client, db, user, vision, monkeypatch):
+    _, headers = user
+    def no_embeddings(descriptions, task_type):
+        raise RuntimeError('embeddings are unavailable')
+    monkeypatch.setattr(index, 'embed_descriptions', no_embeddings)
+    data = encode(photo((20, 30, 90)), 'PNG')
+    tagged = tags(client, data)
+    response = client.post('/add_clothing_item', headers=headers, data={'image': (io.BytesIO(data), 'shirt.png'), 'path': 'shirt.png'})
+    assert response.status_code == 200
+    assert len(vision) == 1
+    item = db.clothing_items.find_one()
+    assert item['image_hash'] == tagged['image_hash'] and item['description'] == tagged['description']
+    assert item['colors'] == ['navy', 'white']
@@ -0,0 +1,156 @@
+import datetime
+
+import pytest
+
+import index
+
+PARAMS = {'weather_description': 'sunny', 'temperature': '20', 'day_description': 'work'}
+
+
+@pytest.fixture
+def owner(db):
+    return db.users.insert_one({'email': 'jobs@example.com', 'dob': '1990-01-01', 'gender': 'male'}).inserted_id
+
+
+# the generate runner: records the params of each run and raises the queued failures first
+class Runner:
+    def __init__(self):
+        self.calls = []
+        self.failures = []
+
+    def __call__(self, user, kind, params):
+        self.calls.append(params)
+        if self.failures:
+            raise self.failures.pop(0)
+        return {'outfit_ids': []}
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    runner = Runner()
+    monkeypatch.setitem(index.JOB_RUNNERS, 'generate', runner)
+    return runner
+
+
+def expire_lease(db, job):
+    db.jobs.update_one({'_id': job['_id']}, {'$set': {'lease_expires_at': index.utc_now() - datetime.timedelta(seconds=1)}})
+
+
+def test_identical_active_requests_share_a_job(db, owner):
+    job, created = index.enqueue_job(owner, 'generate', dict(PARAMS, **{'async': True}))
+    same, created_again = index.enqueue_job(owner, 'generate', dict(PARAMS, stream=True))
+    other, created_other = index.enqueue_job(owner, 'generate', dict(PARAMS, temperature='25'))
+    assert created and not created_again and created_other
+    assert same['_id'] == job['_id'] and other['_id'] != job['_id']
+    assert job['params'] == PARAMS
+
+
+def test_a_finished_job_is_not_reused(db, owner, runner):
+    job, _ = index.enqueue_job(owner, 'generate', PARAMS)
+    index.run_job(index.claim_job('worker-1'))
+    assert db.jobs.find_one({'_id': job['_id']})['status'] == 'done'
+    assert 'active_key' not in db.jobs.find_one({'_id': job['_id']})
+    again, created = index.enqueue_job(owner, 'generate', PARAMS)
+    assert created and again['_id'] != job['_id']
+
+
+def test_claims_the_oldest_queued_job_once(db, owner):
+    first, _ = index.enqueue_job(owner, 'generate', PARAMS)
+    second, _ = index.enqueue_job(owner, 'generate', dict(PARAMS, day_description='gym'))
+    claimed = index.claim_job('worker-1')
+    assert claimed['_id'] == first['_id'] and claimed['attempts'] == 1 and claimed['worker'] == 'worker-1'
+    assert index.claim_job('worker-2')['_id'] == second['_id']
+    assert index.claim_job('worker-3') is None
+
+
+def test_an_expired_lease_is_claimed_again_and_fences_the_first_worker(db, owner):
+    job, _ = index.enqueue_job(owner, 'generate', PARAMS)
+    stale = index.claim_job('worker-1')
+    assert index.claim_job('worker-2') is None
+    expire_lease(db, stale)
+    current = index.claim_job('worker-2')
+    assert current['_id'] == job['_id'] and current['attempts'] == 2
+
+    # the first worker finishing late changes nothing
+    index.update_claimed_job(stale, 'done', {'result': {'outfit_ids': ['stale']}})
+    assert db.jobs.find_one({'_id': job['_id']})['status'] == 'running'
+
+    index.update_claimed_job(current, 'done', {'result': {'outfit_ids': ['current']}})
+    finished = db.jobs.find_one({'_id': job['_id']})
+    assert finished['status'] == 'done' and finished['result'] == {'outfit_ids': ['current']}
+    assert 'lease_expires_at' not in finished and 'finished_at' in finished
+
+
+def test_failures_are_retried_up_to_the_limit(db, owner, runner, monkeypatch):
+    monkeypatch.setattr(index, 'JOB_MAX_ATTEMPTS', 2)
+    runner.failures = [RuntimeError('gemini down'), RuntimeError('gemini down again')]
+    job, _ = index.enqueue_job(owner, 'generate', PARAMS)
+
+    index.run_job(index.claim_job('worker-1'))
+    retried = db.jobs.find_one({'_id': job['_id']})
+    assert retried['status'] == 'queued' and retried['error'] == 'gemini down' and 'active_key' in retried
+
+    # not claimed again before its backoff passes
+    assert index.claim_job('worker-1') is None
+    db.jobs.update_one({'_id': job['_id']}, {'$set': {'not_before': index.utc_now() - datetime.timedelta(seconds=1)}})
+    index.run_job(index.claim_job('worker-1'))
+    failed = db.jobs.find_one({'_id': job['_id']})
+    assert failed['status'] == 'failed' and failed['error'] == 'gemini down again' and 'active_key' not in failed
+    assert len(runner.calls) == 2
+
+
+def test_request_errors_fail_without_a_retry(db, owner, runner):
+    runner.failures = [index.OutfitRequestError('No clothing items found for user', 404)]
+    job, _ = index.enqueue_job(owner, 'generate', PARAMS)
+    index.run_job(index.claim_job('worker-1'))
+    failed = db.jobs.find_one({'_id': job['_id']})
+    assert failed['status'] == 'failed' and failed['error_status'] == 404 and failed['attempts'] == 1
+
+
+def test_a_job_abandoned_too_often_fails_without_running(db, owner, runner, monkeypatch):
+    monkeypatch.setattr(index, 'JOB_MAX_ATTEMPTS', 1)
+    job, _ = index.enqueue_job(owner, 'generate', PARAMS)
+    expire_lease(db, index.claim_job('worker-1'))
+    index.run_job(index.claim_job('worker-2'))
+    failed = db.jobs.find_one({'_id': job['_id']})
+    assert failed['status'] == 'failed' and failed['error'] == 'The job was abandoned by its workers'
+    assert runner.calls == []
+
+
+def test_retries_back_off_exponentially_up_to_a_limit(db, owner, runner, monkeypatch):
+    monkeypatch.setattr(index, 'JOB_RETRY_BACKOFF_SECONDS', 5)
+    monkeypatch.setattr(index, 'JOB_RETRY_MAX_BACKOFF_SECONDS', 12)
+    assert [index.job_retry_backoff(attempts).total_seconds() for attempts in (1, 2, 3, 4)] == [5, 10, 12, 12]
+
+    runner.failures = [RuntimeError('gemini down')]
+    job, _ = index.enqueue_job(owner, 'generate', PARAMS)
+    before = index.utc_now()
+    index.run_job(index.claim_job('worker-1'))
+    not_before = db.jobs.find_one({'_id': job['_id']})['not_before']
+    # mongomock, like pymongo, returns naive UTC datetimes truncated to milliseconds
+    assert not_before >= (before + datetime.timedelta(seconds=5, milliseconds=-1)).replace(tzinfo=None)
+    # a job that is backing off does not hold up the others
+    other, _ = index.enqueue_job(owner, 'generate', dict(PARAMS, day_description='gym'))
+    assert index.claim_job('worker-1')['_id'] == other['_id']
+
+
+def test_async_requests_are_checked_before_they_are_queued(client, db, user):
+    user_id, headers = user
+    for route, body, status in (
+        ('/outfits/generate', dict(PARAMS, **{'async': True}), 404),
+        ('/gemini', {'prompt': 'What goes with my jeans?', 'async': True}, 404),
+    ):
+        response = client.post(route, headers=headers, json=body)
+        assert response.status_code == status and response.json['error'] == 'No clothing items found for user'
+    db.clothing_items.insert_one(index.new_clothing_item_doc(user_id, 'Blue denim jeans.', 'hash', 'jeans.jpg', 'jeans.jpg',
+                                                             index.extract_attributes('Blue denim jeans.')))
+    for route, body in (
+        ('/outfits/generate', {'temperature': '20', 'async': True}),
+        ('/outfits/generate', dict(PARAMS, mode='offline', **{'async': True})),
+        ('/gemini', {'async': True}),
+    ):
+        assert client.post(route, headers=headers, json=body).status_code == 400
+    assert db.jobs.count_documents({}) == 0
+
+    response = client.post('/outfits/generate', headers=headers, json=dict(PARAMS, **{'async': True}))
+    assert response.status_code == 202 and db.jobs.count_documents({}) == 1
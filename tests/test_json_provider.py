@@ -0,0 +1,31 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+
+import index
+
+DOCUMENT = {
+    '_id': ObjectId('66f049d6f6d2352521cf0221'),
+    'description': 'Wool scarf for 5°C mornings — «cosy»',
+    'tags': ['café', 'naïve', None, True, 3, 2.5],
+    'created_at': datetime.datetime(2024, 5, 1, 10, 0, 0),
+    'nested': {'quote': 'say "hi"\n', 'ids': [ObjectId('66f049d6f6d2352521cf0222')]},
+}
+
+
+@pytest.mark.skipif(index.orjson is None, reason='orjson is not installed')
+def test_orjson_and_json_module_write_the_same_text(monkeypatch):
+    provider = index.app.json
+    monkeypatch.setattr(index.MongoJSONProvider, 'use_orjson', True)
+    with index.app.app_context():
+        with_orjson = provider.dumps(DOCUMENT)
+        with_orjson_response = index.jsonify(DOCUMENT).get_data()
+    monkeypatch.setattr(index.MongoJSONProvider, 'use_orjson', False)
+    with index.app.app_context():
+        with_json = provider.dumps(DOCUMENT)
+        with_json_response = index.jsonify(DOCUMENT).get_data()
+    assert with_orjson == with_json
+    assert with_orjson_response == with_json_response
+    assert '5°C' in with_json and '"_id":"66f049d6f6d2352521cf0221"' in with_json
+    assert '"created_at":"Wed, 01 May 2024 10:00:00 GMT"' in with_json
@@ -0,0 +1,34 @@
+import datetime
+
+import index
+
+
+def test_the_sweep_runs_after_the_response(client, db, user, monkeypatch):
+    user_id, _ = user
+    db.clothing_items.insert_one({'user_id': user_id, 'description': 'Blue denim jeans.', 'available': False,
+                                  'available_at': index.utc_now() - datetime.timedelta(minutes=1)})
+    monkeypatch.setattr(index, '_last_laundry_sweep', index.time.monotonic() - index.LAUNDRY_SWEEP_INTERVAL_SECONDS)
+    swept_during_the_request = []
+
+    def view_checks_the_item(view):
+        def wrapper(*args, **kwargs):
+            swept_during_the_request.append(db.clothing_items.find_one()['available'])
+            return view(*args, **kwargs)
+        return wrapper
+    monkeypatch.setitem(index.app.view_functions, 'home', view_checks_the_item(index.app.view_functions['home']))
+
+    response = client.get('/', buffered=False)
+    assert response.status_code == 200 and swept_during_the_request == [False]
+    assert db.clothing_items.find_one()['available'] is False
+    response.close()
+    item = db.clothing_items.find_one()
+    assert item['available'] is True and 'available_at' not in item
+
+
+def test_the_sweep_waits_for_its_interval(client, db, user, monkeypatch):
+    user_id, _ = user
+    db.clothing_items.insert_one({'user_id': user_id, 'description': 'Blue denim jeans.', 'available': False,
+                                  'available_at': index.utc_now() - datetime.timedelta(minutes=1)})
+    monkeypatch.setattr(index, '_last_laundry_sweep', index.time.monotonic())
+    client.get('/')
+    assert db.clothing_items.find_one()['available'] is False
@@ -0,0 +1,120 @@
+import pytest
+from bson import ObjectId
+
+import index
+
+WARDROBE = {
+    'tee': 'A white cotton t-shirt.',
+    'polo': 'A navy polo shirt.',
+    'jeans': 'Blue denim jeans.',
+    'chinos': 'Beige linen chinos.',
+    'coat': 'A grey wool coat.',
+    'sneakers': 'White leather sneakers.',
+    'cap': 'A black baseball cap.',
+}
+REQUEST = {'weather_description': 'Sunny', 'temperature': '18', 'day_description': 'Walk in the park'}
+
+
+def wardrobe(**frequencies):
+    return {name: {'_id': ObjectId(), 'description': description, 'frequency': frequencies.get(name, 0)}
+            for name, description in WARDROBE.items()}
+
+
+def names(outfit, items):
+    by_id = {str(item['_id']): name for name, item in items.items()}
+    return [by_id[item_id] for item_id in outfit['clothing_item_ids']]
+
+
+def test_local_outfits_pair_one_top_with_one_bottom():
+    items = wardrobe()
+    outfits = index.generate_local_outfits(list(items.values()), '18', 'Sunny')
+    assert len(outfits) == 3
+    for outfit in outfits:
+        pieces = names(outfit, items)
+        assert len({'tee', 'polo'} & set(pieces)) == 1 and len({'jeans', 'chinos'} & set(pieces)) == 1
+        assert 'sneakers' in pieces and 'coat' not in pieces
+        assert outfit['source'] == 'local'
+    # the first two outfits do not repeat a top or a bottom
+    first, second = (set(names(outfit, items)[:2]) for outfit in outfits[:2])
+    assert not first & second
+
+
+def test_local_outfits_add_outerwear_when_cold_or_wet():
+    items = wardrobe()
+    for temperature, weather in (('2', 'Clear'), ('18', 'Light rain showers')):
+        outfits = index.generate_local_outfits(list(items.values()), temperature, weather)
+        assert all('coat' in names(outfit, items) for outfit in outfits)
+    assert 'Expect rain' in outfits[0]['styling_tips']
+
+
+def test_local_outfits_prefer_items_worn_less():
+    items = wardrobe(tee=5, jeans=5)
+    outfit = index.generate_local_outfits(list(items.values()), '18', 'Sunny')[0]
+    assert names(outfit, items)[:2] == ['polo', 'chinos']
+
+
+def test_base_items_are_part_of_every_local_outfit():
+    items = wardrobe()
+    outfits = index.generate_local_outfits(list(items.values()), '18', 'Sunny', base_items=[items['jeans']])
+    assert outfits and all(names(outfit, items)[1] == 'jeans' for outfit in outfits)
+
+
+@pytest.fixture
+def items(db, user):
+    user_id, _ = user
+    docs = [index.new_clothing_item_doc(user_id, description, name, f'{name}.jpg', f'{name}.jpg', index.extract_attributes(description))
+            for name, description in WARDROBE.items()]
+    db.clothing_items.insert_many(docs)
+    return docs
+
+
+def failing_gemini(error):
+    def query_gemini(prompt, timeout=None, system_instruction=None):
+        query_gemini.calls += 1
+        if isinstance(error, Exception):
+            raise error
+        return error
+    query_gemini.calls = 0
+    return query_gemini
+
+
+@pytest.mark.parametrize('error', [
+    index.GeminiUnavailable('breaker open'),
+    index.GeminiTimeout('deadline exceeded'),
+    {'error': 'No JSON found in response'},
+])
+def test_outfits_fall_back_to_the_local_engine(client, db, user, items, monkeypatch, error):
+    _, headers = user
+    query_gemini = failing_gemini(error)
+    monkeypatch.setattr(index, 'query_gemini', query_gemini)
+
+    response = client.post('/outfits/generate', headers=headers, json=REQUEST)
+    assert response.status_code == 200
+    assert len(response.json) == 3 and all(outfit['source'] == 'local' for outfit in response.json)
+    assert db.outfits.count_documents({}) == 3
+    # local outfits are not cached, the next request asks Gemini again
+    assert client.post('/outfits/generate', headers=headers, json=REQUEST).headers['X-Outfit-Cache'] == 'miss'
+    assert query_gemini.calls == 2
+
+
+def test_local_mode_does_not_call_gemini(client, db, user, items, monkeypatch):
+    _, headers = user
+    query_gemini = failing_gemini(AssertionError('Gemini was called'))
+    monkeypatch.setattr(index, 'query_gemini', query_gemini)
+
+    for route, extra in (('generate', {}), ('build', {'base_items_ids': [str(items[2]['_id'])]})):
+        response = client.post(f'/outfits/{route}', headers=headers, json={**REQUEST, **extra, 'mode': 'local'})
+        assert response.status_code == 200
+        assert response.json and all(outfit['source'] == 'local' for outfit in response.json)
+        assert 'X-Outfit-Cache' not in response.headers
+    assert query_gemini.calls == 0
+
+
+def test_local_mode_checks_the_profile_and_the_mode(client, db, user, items):
+    user_id, headers = user
+    assert client.post('/outfits/generate', headers=headers, json={**REQUEST, 'mode': 'offline'}).status_code == 400
+    db.users.update_one({'_id': user_id}, {'$unset': {'dob': ''}})
+    index.user_cache.clear()
+    for route, extra in (('generate', {}), ('build', {'base_items_ids': [str(items[2]['_id'])]})):
+        response = client.post(f'/outfits/{route}', headers=headers, json={**REQUEST, **extra, 'mode': 'local'})
+        assert response.status_code == 400 and response.json['error'] == 'User date of birth is required'
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import index
+
+API_DIR = os.path.dirname(index.__file__)
+
+
+def test_importing_the_app_starts_no_log_thread():
+    script = 'import threading, index; print(index._log_listener_started, threading.active_count())'
+    output = subprocess.run([sys.executable, '-c', script], cwd=API_DIR, capture_output=True, text=True, check=True,
+                            env={**os.environ, 'ENSURE_INDEXES_ON_STARTUP': '0'}).stdout.split()
+    assert output == ['False', '1']
+
+
+def test_the_first_request_starts_the_log_thread(client):
+    client.get('/')
+    assert index._log_listener_started and index.log_listener._thread.is_alive()
+
+
+def test_metrics_routes_need_the_metrics_token(client, monkeypatch):
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    for route in ('/metrics', '/cache/stats'):
+        assert client.get(route, headers={'Authorization': 'Bearer '}).status_code == 404
+
+    monkeypatch.setenv('METRICS_TOKEN', 'scrape-secret')
+    for route in ('/metrics', '/cache/stats'):
+        assert client.get(route).status_code == 401
+        assert client.get(route, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+        assert client.get(route, headers={'Authorization': 'Bearer scrape-secret'}).status_code == 200
+    assert 'outfits' in client.get('/cache/stats', headers={'Authorization': 'Bearer scrape-secret'}).json
@@ -0,0 +1,98 @@
+import pytest
+
+import index
+
+DESCRIPTIONS = ['A white cotton t-shirt.', 'Blue denim jeans.', 'White leather sneakers.', 'A grey wool jumper.']
+REQUEST = {'weather_description': 'Sunny', 'temperature': '13', 'day_description': 'Walk in the park'}
+
+
+@pytest.fixture
+def items(db, user):
+    user_id, _ = user
+    docs = [index.new_clothing_item_doc(user_id, description, f'hash-{number}', f'{number}.jpg', f'{number}.jpg',
+                                        index.extract_attributes(description))
+            for number, description in enumerate(DESCRIPTIONS)]
+    db.clothing_items.insert_many(docs)
+    return [doc['_id'] for doc in docs]
+
+
+# Gemini answers with one outfit of the first two listed items; calls holds the prompts it was asked
+@pytest.fixture
+def gemini(monkeypatch):
+    calls = []
+
+    def query_gemini(prompt, timeout=None, system_instruction=None):
+        calls.append(prompt)
+        return [{'name': f'Outfit {len(calls)}', 'clothing_item_ids': ['i1', 'i2']}]
+    monkeypatch.setattr(index, 'query_gemini', query_gemini)
+    return calls
+
+
+def generate(client, headers, **params):
+    response = client.post('/outfits/generate', headers=headers, json={**REQUEST, **params})
+    assert response.status_code == 200, response.json
+    return response
+
+
+def test_the_same_request_is_answered_from_the_cache(client, user, items, gemini):
+    _, headers = user
+    first = generate(client, headers)
+    assert first.headers['X-Outfit-Cache'] == 'miss'
+    second = generate(client, headers, weather_description='  SUNNY! ')
+    assert second.headers['X-Outfit-Cache'] == 'hit'
+    assert second.json == first.json
+    assert len(gemini) == 1
+
+
+def test_a_cleared_memory_cache_falls_back_to_the_saved_results(client, user, items, gemini):
+    _, headers = user
+    first = generate(client, headers)
+    index.outfit_cache.clear()
+    hits = index.outfit_cache_counters['db_hits']
+    second = generate(client, headers)
+    assert second.headers['X-Outfit-Cache'] == 'hit' and second.json == first.json
+    assert index.outfit_cache_counters['db_hits'] == hits + 1
+    assert len(gemini) == 1
+
+
+def test_fresh_skips_the_cache_and_replaces_the_entry(client, user, items, gemini):
+    _, headers = user
+    generate(client, headers)
+    fresh = generate(client, headers, fresh=True)
+    assert fresh.headers['X-Outfit-Cache'] == 'miss' and fresh.json[0]['name'] == 'Outfit 2'
+    assert generate(client, headers).json[0]['name'] == 'Outfit 2'
+    assert len(gemini) == 2
+
+
+def test_the_same_temperature_bucket_shares_an_entry(client, user, items, gemini):
+    _, headers = user
+    generate(client, headers, temperature='13')
+    assert generate(client, headers, temperature='14').headers['X-Outfit-Cache'] == 'hit'
+    assert generate(client, headers, temperature='24').headers['X-Outfit-Cache'] == 'miss'
+    assert len(gemini) == 2
+
+
+def test_a_wardrobe_change_misses(client, db, user, items, gemini):
+    _, headers = user
+    generate(client, headers)
+    db.clothing_items.update_one({'_id': items[0]}, {'$inc': {'frequency': 1}})
+    assert generate(client, headers).headers['X-Outfit-Cache'] == 'miss'
+    db.clothing_items.delete_one({'_id': items[3]})
+    assert generate(client, headers).headers['X-Outfit-Cache'] == 'miss'
+    assert len(gemini) == 3
+
+
+def test_a_preference_change_misses(client, user, items, gemini):
+    _, headers = user
+    generate(client, headers)
+    assert client.post('/users/preferences', headers=headers, json={'preferences': ['No sneakers']}).status_code == 200
+    assert generate(client, headers).headers['X-Outfit-Cache'] == 'miss'
+    assert len(gemini) == 2
+
+
+def test_an_archived_outfit_turns_the_entry_into_a_miss(client, db, user, items, gemini):
+    _, headers = user
+    generate(client, headers)
+    db.outfits.delete_many({})
+    assert generate(client, headers).headers['X-Outfit-Cache'] == 'miss'
+    assert len(gemini) == 2
@@ -0,0 +1,53 @@
+import datetime
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def outfits(db, user):
+    user_id, _ = user
+    item_id = db.clothing_items.insert_one(index.new_clothing_item_doc(
+        user_id, 'Blue denim jeans.', 'hash', 'jeans.jpg', 'jeans.jpg', index.extract_attributes('Blue denim jeans.'))).inserted_id
+    created_at = datetime.datetime(2024, 5, 1)
+    docs = [{'user_id': user_id, 'name': f'Outfit {number}', 'clothing_item_ids': [str(item_id)],
+             'created_at': created_at + datetime.timedelta(hours=number)} for number in range(5)]
+    db.outfits.insert_many(docs)
+    # newest first
+    return [doc['_id'] for doc in reversed(docs)]
+
+
+def test_archiving_keeps_the_newest_and_the_used_outfits(client, db, user, outfits):
+    _, headers = user
+    assert client.post(f'/outfits/use/{outfits[4]}', headers=headers).status_code == 200
+    assert index.archive_old_outfits(keep=2) == 2
+    assert {outfit['_id'] for outfit in db.outfits.find()} == {outfits[0], outfits[1], outfits[4]}
+    assert {outfit['_id'] for outfit in db.outfits_archive.find()} == {outfits[2], outfits[3]}
+    assert index.archive_old_outfits(keep=2) == 0
+
+
+def test_using_an_archived_outfit_moves_it_back(client, db, user, outfits):
+    _, headers = user
+    index.archive_old_outfits(keep=2)
+    assert client.get(f'/outfits/{outfits[3]}', headers=headers).status_code == 200
+
+    assert client.post(f'/outfits/use/{outfits[3]}', headers=headers).status_code == 200
+    restored = db.outfits.find_one({'_id': outfits[3]})
+    assert restored['used_at'] and 'archived_at' not in restored
+    assert db.outfits_archive.find_one({'_id': outfits[3]}) is None
+    # used outfits stay out of the archive
+    assert index.archive_old_outfits(keep=2) == 0
+    assert db.clothing_items.find_one()['frequency'] == 1
+
+
+def test_the_archive_cron_needs_the_cron_secret(client, db, outfits, monkeypatch):
+    monkeypatch.setattr(index, 'OUTFIT_RETENTION_RECENT', 3)
+    monkeypatch.delenv('CRON_SECRET', raising=False)
+    assert client.get('/cron/archive-outfits').status_code == 404
+
+    monkeypatch.setenv('CRON_SECRET', 'cron-secret')
+    assert client.get('/cron/archive-outfits', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    response = client.get('/cron/archive-outfits', headers={'Authorization': 'Bearer cron-secret'})
+    assert response.status_code == 200 and response.json == {'archived': 2}
+    assert db.outfits.count_documents({}) == 3
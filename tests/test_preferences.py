@@ -0,0 +1,104 @@
+import datetime
+
+import index
+
+
+def add(db, user_id, *texts):
+    return index.add_user_preferences(user_id, list(texts))
+
+
+def test_entries_are_appended_with_their_time(db, user):
+    user_id, _ = user
+    add(db, user_id, 'likes linen')
+    add(db, user_id, 'no yellow')
+    entries = db.users.find_one({'_id': user_id})['preferences']
+    assert [entry['text'] for entry in entries] == ['likes linen', 'no yellow']
+    assert all(isinstance(entry['created_at'], datetime.datetime) for entry in entries)
+
+
+def test_only_the_newest_entries_are_kept(db, user, monkeypatch):
+    user_id, _ = user
+    monkeypatch.setattr(index, 'PREFERENCES_MAX_ENTRIES', 3)
+    add(db, user_id, 'one', 'two')
+    add(db, user_id, 'three', 'four')
+    assert [entry['text'] for entry in db.users.find_one({'_id': user_id})['preferences']] == ['two', 'three', 'four']
+
+
+def test_entries_dropped_by_the_cap_leave_the_summary(db, user, monkeypatch):
+    user_id, _ = user
+    monkeypatch.setattr(index, 'PREFERENCES_MAX_ENTRIES', 3)
+    add(db, user_id, 'likes linen', 'no yellow')
+    assert add(db, user_id, 'prefers dark colors')['text'] == 'likes linen; no yellow; prefers dark colors'
+    summary = add(db, user_id, 'wears sneakers')
+    assert summary['items'] == ['wears sneakers', 'prefers dark colors', 'no yellow']
+    assert db.users.find_one({'_id': user_id})['preferences_summary'] == summary
+
+
+def test_summary_is_extended_with_the_new_entries(db, user, monkeypatch):
+    user_id, _ = user
+    add(db, user_id, 'likes linen', 'no  yellow')
+    # the incremental path only merges the new entries into the stored summary
+    merged = []
+    summarize = index.summarize_preferences
+
+    def counting_summarize(items, entries, version=0):
+        merged.append(len(entries))
+        return summarize(items, entries, version)
+
+    monkeypatch.setattr(index, 'summarize_preferences', counting_summarize)
+    summary = add(db, user_id, 'prefers dark colors', 'LIKES LINEN')
+    assert merged == [2]
+    assert summary == {'items': ['LIKES LINEN', 'prefers dark colors', 'no yellow'], 'text': 'no yellow; prefers dark colors; LIKES LINEN', 'version': 2}
+    assert db.users.find_one({'_id': user_id})['preferences_summary'] == summary
+
+
+def test_summary_keeps_the_newest_within_the_budget(db, user, monkeypatch):
+    user_id, _ = user
+    monkeypatch.setattr(index, 'PREFERENCES_TOKEN_BUDGET', 20)
+    summary = add(db, user_id, *[f'preference number {n}' for n in range(10)])
+    assert summary['items'][0] == 'preference number 9'
+    assert sum(index.estimate_tokens(text) for text in summary['items']) <= 20 < sum(index.estimate_tokens(f'preference number {n}') for n in range(10))
+
+
+def test_a_concurrent_change_rebuilds_the_summary_and_the_newest_one_wins(db, user, monkeypatch):
+    user_id, _ = user
+    add(db, user_id, 'likes linen')
+    summarize = index.summarize_preferences
+    interleaved = []
+
+    # another request adds a preference between this one's push and its summary write
+    def summarize_after_a_concurrent_add(items, entries, version=0):
+        if not interleaved:
+            interleaved.append(True)
+            add(db, user_id, 'no yellow')
+        return summarize(items, entries, version)
+
+    monkeypatch.setattr(index, 'summarize_preferences', summarize_after_a_concurrent_add)
+    add(db, user_id, 'prefers dark colors')
+
+    stored = db.users.find_one({'_id': user_id})
+    assert stored['preferences_version'] == 3
+    # the stale write of version 2 was fenced out by the summary of version 3, rebuilt from every entry
+    assert stored['preferences_summary']['version'] == 3
+    assert stored['preferences_summary']['text'] == 'likes linen; prefers dark colors; no yellow'
+
+
+def test_legacy_string_preferences_are_read_and_rebuilt(db, user):
+    user_id, _ = user
+    db.users.update_one({'_id': user_id}, {'$set': {'preferences': ['likes linen on 2024-05-01 10:00:00.123456', 'plain text']}})
+    legacy = db.users.find_one({'_id': user_id})
+    assert index.preferences_summary(legacy)['text'] == 'likes linen; plain text'
+    assert index.preference_entry(legacy['preferences'][0]) == {'text': 'likes linen', 'created_at': datetime.datetime(2024, 5, 1, 10, 0, 0, 123456)}
+
+    summary = add(db, user_id, 'no yellow')
+    assert summary['text'] == 'likes linen; plain text; no yellow' and summary['version'] == 1
+
+
+def test_route_validates_and_answers_with_the_summary(client, user):
+    _, headers = user
+    assert client.post('/users/preferences', headers=headers, json={'preferences': 'likes linen'}).status_code == 400
+    assert client.post('/users/preferences', headers=headers, json={'preferences': ['  ']}).status_code == 400
+    response = client.post('/users/preferences', headers=headers, json={'preferences': ['likes linen']})
+    assert response.status_code == 200 and response.json['summary'] == 'likes linen'
+    preferences = client.get('/users/preferences', headers=headers).json
+    assert preferences['summary'] == 'likes linen' and [entry['text'] for entry in preferences['preferences']] == ['likes linen']
@@ -0,0 +1,68 @@
+import datetime
+import io
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def tagging(monkeypatch):
+    monkeypatch.setattr(index, 'describe_clothing_image',
+                        lambda data: (data.decode(), 'A blue shirt.', index.extract_attributes('A blue shirt.')))
+
+    def no_embeddings(descriptions, task_type):
+        raise RuntimeError('embeddings are unavailable')
+    monkeypatch.setattr(index, 'embed_descriptions', no_embeddings)
+
+
+def add_item(client, headers, name):
+    response = client.post('/add_clothing_item', headers=headers,
+                           data={'image': (io.BytesIO(name.encode()), f'{name}.jpg'), 'path': f'{name}.jpg'})
+    assert response.status_code == 200, response.json
+    return index.ObjectId(response.json['id'])
+
+
+def test_matching_if_none_match_is_answered_with_304(client, user, tagging):
+    _, headers = user
+    add_item(client, headers, 'shirt')
+    first = client.get('/wardrobe', headers=headers)
+    assert first.status_code == 200 and len(first.json) == 1
+
+    second = client.get('/wardrobe', headers={**headers, 'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert client.get('/wardrobe', headers={**headers, 'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_adding_an_item_changes_the_etag(client, user, tagging):
+    _, headers = user
+    add_item(client, headers, 'shirt')
+    etag = client.get('/wardrobe', headers=headers).headers['ETag']
+    add_item(client, headers, 'trousers')
+
+    response = client.get('/wardrobe', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200 and len(response.json) == 2
+    assert response.headers['ETag'] != etag
+
+
+def test_using_an_outfit_and_the_laundry_timeout_change_the_etag(client, db, user, tagging, monkeypatch):
+    user_id, headers = user
+    item_id = add_item(client, headers, 'shirt')
+    outfit_id = db.outfits.insert_one({'user_id': user_id, 'clothing_item_ids': [str(item_id)],
+                                       'created_at': index.utc_now()}).inserted_id
+    etag = client.get('/wardrobe', headers=headers).headers['ETag']
+
+    assert client.post(f'/outfits/use/{outfit_id}', headers=headers).status_code == 200
+    response = client.get('/wardrobe', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200 and response.json[0]['available'] is False
+    used_etag = response.headers['ETag']
+    assert used_etag != etag
+    assert client.get('/wardrobe', headers={**headers, 'If-None-Match': used_etag}).status_code == 304
+
+    # no write happens when the timeout passes, the version still moves on
+    later = index.utc_now() + index.LAUNDRY_TIMEOUT + datetime.timedelta(minutes=1)
+    monkeypatch.setattr(index, 'utc_now', lambda: later)
+    response = client.get('/wardrobe', headers={**headers, 'If-None-Match': used_etag})
+    assert response.status_code == 200 and response.json[0]['available'] is True
+    assert response.headers['ETag'] not in (etag, used_etag)
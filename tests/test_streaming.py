@@ -0,0 +1,98 @@
+import datetime
+import json
+
+import pytest
+
+import index
+
+OUTFITS = [
+    {'name': 'Office {smart} "casual" ]', 'clothing_item_ids': ['i1', 'i2'], 'extra': {'nested': [1, {'x': '\\'}]}},
+    {'name': 'Weekend', 'clothing_item_ids': ['i3']},
+]
+
+
+def parse(text, size):
+    parser = index.JSONArrayStream()
+    objects = []
+    for start in range(0, len(text), size):
+        objects += parser.feed(text[start:start + size])
+    return objects
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 64, 100000])
+@pytest.mark.parametrize('text', [
+    json.dumps(OUTFITS),
+    '```json\n' + json.dumps(OUTFITS, indent=2) + '\n```',
+    'Sure! Here are [3] outfits for you: ```json\n' + json.dumps(OUTFITS) + '\n```',
+    'Options [a], [b] and [ ] below.\n```json' + json.dumps(OUTFITS) + '```\nThe [brackets] after it are ignored [{"name": "no"}]',
+    'Here you go: ' + json.dumps(OUTFITS) + ' and that is [all].',
+])
+def test_objects_of_the_array_in_any_pieces(text, size):
+    assert parse(text, size) == OUTFITS
+
+
+def test_invalid_objects_are_skipped():
+    assert parse('```json\n[{"name": "a"}, {"name": bad}, {"name": "c"}]\n```', 3) == [{'name': 'a'}, {'name': 'c'}]
+
+
+def test_no_array_gives_no_objects():
+    assert parse('I could not find anything [sorry].', 4) == []
+    assert parse('```json\n[]\n```', 1) == []
+
+
+def test_streamed_outfits_resolve_aliases(monkeypatch):
+    answer = 'Here are [3] outfits:\n```json\n' + json.dumps([{'name': 'a', 'clothing_item_ids': ['i1', 'i9']}]) + '\n```'
+    monkeypatch.setattr(index.gemini_client, 'stream_content',
+                        lambda contents, **kwargs: iter([answer[start:start + 7] for start in range(0, len(answer), 7)]))
+    prompt = index.PromptBuilder('generate', index.OUTFIT_SYSTEM_PROMPT)
+    prompt.alias('66f049d6f6d2352521cf0221')
+    outfits = list(index.stream_gemini_outfits(lambda: prompt))
+    assert outfits == [{'name': 'a', 'clothing_item_ids': ['66f049d6f6d2352521cf0221']}]
+
+
+@pytest.fixture
+def wardrobe(db, user):
+    user_id, _ = user
+    for number, description in enumerate(['A white cotton t-shirt.', 'Blue denim jeans.', 'White leather sneakers.']):
+        db.clothing_items.insert_one(index.new_clothing_item_doc(user_id, description, f'hash-{number}', f'{number}.jpg',
+                                                                 f'{number}.jpg', index.extract_attributes(description)))
+
+
+def stream_answer(monkeypatch, count):
+    answer = '```json\n' + json.dumps([{'name': f'Outfit {n}', 'clothing_item_ids': ['i1', 'i2']} for n in range(count)]) + '\n```'
+    monkeypatch.setattr(index.gemini_client, 'stream_content',
+                        lambda contents, **kwargs: iter([answer[start:start + 16] for start in range(0, len(answer), 16)]))
+
+
+def events(response):
+    return [json.loads(block.split('\ndata: ')[1]) for block in response.get_data(as_text=True).strip().split('\n\n')]
+
+
+def test_streamed_outfits_are_recorded_once_at_the_end(client, db, user, wardrobe, monkeypatch):
+    user_id, headers = user
+    stream_answer(monkeypatch, 3)
+    before = index.utc_now().replace(tzinfo=None)
+    response = client.post('/outfits/generate', headers=headers, json={'weather_description': 'Sunny', 'temperature': '20', 'stream': True})
+    assert [event.get('name') for event in events(response)] == ['Outfit 0', 'Outfit 1', 'Outfit 2', None]
+
+    # one version bump and one push for the whole stream
+    assert db.user_versions.find_one({'_id': user_id})['version'] == 1
+    recent = db.recent_outfits.find_one({'_id': user_id})['outfits']
+    assert [outfit['name'] for outfit in recent] == ['Outfit 2', 'Outfit 1', 'Outfit 0']
+    assert all(isinstance(outfit['_id'], index.ObjectId) for outfit in recent)
+    # saved with the UTC time the stream started
+    created_at = {outfit['created_at'] for outfit in db.outfits.find()}
+    assert len(created_at) == 1 and abs(created_at.pop() - before) < datetime.timedelta(minutes=1)
+
+
+def test_outfits_sent_before_the_client_leaves_are_recorded(client, db, user, wardrobe, monkeypatch):
+    user_id, headers = user
+    stream_answer(monkeypatch, 3)
+    response = client.post('/outfits/generate', headers=headers, json={'weather_description': 'Sunny', 'temperature': '20', 'stream': True},
+                           buffered=False)
+    next(response.response)
+    response.close()
+
+    assert db.outfits.count_documents({}) == 1
+    assert [outfit['name'] for outfit in db.recent_outfits.find_one({'_id': user_id})['outfits']] == ['Outfit 0']
+    assert db.user_versions.find_one({'_id': user_id})['version'] == 1
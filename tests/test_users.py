@@ -0,0 +1,16 @@
+SIGNUP = {'email': 'someone@example.com', 'password': 'secret', 'name': 'Someone', 'gender': 'male', 'dob': '1990-01-01'}
+
+
+def test_duplicate_signup_is_rejected(client, db):
+    assert client.post('/users/signup', json=SIGNUP).status_code == 200
+    response = client.post('/users/signup', json=dict(SIGNUP, name='Someone else'))
+    assert response.status_code == 400 and response.json['error'] == 'User with email already exists'
+    assert db.users.count_documents({'email': SIGNUP['email']}) == 1
+
+
+def test_deleted_users_token_stops_working(client, user):
+    _, headers = user
+    assert client.get('/wardrobe', headers=headers).status_code == 200
+    assert client.delete('/users/profile', headers=headers).status_code == 200
+    assert client.get('/wardrobe', headers=headers).status_code == 404
+    assert client.get('/outfits/recent', headers=headers).status_code == 404
@@ -0,0 +1,113 @@
+import datetime
+import json
+
+import pytest
+from bson import ObjectId
+
+import index
+
+DESCRIPTIONS = ['A white cotton t-shirt.', 'Blue denim jeans.', 'A grey wool coat.', 'White leather sneakers.',
+                'A black baseball cap.', 'A red summer dress.', 'A navy polo shirt.']
+CREATED_AT = datetime.datetime(2024, 5, 1, 12, 0)
+
+
+# seven items; the first four share created_at, so their order comes from _id alone
+@pytest.fixture
+def items(db, user):
+    user_id, _ = user
+    docs = []
+    for number, description in enumerate(DESCRIPTIONS):
+        doc = index.new_clothing_item_doc(user_id, description, f'hash-{number}', f'{number}.jpg', f'{number}.jpg',
+                                          index.extract_attributes(description))
+        doc.update(_id=ObjectId(), created_at=CREATED_AT + datetime.timedelta(minutes=max(number - 3, 0)),
+                   frequency=number, embedding=b'\0' * 8)
+        docs.append(doc)
+    # inserted out of order
+    db.clothing_items.insert_many(list(reversed(docs)))
+    return [str(doc['_id']) for doc in sorted(docs, key=lambda doc: (doc['created_at'], doc['_id']))]
+
+
+def pages(client, headers, **params):
+    cursor, ids = None, []
+    while True:
+        response = client.get('/wardrobe', headers=headers, query_string={**params, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200, response.json
+        ids.append([item['_id'] for item in response.json])
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return ids
+
+
+def test_cursor_pages_cover_every_item_once_in_order(client, user, items):
+    _, headers = user
+    assert pages(client, headers, limit=2) == [items[0:2], items[2:4], items[4:6], items[6:7]]
+    assert pages(client, headers, limit=3) == [items[0:3], items[3:6], items[6:7]]
+    # a page that ends on the last item has no next cursor
+    assert pages(client, headers, limit=7) == [items]
+
+
+def test_unpaginated_reads_return_everything_without_embeddings(client, user, items):
+    _, headers = user
+    response = client.get('/wardrobe', headers=headers)
+    assert [item['_id'] for item in response.json] == items
+    assert 'X-Next-Cursor' not in response.headers
+    assert all('embedding' not in item for item in response.json)
+
+
+def test_fields_projection_keeps_the_sort_keys(client, user, items):
+    _, headers = user
+    response = client.get('/wardrobe', headers=headers, query_string={'fields': 'description,embedding', 'limit': 2})
+    assert [set(item) for item in response.json] == [{'_id', 'description', 'created_at'}] * 2
+    cursor = response.headers['X-Next-Cursor']
+    next_page = client.get('/wardrobe', headers=headers, query_string={'fields': 'description', 'limit': 2, 'cursor': cursor})
+    assert [item['_id'] for item in next_page.json] == items[2:4]
+
+
+def test_filters(client, db, user, items):
+    _, headers = user
+
+    def ids(**params):
+        return [item['_id'] for item in client.get('/wardrobe', headers=headers, query_string=params).json]
+
+    assert ids(min_frequency=2, max_frequency=4) == [item_id for item_id in items
+                                                     if 2 <= db.clothing_items.find_one({'_id': ObjectId(item_id)})['frequency'] <= 4]
+    shirts = [str(item['_id']) for item in db.clothing_items.find({'category': 'shirt'})]
+    assert sorted(ids(category='shirt')) == sorted(shirts) and len(shirts) == 2
+    assert sorted(ids(category='shirt, Footwear')) == sorted(shirts + [str(db.clothing_items.find_one({'category': 'footwear'})['_id'])])
+    assert all(item['warmth'] >= 4 for item in client.get('/wardrobe', headers=headers, query_string={'min_warmth': 4}).json)
+
+    db.clothing_items.update_one({'_id': ObjectId(items[0])}, {'$set': {
+        'available': False, 'available_at': index.utc_now() + datetime.timedelta(hours=1)}})
+    assert ids(available='false') == [items[0]]
+    assert ids(available='true') == items[1:]
+    # the filters combine with the cursor
+    first = client.get('/wardrobe', headers=headers, query_string={'available': 'true', 'limit': 3})
+    rest = client.get('/wardrobe', headers=headers, query_string={'available': 'true', 'cursor': first.headers['X-Next-Cursor']})
+    assert [item['_id'] for item in first.json + rest.json] == items[1:]
+
+
+@pytest.mark.parametrize('params', [
+    {'available': 'maybe'}, {'category': 'hats'}, {'limit': 0}, {'limit': index.WARDROBE_MAX_PAGE_SIZE + 1},
+    {'limit': 'ten'}, {'cursor': 'not-a-cursor'},
+])
+def test_invalid_queries_are_rejected(client, user, items, params):
+    _, headers = user
+    assert client.get('/wardrobe', headers=headers, query_string=params).status_code == 400
+
+
+def test_ndjson_pages_end_with_the_next_cursor(client, user, items):
+    _, headers = user
+    ids, cursor = [], None
+    while True:
+        response = client.get('/wardrobe', headers=headers,
+                              query_string={'format': 'ndjson', 'limit': 3, **({'cursor': cursor} if cursor else {})})
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        cursor = lines[-1].get('next_cursor')
+        if cursor:
+            assert list(lines[-1]) == ['next_cursor']
+            lines = lines[:-1]
+        ids += [line['_id'] for line in lines]
+        if not cursor:
+            break
+    assert ids == items
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+import index
+
+SUMMARY = {'weather_description': 'Warm and humid', 'temperature': 31}
+
+
+# fetch_weather_summary that blocks until released; calls holds the locations it was asked for
+class Upstream:
+    def __init__(self, result=SUMMARY):
+        self.result = result
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, location):
+        self.calls.append(location)
+        self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return dict(self.result)
+
+
+@pytest.fixture
+def upstream(db, monkeypatch):
+    index.weather_cache.clear()
+    monkeypatch.setattr(index, 'weather_cache_counters', {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'coalesced': 0})
+    upstream = Upstream()
+    monkeypatch.setattr(index, 'fetch_weather_summary', upstream)
+    return upstream
+
+
+# calls get_weather_summary for every location at once, one thread each; returns what each got (or raised)
+def concurrently(upstream, locations):
+    results = [None] * len(locations)
+
+    def call(position, location):
+        try:
+            results[position] = index.get_weather_summary(location)
+        except Exception as e:
+            results[position] = e
+
+    threads = [threading.Thread(target=call, args=(position, location)) for position, location in enumerate(locations)]
+    for thread in threads:
+        thread.start()
+    # the first caller is fetching; wait until every other one is waiting for it
+    deadline = time.monotonic() + 5
+    while index.weather_cache_counters['coalesced'] < len(locations) - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    upstream.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_requests_for_a_location_share_one_upstream_call(db, upstream):
+    results = concurrently(upstream, ['Chennai', 'chennai', '  CHENNAI ', 'Chennai'] * 2)
+    assert len(upstream.calls) == 1
+    assert results == [SUMMARY] * 8
+    assert index.weather_cache_counters == {'memory_hits': 0, 'db_hits': 0, 'misses': 1, 'coalesced': 7}
+
+    # then it is cached, in memory and in mongo
+    assert index.get_weather_summary('chennai') == SUMMARY
+    index.weather_cache.clear()
+    assert index.get_weather_summary('chennai') == SUMMARY
+    assert len(upstream.calls) == 1
+    assert db.weather_summaries.count_documents({}) == 1
+
+
+def test_a_failed_call_fails_every_waiter_and_is_not_cached(db, upstream):
+    upstream.result = index.WeatherUnavailable('city not found')
+    results = concurrently(upstream, ['Atlantis'] * 4)
+    assert len(upstream.calls) == 1
+    assert all(isinstance(result, index.WeatherUnavailable) for result in results)
+    assert index._inflight == {}
+
+    upstream.result = SUMMARY
+    upstream.release.set()
+    assert index.get_weather_summary('Atlantis') == SUMMARY
+    assert len(upstream.calls) == 2
+
+
+def test_different_locations_are_fetched_separately(db, upstream):
+    upstream.release.set()
+    assert index.get_weather_summary('Chennai') == index.get_weather_summary('Mumbai') == SUMMARY
+    assert upstream.calls == ['Chennai', 'Mumbai']
+
+
+def test_the_route_answers_with_the_summary(client, user, upstream):
+    _, headers = user
+    upstream.release.set()
+    response = client.post('/get_weather', headers=headers, json={'location': 'Chennai'})
+    assert response.json == SUMMARY
+    assert client.post('/get_weather', headers=headers, json={}).status_code == 400